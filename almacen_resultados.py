@@ -0,0 +1,195 @@
+# almacen_resultados.py
+# Histórico de análisis de tiempos de calificación en Parquet, particionado por curso y tarea:
+#
+#   <directorio>/course_id=<curso>/assignment_id=<tarea>/<ejecucion>.parquet
+#   <directorio>/_ejecuciones/<ejecucion>.json   (fecha, tareas y filas de cada ejecución)
+#
+# Cada análisis de la pestaña 2 es una "ejecución" (run_id) y escribe un archivo por tarea. Las
+# lecturas usan pyarrow.dataset con mmap: solo se leen las columnas pedidas, los filtros por curso,
+# tarea o ejecución descartan directorios/archivos enteros y el de latencia se aplica por row group
+# (estadísticas min/max de Parquet) antes de materializar nada en pandas.
+#
+# Requiere pyarrow (pip install pyarrow); sin él get_almacen_resultados() devuelve None y la app
+# funciona igual, sin histórico.
+import json
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from analisis_tiempos import SEGUNDOS_POR_DIA, formatear_timestamps
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+    import pyarrow.parquet as pq
+except ImportError: # Dependencia opcional
+    pa = None
+
+# Directorio por defecto del histórico; se puede cambiar con MOODLE_RESULTADOS_DIR
+RESULTADOS_DIR_POR_DEFECTO = os.environ.get("MOODLE_RESULTADOS_DIR", ".resultados_moodle")
+
+# Valor de la partición course_id cuando no se conoce el curso de una tarea
+CURSO_DESCONOCIDO = -1
+
+# Manifiestos por ejecución; el prefijo "_" hace que pyarrow.dataset no los trate como datos
+DIR_EJECUCIONES = "_ejecuciones"
+COLUMNAS_EJECUCIONES = ["run_id", "analizado_ts", "tareas", "filas"]
+
+# Columnas que se leen para el reporte de retrasos histórico (proyección)
+COLUMNAS_REPORTE = ["run_id", "analizado_ts", "course_id", "assignment_id", "assignment_name",
+                    "student_name", "submission_date_ts", "graded_date_ts", "time_to_grade_s"]
+
+if pa is not None:
+    # Esquema explícito de cada archivo (las columnas de partición van en la ruta, no en el archivo):
+    # así tablas vacías o con columnas todo-nulas no producen tipos distintos entre archivos.
+    ESQUEMA_ARCHIVO = pa.schema([
+        ("run_id", pa.dictionary(pa.int32(), pa.string())),
+        ("analizado_ts", pa.int64()),
+        ("assignment_name", pa.dictionary(pa.int32(), pa.string())),
+        ("user_id", pa.int64()),
+        ("student_name", pa.string()),
+        ("submission_status", pa.dictionary(pa.int32(), pa.string())),
+        ("submission_date_ts", pa.int64()),
+        ("graded_date_ts", pa.int64()),
+        ("grade", pa.float64()),
+        ("estado", pa.dictionary(pa.int32(), pa.string())),
+        ("time_to_grade_s", pa.int64()),
+    ])
+    PARTICIONADO = ds.partitioning(pa.schema([("course_id", pa.int64()), ("assignment_id", pa.int64())]),
+                                   flavor="hive")
+
+
+class AlmacenResultados:
+    """
+    Histórico de análisis en Parquet particionado (ver cabecera del módulo). Escribir es
+    seguro entre hilos y procesos: cada ejecución escribe archivos nuevos con nombre único.
+    """
+
+    def __init__(self, directorio=RESULTADOS_DIR_POR_DEFECTO):
+        if pa is None:
+            raise ImportError("El histórico de resultados requiere pyarrow: pip install pyarrow")
+        os.makedirs(os.path.join(directorio, DIR_EJECUCIONES), exist_ok=True)
+        self.directorio = directorio
+        self._fs = pyarrow.fs.LocalFileSystem(use_mmap=True)
+        self._manifiestos = {} # nombre de archivo -> manifiesto ya leído (no cambian una vez escritos)
+        self._lock = threading.Lock()
+
+    def guardar(self, analisis_por_tarea, curso_por_tarea=None, nombres_tareas=None):
+        """
+        Escribe un análisis completo ({assignid: tabla de análisis}) como una nueva ejecución y
+        devuelve su run_id. Los nombres de tarea se guardan para poder reportar sin la sesión.
+        El manifiesto de la ejecución se escribe al final: solo se lista una vez completa.
+        """
+        curso_por_tarea = curso_por_tarea or {}
+        nombres_tareas = nombres_tareas or {}
+        run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        analizado_ts = int(time.time())
+        for assignid, df in analisis_por_tarea.items():
+            curso = curso_por_tarea.get(assignid)
+            ruta = os.path.join(self.directorio, f"course_id={CURSO_DESCONOCIDO if curso is None else int(curso)}",
+                                f"assignment_id={int(assignid)}")
+            os.makedirs(ruta, exist_ok=True)
+            columnas = {c: df[c] for c in ESQUEMA_ARCHIVO.names if c in df.columns}
+            tabla = pa.Table.from_pandas(pd.DataFrame({
+                "run_id": run_id,
+                "analizado_ts": analizado_ts,
+                "assignment_name": nombres_tareas.get(assignid, f"Tarea ID: {assignid}"),
+                **{c: s.astype(object) if s.dtype == "category" else s for c, s in columnas.items()},
+            }, index=range(len(df))), schema=ESQUEMA_ARCHIVO, preserve_index=False)
+            # Escritura atómica: el temporal empieza por "." y pyarrow.dataset lo ignora al listar
+            temporal = os.path.join(ruta, f".{run_id}.parquet.tmp")
+            pq.write_table(tabla, temporal, compression="zstd")
+            os.replace(temporal, os.path.join(ruta, f"{run_id}.parquet"))
+        # Las tareas se cuentan aquí: las vacías no dejan filas de las que contarlas después
+        manifiesto = {"run_id": run_id, "analizado_ts": analizado_ts, "tareas": len(analisis_por_tarea),
+                      "filas": int(sum(len(df) for df in analisis_por_tarea.values()))}
+        ruta = os.path.join(self.directorio, DIR_EJECUCIONES)
+        with open(os.path.join(ruta, f".{run_id}.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(manifiesto, f)
+        os.replace(os.path.join(ruta, f".{run_id}.json.tmp"), os.path.join(ruta, f"{run_id}.json"))
+        return run_id
+
+    def _dataset(self):
+        return ds.dataset(self.directorio, format="parquet", partitioning=PARTICIONADO, filesystem=self._fs)
+
+    def leer(self, columnas=None, ejecuciones=None, cursos=None, tareas=None, retraso_min_dias=None):
+        """
+        pyarrow.Table con las `columnas` pedidas (todas si None) de las filas que cumplen los
+        filtros: ejecuciones (run_id), cursos, tareas y latencia > retraso_min_dias.
+        """
+        condiciones = []
+        if ejecuciones is not None:
+            condiciones.append(ds.field("run_id").isin(list(ejecuciones)))
+        if cursos is not None:
+            condiciones.append(ds.field("course_id").isin([int(c) for c in cursos]))
+        if tareas is not None:
+            condiciones.append(ds.field("assignment_id").isin([int(t) for t in tareas]))
+        if retraso_min_dias is not None:
+            condiciones.append(ds.field("time_to_grade_s") > retraso_min_dias * SEGUNDOS_POR_DIA)
+        filtro = None
+        for condicion in condiciones:
+            filtro = condicion if filtro is None else filtro & condicion
+        return self._dataset().to_table(columns=columnas, filter=filtro)
+
+    def ejecuciones(self):
+        """
+        DataFrame con una fila por ejecución guardada (más reciente primero): fecha, tareas y
+        filas. Sale de los manifiestos de _ejecuciones/, sin leer el histórico; cada manifiesto
+        se lee una sola vez.
+        """
+        ruta = os.path.join(self.directorio, DIR_EJECUCIONES)
+        nombres = [n for n in os.listdir(ruta) if n.endswith(".json") and not n.startswith(".")]
+        with self._lock:
+            for nombre in nombres:
+                if nombre not in self._manifiestos:
+                    with open(os.path.join(ruta, nombre), encoding="utf-8") as f:
+                        self._manifiestos[nombre] = json.load(f)
+            manifiestos = [self._manifiestos[n] for n in nombres]
+        return (pd.DataFrame(manifiestos, columns=COLUMNAS_EJECUCIONES)
+                .sort_values("analizado_ts", ascending=False, ignore_index=True))
+
+    def reporte_retrasos(self, umbral_dias, ejecuciones=None, cursos=None):
+        """
+        Reporte de retrasos sobre ejecuciones guardadas, leyendo solo las filas por encima del
+        umbral. Devuelve (resumen: una fila por ejecución y tarea con el número de retrasados,
+        detalle con textos formateados, de mayor a menor retraso).
+        """
+        tabla = self.leer(COLUMNAS_REPORTE, ejecuciones=ejecuciones, cursos=cursos, retraso_min_dias=umbral_dias)
+        if tabla.num_rows == 0:
+            return pd.DataFrame(), pd.DataFrame()
+        df = tabla.to_pandas()
+        df["Ejecución"] = formatear_timestamps(df["analizado_ts"])
+        df = df.sort_values(["analizado_ts", "time_to_grade_s"], ascending=False, ignore_index=True)
+        resumen = (df.groupby(["Ejecución", "run_id", "course_id", "assignment_name"], observed=True, sort=False)
+                   .size().rename("Retrasados").reset_index()
+                   .rename(columns={"course_id": "Curso", "assignment_name": "Tarea"}))
+        detalle = pd.DataFrame({
+            "Ejecución": df["Ejecución"],
+            "Curso": df["course_id"],
+            "Tarea": df["assignment_name"].astype(object),
+            "Estudiante": df["student_name"],
+            "Fecha Envío": formatear_timestamps(df["submission_date_ts"].astype("float64")),
+            "Fecha Calificación": formatear_timestamps(df["graded_date_ts"].astype("float64")),
+            "Días de Retraso (Profesor)": (df["time_to_grade_s"] / SEGUNDOS_POR_DIA).round(1),
+        })
+        return resumen.drop(columns="run_id"), detalle
+
+
+_almacen_resultados = None
+_almacen_lock = threading.Lock()
+
+
+def get_almacen_resultados():
+    """AlmacenResultados compartido (creado en el primer uso), o None si pyarrow no está instalado."""
+    global _almacen_resultados
+    if pa is None:
+        return None
+    if _almacen_resultados is None:
+        with _almacen_lock:
+            if _almacen_resultados is None:
+                _almacen_resultados = AlmacenResultados()
+    return _almacen_resultados
@@ -0,0 +1,332 @@
+# analisis_tiempos.py
+# Cruce vectorizado (pandas) de participantes, submisiones y calificaciones de una tarea.
+from array import array
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from moodle_stream import CAMPOS_CALIFICACION, CAMPOS_SUBMISION, RegistrosColumnares
+
+SEGUNDOS_POR_DIA = 24 * 60 * 60
+
+# Estados de envío que cuentan como "el estudiante envió"
+ESTADOS_ENVIADOS = ("submitted", "graded")
+
+
+def _offsets_locales(ts):
+    """
+    Desfase UTC -> hora local (segundos) para cada timestamp. Se calcula una vez por hora
+    distinta (los cambios de horario ocurren en horas en punto), no una vez por fila.
+    """
+    horas = (ts // 3600).astype("int64")
+    offsets = {h: datetime.fromtimestamp(h * 3600).astimezone().utcoffset().total_seconds()
+               for h in horas.unique()}
+    return horas.map(offsets)
+
+
+def formatear_timestamps(ts, short_format=False):
+    """Versión vectorizada de timestamp_to_datetime_str: epoch (hora local) -> texto, 'N/A' si falta o es <= 0."""
+    ts = pd.to_numeric(ts, errors="coerce")
+    validos = ts[ts > 0]
+    texto = pd.Series("N/A", index=ts.index, dtype=object)
+    if not validos.empty:
+        fechas_locales = pd.to_datetime(validos + _offsets_locales(validos), unit="s")
+        texto[validos.index] = fechas_locales.dt.strftime("%Y-%m-%d" if short_format else "%Y-%m-%d %H:%M:%S")
+    return texto
+
+
+def _parte_duracion(n, singular, plural):
+    n = n.astype("int64")
+    return np.where(n > 0, n.astype(str) + np.where(n == 1, singular, plural), "")
+
+
+def formatear_duraciones(segundos):
+    """Versión vectorizada del texto de calculate_time_difference a partir de segundos (>= 0)."""
+    segundos = segundos.astype("int64")
+    partes = pd.DataFrame({
+        "d": _parte_duracion(segundos // SEGUNDOS_POR_DIA, " día", " días"),
+        "h": _parte_duracion((segundos % SEGUNDOS_POR_DIA) // 3600, " hora", " horas"),
+        "m": _parte_duracion((segundos % 3600) // 60, " minuto", " minutos"),
+    }, index=segundos.index)
+    texto = (partes["d"] + ", " + partes["h"] + ", " + partes["m"]).astype(object)
+    texto = texto.str.replace(r"(, )+", ", ", regex=True).str.strip(", ")
+    return texto.where(texto != "", "Menos de un minuto")
+
+
+def _ultimo_por_usuario(registros, columnas):
+    """
+    DataFrame con un registro por userid (el último de la lista, como hacía el cruce con dicts).
+    `registros` pueden ser dicts completos de Moodle, tuplas en el orden de `columnas` o un
+    RegistrosColumnares (sus columnas se usan directamente, sin pasar por objetos por registro).
+    """
+    if isinstance(registros, RegistrosColumnares) and registros:
+        datos = registros.como_dict()
+        df = pd.DataFrame({c: np.frombuffer(datos[c], dtype=np.int64) if isinstance(datos[c], array) else datos[c]
+                           for c in columnas})
+    elif registros:
+        df = pd.DataFrame.from_records(registros, columns=columnas)
+    else:
+        df = pd.DataFrame(columns=columnas)
+    df = df[df["userid"].notna() & (df["userid"] != 0)]
+    return df.drop_duplicates("userid", keep="last")
+
+
+# Estado de calificación de cada participante (columna categórica del análisis)
+ESTADO_CALIFICADO = "Calificado"
+ESTADOS_CALIFICACION = [
+    ESTADO_CALIFICADO,
+    "Calificado antes del envío",
+    "Pendiente de calificar",
+    "Calificado sin envío",
+    "No ha enviado",
+]
+
+# Esquema de la tabla columnar que devuelve el análisis (una fila por participante)
+COLUMNAS_ANALISIS = {
+    "user_id":            "int64",
+    "student_name":       "object",
+    "submission_status":  "category",
+    "submission_date_ts": "Int64",   # epoch en segundos, <NA> si no envió
+    "graded_date_ts":     "Int64",   # epoch en segundos, <NA> si no hay calificación
+    "grade":              "float64", # NaN si no hay nota
+    "estado":             pd.CategoricalDtype(ESTADOS_CALIFICACION),
+    "time_to_grade_s":    "Int64",   # segundos entre envío y calificación, <NA> si no aplica
+}
+
+
+def tabla_vacia(assignid=None):
+    """Tabla de análisis sin filas pero con el esquema de COLUMNAS_ANALISIS."""
+    df = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in COLUMNAS_ANALISIS.items()})
+    df.attrs["assignment_id"] = assignid
+    return df
+
+
+def marcar_error(df):
+    """
+    Marca una tabla de análisis como fallida (df.attrs["error"]): alguna descarga de su tarea
+    falló, así que está vacía o incompleta y no debe guardarse en cachés ni almacenes.
+    """
+    df.attrs["error"] = True
+    return df
+
+
+def es_error(df):
+    """True si la tabla viene de un análisis fallido (ver marcar_error), no de una tarea sin datos."""
+    return bool(df.attrs.get("error"))
+
+
+def cruzar_datos_analisis_df(assignid, participantes, submisiones, calificaciones):
+    """
+    Cruza los datos de una tarea con merges de pandas y clasifica cada participante con
+    condiciones vectorizadas. Devuelve una tabla columnar tipada (ver COLUMNAS_ANALISIS)
+    con una fila por participante, en el orden de `participantes`. El assignid no se repite
+    por fila: queda en df.attrs["assignment_id"]. Los textos para mostrar se generan
+    después, con formatear_para_mostrar, solo para las filas que se muestran.
+    """
+    if not participantes:
+        return tabla_vacia(assignid)
+
+    df = pd.DataFrame({
+        "user_id": pd.Series(list(participantes.keys()), dtype="int64"),
+        "student_name": pd.Series(list(participantes.values()), dtype=object),
+    })
+
+    subs = _ultimo_por_usuario(submisiones, list(CAMPOS_SUBMISION)).rename(
+        columns={"userid": "user_id", "status": "submission_status", "timemodified": "submission_time"})
+    grades = _ultimo_por_usuario(calificaciones, list(CAMPOS_CALIFICACION)).rename(
+        columns={"userid": "user_id", "timemodified": "graded_time"})
+    for parcial in (subs, grades):
+        parcial["user_id"] = parcial["user_id"].astype("int64")
+
+    df = df.merge(subs, on="user_id", how="left").merge(grades, on="user_id", how="left")
+
+    # Solo cuenta como envío si el estado es submitted/graded y el timestamp no es 0/nulo
+    enviado = df["submission_status"].isin(ESTADOS_ENVIADOS)
+    sub_ts = pd.to_numeric(df["submission_time"], errors="coerce").where(enviado)
+    sub_ts = sub_ts.where(sub_ts != 0)
+    graded_ts = pd.to_numeric(df["graded_time"], errors="coerce")
+    graded_ts = graded_ts.where(graded_ts != 0)
+    con_envio = sub_ts.notna()
+    con_calificacion = graded_ts.notna()
+    con_nota = df["grade"].notna()
+
+    ambos = con_envio & con_calificacion
+    time_to_grade_s = (graded_ts - sub_ts).where(ambos)
+
+    # np.select toma la primera condición que se cumple, por eso el orden importa
+    estado = np.select(
+        [ambos & (time_to_grade_s < 0), ambos, con_envio, con_nota],
+        ["Calificado antes del envío", ESTADO_CALIFICADO, "Pendiente de calificar", "Calificado sin envío"],
+        default="No ha enviado",
+    )
+
+    resultado = pd.DataFrame({
+        "user_id":            df["user_id"],
+        "student_name":       df["student_name"],
+        "submission_status":  df["submission_status"].astype("category"),
+        "submission_date_ts": sub_ts.astype("Int64"),
+        "graded_date_ts":     graded_ts.astype("Int64"),
+        "grade":              pd.to_numeric(df["grade"], errors="coerce").astype("float64"),
+        "estado":             pd.Categorical(estado, categories=ESTADOS_CALIFICACION),
+        "time_to_grade_s":    time_to_grade_s.astype("Int64"),
+    })
+    resultado.attrs["assignment_id"] = assignid
+    return resultado
+
+
+def formatear_para_mostrar(df):
+    """
+    Genera las columnas de texto en español de la tabla de análisis. Pensada para llamarse
+    en el momento de pintar y solo con las filas que se van a mostrar.
+    """
+    calificado = df["estado"] == ESTADO_CALIFICADO
+    tiempo = df["estado"].astype(object)
+    if calificado.any():
+        tiempo[calificado] = formatear_duraciones(df["time_to_grade_s"][calificado])
+    return pd.DataFrame({
+        "Estudiante":            df["student_name"],
+        "Estado Envío":          df["submission_status"].astype(object).where(df["submission_status"].notna(), "Sin información de envío"),
+        "Fecha Envío":           formatear_timestamps(df["submission_date_ts"].astype("float64")),
+        "Fecha Calificación":    formatear_timestamps(df["graded_date_ts"].astype("float64")),
+        "Tiempo para Calificar": tiempo,
+        "Calificación":          df["grade"].astype(object).where(df["grade"].notna(), "Sin calificar"),
+    }, index=df.index)
+
+
+def filas_con_retraso(df, umbral_dias):
+    """Filas calificadas más de `umbral_dias` días después del envío (regla del reporte de retrasos)."""
+    return df[(df["time_to_grade_s"] > umbral_dias * SEGUNDOS_POR_DIA).fillna(False)]
+
+
+# Bordes (en días) de los buckets del histograma de latencias de calificación
+BORDES_HISTOGRAMA_DIAS = (0, 1, 2, 3, 5, 7, 10, 14, 21, 30, np.inf)
+PERCENTILES = (50, 90, 99)
+
+
+class LatenciasOrdenadas:
+    """
+    Latencias de calificación (segundos, solo las >= 0) ordenadas de menor a mayor, con su
+    histograma y percentiles calculados una vez. `filas` son las posiciones de cada latencia en
+    la tabla de análisis de origen (solo a nivel de tarea). Contar cuántas superan un umbral es
+    una búsqueda binaria sobre el array ordenado.
+    """
+    __slots__ = ("segundos", "filas", "histograma", "percentiles")
+
+    def __init__(self, segundos, filas=None):
+        orden = np.argsort(segundos, kind="stable")
+        self.segundos = segundos[orden]
+        self.filas = None if filas is None else filas[orden]
+        self.histograma = np.histogram(self.segundos / SEGUNDOS_POR_DIA, bins=BORDES_HISTOGRAMA_DIAS)[0]
+        self.percentiles = (dict(zip(PERCENTILES, np.percentile(self.segundos, PERCENTILES) / SEGUNDOS_POR_DIA))
+                            if len(self.segundos) else dict.fromkeys(PERCENTILES))
+
+    def __len__(self):
+        return len(self.segundos)
+
+    def primera_sobre(self, umbral_dias):
+        """Índice (en el orden de `segundos`) de la primera latencia > umbral_dias."""
+        return int(np.searchsorted(self.segundos, umbral_dias * SEGUNDOS_POR_DIA, side="right"))
+
+    def contar_sobre(self, umbral_dias):
+        return len(self.segundos) - self.primera_sobre(umbral_dias)
+
+
+class ResumenLatencias:
+    """
+    Agregados de latencia de un análisis completo ({assignid: tabla de análisis}), construidos una
+    sola vez: LatenciasOrdenadas por tarea, por curso y global. Con ellos el reporte de retrasos
+    responde a cualquier umbral sin volver a recorrer las filas. Los textos del detalle solo se
+    formatean para las filas que algún umbral ha mostrado, y se reutilizan en los siguientes.
+    """
+
+    def __init__(self, analisis_por_tarea, curso_por_tarea=None):
+        self.origen = analisis_por_tarea
+        self.curso_por_tarea = curso_por_tarea or {}
+        self.por_tarea = {}
+        self._detalle = {} # assignid -> (posición desde la que está formateado, detalle en orden ascendente)
+        por_curso = {}
+        for assignid, df in analisis_por_tarea.items():
+            segundos = df["time_to_grade_s"].to_numpy(dtype="int64", na_value=-1)
+            filas = np.flatnonzero(segundos >= 0)
+            self.por_tarea[assignid] = LatenciasOrdenadas(segundos[filas], filas)
+            por_curso.setdefault(self.curso_por_tarea.get(assignid), []).append(self.por_tarea[assignid].segundos)
+        vacio = np.empty(0, dtype="int64")
+        self.por_curso = {curso: LatenciasOrdenadas(np.concatenate(arrays)) for curso, arrays in por_curso.items()}
+        self.total = LatenciasOrdenadas(np.concatenate([l.segundos for l in self.por_tarea.values()] or [vacio]))
+
+    def memoria_bytes(self):
+        """
+        Tamaño aproximado de los agregados, del detalle ya formateado y de las tablas de análisis
+        de origen: el resumen las mantiene vivas (el detalle sale de ellas) aunque la caché las
+        haya expulsado, así que cuentan como suyas.
+        """
+        arrays = [l.segundos.nbytes + (l.filas.nbytes if l.filas is not None else 0)
+                  for l in (*self.por_tarea.values(), *self.por_curso.values(), self.total)]
+        detalle = [int(d.memory_usage(deep=True).sum()) for _, d in self._detalle.values()]
+        origen = [int(df.memory_usage(deep=True).sum()) for df in self.origen.values()]
+        return sum(arrays) + sum(detalle) + sum(origen)
+
+    def _detalle_tarea(self, assignid, nombre, inicio):
+        """
+        Detalle formateado de las latencias de la tarea desde la posición `inicio` (orden ascendente).
+        Se guarda el tramo ya formateado; al bajar el umbral solo se formatean las filas nuevas.
+        """
+        desde, detalle = self._detalle.get(assignid, (len(self.por_tarea[assignid]), None))
+        if inicio < desde:
+            latencias = self.por_tarea[assignid]
+            filas = self.origen[assignid].iloc[latencias.filas[inicio:desde]]
+            nuevo = pd.DataFrame({
+                "Tarea": nombre,
+                "Estudiante": filas["student_name"].to_numpy(),
+                "Fecha Envío": formatear_timestamps(filas["submission_date_ts"].astype("float64")).to_numpy(),
+                "Fecha Calificación": formatear_timestamps(filas["graded_date_ts"].astype("float64")).to_numpy(),
+                "Días de Retraso (Profesor)": (latencias.segundos[inicio:desde] / SEGUNDOS_POR_DIA).round(1),
+            })
+            detalle = nuevo if detalle is None else pd.concat([nuevo, detalle], ignore_index=True)
+            desde = inicio
+            self._detalle[assignid] = (desde, detalle)
+        return detalle.iloc[inicio - desde:]
+
+    def reporte(self, nombres_tareas, umbral_dias):
+        """
+        ({nombre_tarea: n_retrasados}, DataFrame de detalle) para `umbral_dias`. El detalle de cada
+        tarea va de mayor a menor retraso.
+        """
+        conteos = {}
+        detalle = []
+        for assignid, latencias in self.por_tarea.items():
+            inicio = latencias.primera_sobre(umbral_dias)
+            if inicio == len(latencias):
+                continue
+            nombre = nombres_tareas.get(assignid, f"Tarea ID: {assignid}")
+            conteos[nombre] = len(latencias) - inicio
+            detalle.append(self._detalle_tarea(assignid, nombre, inicio)[::-1])
+        return conteos, pd.concat(detalle, ignore_index=True) if detalle else pd.DataFrame()
+
+    def tabla_percentiles(self, nombres_tareas, umbral_dias):
+        """Una fila por tarea: calificados, p50/p90/p99 (días) y cuántos superan `umbral_dias`."""
+        return pd.DataFrame([{
+            "Tarea": nombres_tareas.get(assignid, f"Tarea ID: {assignid}"),
+            "Curso": self.curso_por_tarea.get(assignid),
+            "Calificados": len(latencias),
+            **{f"p{p} (días)": v for p, v in latencias.percentiles.items()},
+            f"> {umbral_dias:g} días": latencias.contar_sobre(umbral_dias),
+        } for assignid, latencias in self.por_tarea.items()])
+
+    def histograma(self, latencias=None):
+        """Serie {bucket: cuenta} del histograma (global por defecto) con etiquetas en días."""
+        latencias = self.total if latencias is None else latencias
+        bordes = BORDES_HISTOGRAMA_DIAS
+        etiquetas = [f"{bordes[i]:g}-{bordes[i + 1]:g}" if np.isfinite(bordes[i + 1]) else f"{bordes[i]:g}+"
+                     for i in range(len(bordes) - 1)]
+        return pd.Series(latencias.histograma, index=etiquetas, name="Calificaciones")
+
+
+def reporte_retrasos(analisis_por_tarea, nombres_tareas, umbral_dias):
+    """
+    Agregación del reporte de retrasos (pestaña 3) sin dependencias de Streamlit.
+    Devuelve ({nombre_tarea: n_retrasados}, DataFrame de detalle con textos ya formateados).
+    Para varios umbrales sobre el mismo análisis, construir un ResumenLatencias y reutilizarlo.
+    """
+    return ResumenLatencias(analisis_por_tarea).reporte(nombres_tareas, umbral_dias)
@@ -1,9 +1,20 @@
+import logging
+import os
+
 import streamlit as st
 from moodle_services import (
-    obtener_tareas_por_curso,
-    analizar_tiempos_calificacion_tarea,
-    MOODLE_URL_BASE,
+    obtener_tareas_por_cursos_memo,
+    iterar_analisis_memo,
+    get_almacen,
+    get_client,
 )
+from moodle_config import ConfiguracionMoodleError
+from moodle_metricas import METRICAS, log_evento
+from moodle_cache import modo_cache
+from analisis_tiempos import es_error, formatear_para_mostrar
+from almacen_resultados import get_almacen_resultados
+from catalogo_tareas import CatalogoTareas
+from estado_sesion import cache_compartida, catalogo_sesion, guardar_analisis, guardar_consulta, limpiar_sesion
 from datetime import datetime
 from etapa3_reporte_retrasos import display_reporte_retrasos
 import pandas as pd
@@ -11,13 +22,39 @@ import pandas as pd
 # --- Configuración de la Página Streamlit ---
 st.set_page_config(page_title="Verificador de Calificaciones Moodle", layout="wide")
 
+# --- RECURSOS COMPARTIDOS ENTRE SESIONES ---
+# st.cache_resource crea un único objeto por proceso de Streamlit: todas las sesiones (pestañas
+# del navegador, coordinadores distintos) comparten el cliente HTTP y la caché en memoria.
+@st.cache_resource(show_spinner=False)
+def cliente_moodle_compartido():
+    return get_client()
+
+@st.cache_resource(show_spinner=False)
+def prefetch_compartido():
+    # MOODLE_PREFETCH_CURSOS (CSV con columna 'id' o IDs separados por coma) activa la precarga
+    # periódica en segundo plano; las consultas se sirven del almacén local en cuanto está lleno.
+    cursos = os.environ.get("MOODLE_PREFETCH_CURSOS")
+    if not cursos:
+        return None
+    from moodle_prefetch import INTERVALO_POR_DEFECTO, Prefetcher, leer_cursos_prefetch
+    intervalo = float(os.environ.get("MOODLE_PREFETCH_INTERVALO", INTERVALO_POR_DEFECTO))
+    return Prefetcher(leer_cursos_prefetch(cursos), intervalo=intervalo).iniciar()
+
+try:
+    cliente_moodle = cliente_moodle_compartido()
+except ConfiguracionMoodleError as e:
+    # Faltan MOODLE_API_URL_BASE / MOODLE_API_TOKEN: detener la aplicación con el mensaje de ayuda
+    print(e)
+    st.error(str(e))
+    st.stop() # Detiene la ejecución del script de Streamlit
+memo_compartida = cache_compartida()
+prefetcher = prefetch_compartido()
+
 # --- INICIALIZACIÓN DE st.session_state (MOVER TODO AQUÍ ARRIBA) ---
-if 'all_assignments_from_courses' not in st.session_state:
-    st.session_state.all_assignments_from_courses = []
-if 'tasks_for_analysis_options_display' not in st.session_state:
-    st.session_state.tasks_for_analysis_options_display = {}
-if 'analisis_completos' not in st.session_state:
-    st.session_state.analisis_completos = {}
+# La sesión solo guarda asas (IDs de curso consultados, IDs de tarea analizados); los resultados
+# viven en la caché compartida, con presupuesto de memoria global (ver estado_sesion.py).
+if 'consulta_cursos' not in st.session_state:
+    limpiar_sesion()
 # 'selected_assignment_info_for_dates' ya no se usa directamente si el multiselect
 # itera sobre los IDs seleccionados para mostrar la info. Si aún lo usas para
 # alguna lógica interna, inicialízalo también. Por ahora, lo omito si no es esencial.
@@ -29,6 +66,70 @@ with col1:
 with col2:
     st.image("smea1.png", width=200)
 
+# --- CONTROL DE CACHÉ (barra lateral) ---
+forzar_descarga = st.sidebar.checkbox(
+    "Forzar descarga desde Moodle (ignorar caché)",
+    key="forzar_descarga_cache",
+    help="Vuelve a descargar los datos y actualiza la caché local en lugar de usar las respuestas guardadas."
+)
+# La app sirve lo caducado del almacén local mientras lo refresca en segundo plano ("obsoleto")
+modo_cache_sesion = "refrescar" if forzar_descarga else "obsoleto"
+sync_incremental = st.sidebar.checkbox(
+    "Sincronización incremental de envíos y calificaciones",
+    key="sync_incremental",
+    help="Descarga solo los envíos y calificaciones modificados desde el último análisis de cada tarea."
+)
+if st.sidebar.button("🗑️ Vaciar cachés", key="btn_vaciar_cache",
+                     help="Vacía la caché en memoria compartida por todas las sesiones, la caché local en disco y el almacén precargado."):
+    memo_compartida.limpiar()
+    if cliente_moodle.cache is not None:
+        cliente_moodle.cache.limpiar()
+    if get_almacen() is not None:
+        get_almacen().limpiar()
+    st.sidebar.success("Cachés vaciadas.")
+
+if prefetcher is not None:
+    ultima = prefetcher.ultima_pasada
+    st.sidebar.caption(
+        f"🔄 Precarga en segundo plano de {len(prefetcher.course_ids)} cursos: " +
+        (f"última pasada {datetime.fromtimestamp(ultima['inicio']):%Y-%m-%d %H:%M} "
+         f"({ultima['tareas']} tareas en {ultima['segundos']} s)." if ultima else "primera pasada en curso.")
+    )
+
+with st.sidebar.expander("📈 Métricas de llamadas a Moodle"):
+    if cliente_moodle.trafico:
+        estado_trafico = cliente_moodle.trafico.estado()
+        if estado_trafico["circuito"] != "cerrado":
+            st.warning(f"Moodle no responde bien: circuito {estado_trafico['circuito']}, "
+                       "las llamadas se rechazan temporalmente.")
+        st.caption(f"Ritmo actual: {estado_trafico['tasa_por_s']} peticiones/s, "
+                   f"hasta {int(estado_trafico['limite_concurrencia'])} simultáneas.")
+    ahorro = METRICAS.ahorro_transferencia()
+    if ahorro["bytes_json"]:
+        st.caption(f"Transferido: {ahorro['bytes_red'] / 2**20:.1f} MB por la red para "
+                   f"{ahorro['bytes_json'] / 2**20:.1f} MB de JSON ({ahorro['ahorro']:.0%} ahorrado por compresión).")
+    uso_memoria = memo_compartida.estadisticas()
+    st.caption(f"Resultados en memoria (todas las sesiones): {uso_memoria['bytes'] / 2**20:.0f} de "
+               f"{memo_compartida.max_bytes / 2**20:.0f} MB, {uso_memoria['expulsiones']} expulsiones.")
+    st.json(METRICAS.snapshot(), expanded=False)
+    st.download_button("Descargar (Prometheus)", METRICAS.exportar_prometheus(),
+                       file_name="moodle_metricas.prom", mime="text/plain", key="btn_metricas_prom")
+    st.download_button("Descargar (JSON)", METRICAS.exportar_json(),
+                       file_name="moodle_metricas.json", mime="application/json", key="btn_metricas_json")
+
+def filtrar_catalogo(catalogo, clave, campo_fecha, etiqueta_fecha):
+    """
+    Filtros por curso y por rango de `campo_fecha` sobre el catálogo de tareas. Devuelve los ids
+    que pasan los filtros (todos si no se fija ninguno), resueltos con los índices del catálogo.
+    """
+    with st.expander("🔎 Filtrar tareas", expanded=False):
+        cursos = st.multiselect("Cursos", options=catalogo.cursos(), key=f"filtro_cursos_{clave}")
+        rango = st.date_input(etiqueta_fecha, value=(), key=f"filtro_fechas_{clave}")
+    desde = datetime.combine(rango[0], datetime.min.time()).timestamp() if len(rango) > 0 else None
+    hasta = datetime.combine(rango[-1], datetime.max.time()).timestamp() if len(rango) > 1 else None
+    return catalogo.filtrar(cursos=cursos or None, rangos={campo_fecha: (desde, hasta)})
+
+
 # --- CREACIÓN DE PESTAÑAS ---
 tab1, tab2, tab3 = st.tabs(["1. Consultar Tareas y Fechas", "2. Analizar Tiempos", "3. Reporte de Retrasos"])
 
@@ -59,13 +160,11 @@ with tab1:
             st.error(f"Error al leer el archivo CSV: {str(e)}")
 
     if st.button("📚 Consultar Tareas de Curso(s)", key="btn_consultar_cursos_tab1"):
-        print("DEBUG APP.PY: Botón 'Consultar Tareas de Curso(s)' PRESIONADO")
-        st.session_state.all_assignments_from_courses = []
-        st.session_state.tasks_for_analysis_options_display = {}
-        st.session_state.analisis_completos = {} 
+        log_evento(logging.DEBUG, "app_consultar_tareas")
+        limpiar_sesion()
 
         if not course_ids_str_input:
-            print("DEBUG APP.PY: IDs de curso no ingresados.")
+            log_evento(logging.DEBUG, "app_sin_ids_curso")
             st.warning("Por favor, ingresa al menos un ID de curso.")
         else:
             course_ids_list_str = [id_str.strip() for id_str in course_ids_str_input.split(',')]
@@ -85,106 +184,84 @@ with tab1:
                 progress_bar = st.progress(0.0)
                 progress_text_area = st.empty()
                 
-                for i, course_id in enumerate(valid_course_ids_to_query):
-                    current_progress = (i + 1) / total_courses_to_query
-                    progress_text_area.text(f"Consultando curso ID: {course_id} ({i+1}/{total_courses_to_query})...")
-                    assignments_from_api_for_this_course = obtener_tareas_por_curso(course_id)
+                def _actualizar_progreso_cursos(procesados, total):
+                    progress_text_area.text(f"Consultando cursos ({procesados}/{total})...")
+                    progress_bar.progress(procesados / total)
+
+                with modo_cache(modo_cache_sesion):
+                    tareas_por_curso = obtener_tareas_por_cursos_memo(
+                        memo_compartida,
+                        valid_course_ids_to_query,
+                        refrescar=forzar_descarga,
+                        progress_callback=_actualizar_progreso_cursos,
+                    )
+                for course_id, assignments_from_api_for_this_course in tareas_por_curso.items():
                     if assignments_from_api_for_this_course is not None:
                         if assignments_from_api_for_this_course:
                              all_retrieved_assignments_temp.extend(assignments_from_api_for_this_course)
                     else:
                         st.error(f"Error crítico al consultar el curso ID {course_id}.")
                         has_errors_during_fetch = True
-                    progress_bar.progress(current_progress)
                 progress_text_area.text("¡Consulta de cursos completada!")
                 progress_bar.empty()
 
                 if all_retrieved_assignments_temp:
                     st.success(f"Se encontraron {len(all_retrieved_assignments_temp)} tareas.")
-                    st.session_state.all_assignments_from_courses = all_retrieved_assignments_temp
-                    
-                    # Crear DataFrame para mostrar resultados en tabla
-                    results_data = []
-                    for task in all_retrieved_assignments_temp:
-                        results_data.append({
-                            'ID Curso': task.get('courseid_original_request', 'N/A'),
-                            'ID Tarea': task.get('id', 'N/A'),
-                            'Nombre Tarea': task.get('name', 'N/A'),
-                            'Envíos desde': task.get('allowsubmissionsfromdate_str', 'N/A'),
-                            'Fecha Entrega': task.get('duedate_str', 'N/A'),
-                            'Fecha Límite': task.get('cutoffdate_str', 'N/A'),
-                            'Calificación esperada': task.get('gradingduedate_str', 'N/A')
-                        })
-                        st.session_state.tasks_for_analysis_options_display[task['id']] = f"{task.get('name', 'Tarea s/n')} (Curso ID: {task.get('courseid_original_request', 'Desconocido')}, Tarea ID: {task.get('id', 'N/A')})"
-                    
-                    # Mostrar resultados en tabla
-                    if results_data:
-                        st.subheader("Resultados de la consulta")
-                        df_results = pd.DataFrame(results_data)
-                        st.dataframe(df_results, use_container_width=True)
+                    # Índices (por id, por curso, por fechas), etiquetas y tablas: una vez por consulta
+                    catalogo = CatalogoTareas(all_retrieved_assignments_temp)
+                    guardar_consulta(valid_course_ids_to_query, catalogo)
+
+                    st.subheader("Resultados de la consulta")
+                    st.dataframe(catalogo.tabla_consulta(), use_container_width=True)
                 
                 if not all_retrieved_assignments_temp and not has_errors_during_fetch:
                      st.info("No se encontraron tareas en los cursos especificados o los cursos no tienen tareas.")
                 elif not all_retrieved_assignments_temp and has_errors_during_fetch:
                      st.warning("No se pudieron recuperar tareas de ningún curso debido a errores. Revise la consola del servidor.")
 
-    # Esta es la línea 91 del error original, ahora debería funcionar
-    if st.session_state.all_assignments_from_courses: 
-        task_options_for_dates_view = {
-            task['id']: task.get('name', f"Tarea ID: {task['id']}")
-            for task in st.session_state.all_assignments_from_courses
-        }
-        if task_options_for_dates_view:
-            # Nuevo: uploader de CSV para IDs de actividades
-            st.subheader("Subir CSV con IDs de actividades para ver fechas")
-            actividades_csv = st.file_uploader("Subir archivo CSV con IDs de actividades (columna 'id')", type=['csv'], key="csv_actividades_tab1")
-            selected_task_ids_for_dates_view = []
-            if actividades_csv is not None:
-                try:
-                    df_acts = pd.read_csv(actividades_csv)
-                    if 'id' in df_acts.columns:
-                        # Filtrar solo los IDs que existen en las opciones
-                        ids_csv = [int(i) for i in df_acts['id'].tolist() if int(i) in task_options_for_dates_view]
-                        selected_task_ids_for_dates_view = ids_csv
-                        st.success(f"Se seleccionaron {len(ids_csv)} actividades desde el archivo CSV")
-                    else:
-                        st.error("El archivo CSV debe tener una columna llamada 'id'")
-                except Exception as e:
-                    st.error(f"Error al leer el archivo CSV: {str(e)}")
-            else:
-                selected_task_ids_for_dates_view = st.multiselect(
-                    "Selecciona UNA O MÁS tareas para ver sus fechas de configuración:",
-                    options=list(task_options_for_dates_view.keys()),
-                    format_func=lambda task_id: task_options_for_dates_view.get(task_id, f"ID: {task_id}"),
-                    key="multiselect_view_assignment_dates_tab1"
-                )
-            # Mostrar resultados en tabla si hay IDs seleccionados
-            if selected_task_ids_for_dates_view:
-                tabla_resultados = []
-                for task_id_to_show in selected_task_ids_for_dates_view:
-                    tarea_info = next((task for task in st.session_state.all_assignments_from_courses if task['id'] == task_id_to_show), None)
-                    if tarea_info:
-                        tabla_resultados.append({
-                            "Nombre Tarea": tarea_info['name'],
-                            "ID Tarea": tarea_info['id'],
-                            "Envíos desde": tarea_info.get('allowsubmissionsfromdate_str', "N/A"),
-                            "Entrega": tarea_info.get('duedate_str', "N/A"),
-                            "Límite": tarea_info.get('cutoffdate_str', "N/A"),
-                            "Calificación esperada": tarea_info.get('gradingduedate_str', "N/A")
-                        })
-                if tabla_resultados:
-                    st.subheader("Fechas de configuración de las actividades seleccionadas")
-                    st.dataframe(pd.DataFrame(tabla_resultados), use_container_width=True)
+    catalogo = catalogo_sesion()
+    if catalogo:
+        # Nuevo: uploader de CSV para IDs de actividades
+        st.subheader("Subir CSV con IDs de actividades para ver fechas")
+        actividades_csv = st.file_uploader("Subir archivo CSV con IDs de actividades (columna 'id')", type=['csv'], key="csv_actividades_tab1")
+        selected_task_ids_for_dates_view = []
+        if actividades_csv is not None:
+            try:
+                df_acts = pd.read_csv(actividades_csv)
+                if 'id' in df_acts.columns:
+                    # Filtrar solo los IDs que existen en el catálogo
+                    ids_csv = [int(i) for i in df_acts['id'].tolist() if int(i) in catalogo]
+                    selected_task_ids_for_dates_view = ids_csv
+                    st.success(f"Se seleccionaron {len(ids_csv)} actividades desde el archivo CSV")
+                else:
+                    st.error("El archivo CSV debe tener una columna llamada 'id'")
+            except Exception as e:
+                st.error(f"Error al leer el archivo CSV: {str(e)}")
+        else:
+            opciones_fechas = filtrar_catalogo(catalogo, "tab1", "duedate_ts", "Fecha de entrega entre")
+            selected_task_ids_for_dates_view = st.multiselect(
+                "Selecciona UNA O MÁS tareas para ver sus fechas de configuración:",
+                options=opciones_fechas,
+                format_func=lambda task_id: catalogo.por_id[task_id].get('name', f"Tarea ID: {task_id}"),
+                key="multiselect_view_assignment_dates_tab1"
+            )
+        # Mostrar resultados en tabla si hay IDs seleccionados
+        if selected_task_ids_for_dates_view:
+            st.subheader("Fechas de configuración de las actividades seleccionadas")
+            st.dataframe(catalogo.tabla_fechas(selected_task_ids_for_dates_view), use_container_width=True)
 
 with tab2:
     st.header("Analizar Tiempos de Calificación")
     
     selected_task_ids_for_analysis_input = []
-    if st.session_state.tasks_for_analysis_options_display:
+    catalogo = catalogo_sesion()
+    if catalogo:
+        opciones_analisis = filtrar_catalogo(catalogo, "tab2", "gradingduedate_ts",
+                                             "Fecha de calificación esperada entre")
         selected_task_ids_for_analysis_input = st.multiselect(
             "Selecciona tareas para analizar sus tiempos de calificación:",
-            options=list(st.session_state.tasks_for_analysis_options_display.keys()), 
-            format_func=lambda task_id: st.session_state.tasks_for_analysis_options_display.get(task_id, f"ID Tarea: {task_id}"),
+            options=opciones_analisis,
+            format_func=lambda task_id: catalogo.etiquetas.get(task_id, f"ID Tarea: {task_id}"),
             key="multiselect_analyze_tasks_tab2"
         )
     else:
@@ -195,24 +272,61 @@ with tab2:
             st.warning("Por favor, selecciona al menos una tarea para analizar.")
         else:
             st.info(f"Analizando tareas (IDs): {selected_task_ids_for_analysis_input}")
-            st.session_state.analisis_completos = {} 
-            
+            st.session_state.asa_analisis = None
+
+            # Un contenedor por tarea, creado en el orden seleccionado: los resultados se muestran
+            # a medida que llegan pero cada uno aparece siempre en su posición.
+            total_tareas = len(selected_task_ids_for_analysis_input)
+            progress_bar = st.progress(0.0)
+            progress_text_area = st.empty()
+            contenedores = {}
             for assignid_to_analyze in selected_task_ids_for_analysis_input:
-                task_name_display = st.session_state.tasks_for_analysis_options_display.get(assignid_to_analyze, f"ID Tarea: {assignid_to_analyze}")
-                with st.expander(f"Resultados para Tarea: {task_name_display}", expanded=True):
-                    with st.spinner(f"Obteniendo datos para tarea ID: {assignid_to_analyze}..."):
-                        resultados_analisis = analizar_tiempos_calificacion_tarea(assignid_to_analyze) 
-                    st.session_state.analisis_completos[assignid_to_analyze] = resultados_analisis
-
-                    if resultados_analisis:
-                        st.success(f"Análisis completo. {len(resultados_analisis)} participantes/envíos encontrados.")
-                        data_for_df = [{"Estudiante": res['student_name'], "Estado Envío": res['submission_status'],
-                                        "Fecha Envío": res['submission_date_str'], "Fecha Calificación": res['graded_date_str'],
-                                        "Tiempo para Calificar": res['time_to_grade_str'], "Calificación": res['grade']}
-                                       for res in resultados_analisis]
-                        st.dataframe(data_for_df, use_container_width=True)
-                    else:
-                        st.warning(f"No se encontraron datos de calificación o participantes para la tarea ID: {assignid_to_analyze}, o no hubo envíos/calificaciones que analizar.")
+                contenedores[assignid_to_analyze] = st.empty()
+                contenedores[assignid_to_analyze].info(f"⏳ Obteniendo datos para tarea ID: {assignid_to_analyze}...")
+
+            resultados_por_tarea = {}
+            with modo_cache(modo_cache_sesion):
+                for completadas, (assignid_to_analyze, resultados_analisis) in enumerate(
+                        iterar_analisis_memo(memo_compartida, selected_task_ids_for_analysis_input,
+                                             refrescar=forzar_descarga, incremental=sync_incremental), start=1):
+                    resultados_por_tarea[assignid_to_analyze] = resultados_analisis
+                    progress_text_area.text(f"Tareas analizadas: {completadas}/{total_tareas}")
+                    progress_bar.progress(completadas / total_tareas)
+
+                    task_name_display = catalogo.etiquetas.get(assignid_to_analyze, f"ID Tarea: {assignid_to_analyze}")
+                    with contenedores[assignid_to_analyze].container():
+                        with st.expander(f"Resultados para Tarea: {task_name_display}", expanded=True):
+                            if es_error(resultados_analisis):
+                                st.error(f"Falló la descarga de datos de Moodle para la tarea ID: {assignid_to_analyze}; "
+                                         "los resultados pueden estar incompletos. Vuelve a analizarla más tarde.")
+                            if not resultados_analisis.empty:
+                                st.success(f"Análisis completo. {len(resultados_analisis)} participantes/envíos encontrados.")
+                                # Los textos (fechas, tiempos) se generan solo al pintar; no se guardan en sesión
+                                st.dataframe(formatear_para_mostrar(resultados_analisis), use_container_width=True)
+                            elif not es_error(resultados_analisis):
+                                st.warning(f"No se encontraron datos de calificación o participantes para la tarea ID: {assignid_to_analyze}, o no hubo envíos/calificaciones que analizar.")
+            progress_bar.empty()
+            progress_text_area.text("¡Análisis completado!")
+
+            # Guardar en el orden seleccionado para que el reporte (pestaña 3) sea determinista
+            analisis_completos = {
+                assignid: resultados_por_tarea[assignid] for assignid in selected_task_ids_for_analysis_input
+                if assignid in resultados_por_tarea
+            }
+            # También construye los agregados de latencia para la pestaña 3, una sola vez por análisis
+            guardar_analisis(analisis_completos)
+            # Histórico en Parquet para comparar con análisis anteriores (pestaña 3)
+            almacen_resultados = get_almacen_resultados()
+            # Las tareas con error no entran: el histórico solo guarda análisis completos
+            analisis_historico = {a: df for a, df in analisis_completos.items() if not es_error(df)}
+            if almacen_resultados is not None and analisis_historico:
+                try:
+                    run_id = almacen_resultados.guardar(analisis_historico, catalogo.curso_por_tarea,
+                                                        catalogo.etiquetas)
+                    st.caption(f"Análisis guardado en el histórico ({run_id}).")
+                except OSError as e:
+                    log_evento(logging.WARNING, "historico_error", error=str(e))
+                    st.warning(f"No se pudo guardar el análisis en el histórico: {e}")
 
 with tab3:
     display_reporte_retrasos()
@@ -224,6 +338,6 @@ st.sidebar.info(
     Ayuda a verificar tiempos de calificación en Moodle.
     1. **Pestaña 1:** Consulta tareas por ID de curso y ve sus fechas.
     2. **Pestaña 2:** Analiza tiempos de calificación para tareas seleccionadas.
-    3. **Pestaña 3:** Ve un reporte de calificaciones con retraso mayor a 7 días.
+    3. **Pestaña 3:** Ve un reporte de calificaciones con retraso mayor al umbral configurado.
     """
 )
\ No newline at end of file
@@ -0,0 +1,437 @@
+# auditoria_cli.py
+# Auditoría de tiempos de calificación sin interfaz (para ejecuciones nocturnas / toda la institución).
+#
+# Uso:
+#   python auditoria_cli.py cursos.csv --salida resultados/ --umbral-dias 7 --formato parquet
+#   python auditoria_cli.py cursos.csv --salida resultados/ --reanudar   # continúa tras una caída
+#   python auditoria_cli.py cursos.csv --salida resultados/ --procesos 8  # toda la institución, por shards
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from analisis_tiempos import SEGUNDOS_POR_DIA, ESTADO_CALIFICADO, es_error, filas_con_retraso
+from moodle_cache import modo_cache
+from moodle_config import resolver_configuracion
+from moodle_metricas import METRICAS, configurar_logging
+from moodle_services import (
+    ASIGNACIONES_CHUNK_SIZE,
+    MAX_WORKERS,
+    TAREAS_CHUNK_SIZE,
+    configurar,
+    iterar_analisis_concurrente,
+    obtener_tareas_por_cursos,
+)
+from moodle_trafico import MAX_CONCURRENCIA, ControlTrafico
+
+UMBRAL_DIAS_POR_DEFECTO = 7
+# Cada cuántas tareas analizadas se vuelca el avance a disco (checkpoint)
+TAREAS_POR_LOTE = 50
+# Valores de la columna `error` del resumen (None = sin error)
+ERROR_CURSO = "consulta_tareas"
+ERROR_TAREA = "analisis"
+# Modo por shards: cursos consecutivos (en el orden del CSV) que procesa cada proceso de una vez
+CURSOS_POR_SHARD = 100
+
+
+def _log(mensaje, silencioso=False):
+    if not silencioso:
+        print(mensaje, file=sys.stderr, flush=True)
+
+
+def leer_ids_cursos(ruta_csv):
+    """Lee la columna 'id' del CSV (el mismo formato que acepta la pestaña 1)."""
+    df = pd.read_csv(ruta_csv)
+    if "id" not in df.columns:
+        raise ValueError(f"El archivo CSV '{ruta_csv}' debe contener una columna llamada 'id'")
+    ids = pd.to_numeric(df["id"], errors="coerce")
+    invalidos = df["id"][ids.isna()].tolist()
+    if invalidos:
+        print(f"AVISO: se ignoran {len(invalidos)} IDs no numéricos: {invalidos[:10]}", file=sys.stderr)
+    return list(dict.fromkeys(int(i) for i in ids.dropna()))
+
+
+def _escribir(df, ruta_sin_ext, formato):
+    ruta = f"{ruta_sin_ext}.{formato}"
+    if formato == "parquet":
+        df.to_parquet(ruta, index=False) # Requiere pyarrow (o fastparquet)
+    else:
+        df.to_csv(ruta, index=False)
+    return ruta
+
+
+def _resumen_tarea(tarea, df, umbral_dias):
+    latencias = df["time_to_grade_s"].dropna().astype("float64") / SEGUNDOS_POR_DIA
+    return {
+        "course_id": tarea["courseid_original_request"],
+        "assignment_id": tarea["id"],
+        "assignment_name": tarea["name"],
+        "participantes": len(df),
+        "enviados": int(df["submission_date_ts"].notna().sum()),
+        "calificados": int((df["estado"] == ESTADO_CALIFICADO).sum()),
+        "pendientes": int((df["estado"] == "Pendiente de calificar").sum()),
+        "retrasados": len(filas_con_retraso(df, umbral_dias)),
+        "mediana_dias": latencias.median() if not latencias.empty else None,
+        "max_dias": latencias.max() if not latencias.empty else None,
+        "error": None,
+    }
+
+
+def _resumen_error(course_id, motivo, tarea=None):
+    """Fila del resumen para un curso o una tarea que falló: solo identificación y motivo."""
+    return {
+        "course_id": course_id,
+        "assignment_id": tarea["id"] if tarea else None,
+        "assignment_name": tarea["name"] if tarea else None,
+        "error": motivo,
+    }
+
+
+def hay_errores(df_resumen):
+    """True si el resumen tiene cursos o tareas con error (se reintentan con --reanudar)."""
+    return "error" in df_resumen.columns and bool(df_resumen["error"].notna().any())
+
+
+def _filas_tarea(tarea, df, umbral_dias):
+    filas = df.copy()
+    filas.insert(0, "course_id", tarea["courseid_original_request"])
+    filas.insert(1, "assignment_id", tarea["id"])
+    filas.insert(2, "assignment_name", tarea["name"])
+    filas["time_to_grade_dias"] = filas["time_to_grade_s"].astype("float64") / SEGUNDOS_POR_DIA
+    filas["retrasado"] = (filas["time_to_grade_s"] > umbral_dias * SEGUNDOS_POR_DIA).fillna(False)
+    return filas
+
+
+def _huella_checkpoint(course_ids, umbral_dias):
+    """Qué datos contiene un checkpoint: la lista de cursos (hash) y los parámetros que cambian los resultados."""
+    return {"cursos": hashlib.sha256(",".join(map(str, course_ids)).encode()).hexdigest(),
+            "n_cursos": len(course_ids), "umbral_dias": umbral_dias}
+
+
+def _comprobar_checkpoint(dir_checkpoint, course_ids, umbral_dias, reanudar):
+    """
+    Al reanudar, rechaza un checkpoint hecho con otros cursos u otro umbral (mezclaría
+    resultados); al empezar de cero, guarda la huella del nuevo checkpoint.
+    """
+    ruta = os.path.join(dir_checkpoint, "huella.json")
+    huella = _huella_checkpoint(course_ids, umbral_dias)
+    if reanudar and os.path.exists(os.path.join(dir_checkpoint, "tareas.pkl")):
+        guardada = None
+        if os.path.exists(ruta):
+            with open(ruta, encoding="utf-8") as f:
+                guardada = json.load(f)
+        if guardada != huella:
+            raise ValueError(f"El checkpoint de {dir_checkpoint} es de otros cursos o parámetros "
+                             f"({guardada} != {huella}); ejecuta sin --reanudar para empezar de nuevo")
+        return
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(huella, f)
+
+
+def _auditar_cursos(course_ids, dir_checkpoint, umbral_dias, max_workers, chunk_size, reanudar,
+                    incremental, silencioso):
+    """
+    Consulta y analiza las tareas de `course_ids` guardando el avance en `dir_checkpoint`
+    (tareas consultadas + un archivo por lote de tareas analizadas); con reanudar=True solo se
+    consultan los cursos y se analizan las tareas que faltan o fallaron, siempre que el checkpoint
+    sea de los mismos cursos y umbral (ver _comprobar_checkpoint). Devuelve (df_filas,
+    df_resumen); los cursos y tareas con error van al resumen con la columna `error` rellena.
+    """
+    if not reanudar and os.path.isdir(dir_checkpoint):
+        shutil.rmtree(dir_checkpoint) # Sin restos de una ejecución anterior que la huella nueva diera por buenos
+    os.makedirs(dir_checkpoint, exist_ok=True)
+    _comprobar_checkpoint(dir_checkpoint, course_ids, umbral_dias, reanudar)
+    ruta_tareas = os.path.join(dir_checkpoint, "tareas.pkl")
+
+    # 1. Tareas de los cursos. Al reanudar se reutilizan las del checkpoint y solo se vuelven a
+    # consultar los cursos que fallaron (el checkpoint guarda cuáles son)
+    if reanudar and os.path.exists(ruta_tareas):
+        checkpoint = pd.read_pickle(ruta_tareas)
+        tareas, a_consultar = checkpoint["tareas"], checkpoint["cursos_con_error"]
+        _log(f"Reanudando: {len(tareas)} tareas leídas del checkpoint.", silencioso)
+    else:
+        tareas, a_consultar = [], list(course_ids)
+    cursos_con_error = []
+    if a_consultar:
+        _log(f"Consultando tareas de {len(a_consultar)} cursos...", silencioso)
+        tareas_por_curso = obtener_tareas_por_cursos(
+            a_consultar, chunk_size=TAREAS_CHUNK_SIZE,
+            progress_callback=lambda n, total: _log(f"  cursos {n}/{total}", silencioso),
+        )
+        cursos_con_error = [c for c, t in tareas_por_curso.items() if t is None]
+        if cursos_con_error:
+            _log(f"AVISO: {len(cursos_con_error)} cursos con error: {cursos_con_error[:20]}", silencioso)
+        tareas = tareas + [t for lista in tareas_por_curso.values() if lista for t in lista]
+        pd.to_pickle({"tareas": tareas, "cursos_con_error": cursos_con_error}, ruta_tareas)
+
+    # 2. Análisis, guardando un lote parcial cada TAREAS_POR_LOTE tareas
+    tareas_por_id = {t["id"]: t for t in tareas}
+    ya_analizadas = set()
+    lotes_previos = sorted(f for f in os.listdir(dir_checkpoint) if f.startswith("lote_")) if reanudar else []
+    for nombre in lotes_previos:
+        ya_analizadas.update(pd.read_pickle(os.path.join(dir_checkpoint, nombre))["resumen"]["assignment_id"])
+
+    pendientes = [assignid for assignid in tareas_por_id if assignid not in ya_analizadas]
+    _log(f"Analizando {len(pendientes)} tareas ({len(ya_analizadas)} ya completadas en checkpoint)...", silencioso)
+
+    lote_filas, lote_resumen = [], []
+    # Los fallos no van a los lotes (así --reanudar los reintenta): solo al resumen de esta ejecución
+    errores = [_resumen_error(c, ERROR_CURSO) for c in cursos_con_error]
+    numero_lote = len(lotes_previos)
+    inicio = time.time()
+
+    def _volcar_lote():
+        nonlocal lote_filas, lote_resumen, numero_lote
+        if not lote_resumen:
+            return
+        pd.to_pickle(
+            {"filas": pd.concat(lote_filas, ignore_index=True) if lote_filas else pd.DataFrame(),
+             "resumen": pd.DataFrame(lote_resumen)},
+            os.path.join(dir_checkpoint, f"lote_{numero_lote:06d}.pkl"),
+        )
+        numero_lote += 1
+        lote_filas, lote_resumen = [], []
+
+    with modo_cache("usar"):
+        for completadas, (assignid, df) in enumerate(
+                iterar_analisis_concurrente(pendientes, max_workers=max_workers, chunk_size=chunk_size,
+                                            incremental=incremental), start=1):
+            tarea = tareas_por_id[assignid]
+            if es_error(df):
+                errores.append(_resumen_error(tarea["courseid_original_request"], ERROR_TAREA, tarea))
+                continue
+            lote_resumen.append(_resumen_tarea(tarea, df, umbral_dias))
+            if not df.empty:
+                lote_filas.append(_filas_tarea(tarea, df, umbral_dias))
+            if len(lote_resumen) >= TAREAS_POR_LOTE:
+                _volcar_lote()
+            if completadas % 10 == 0 or completadas == len(pendientes):
+                transcurrido = max(time.time() - inicio, 1e-6)
+                _log(f"  tareas {completadas}/{len(pendientes)} ({completadas / transcurrido:.1f} tareas/s)", silencioso)
+    _volcar_lote()
+
+    # 3. Unir todos los lotes en las salidas finales
+    lotes = [pd.read_pickle(os.path.join(dir_checkpoint, f))
+             for f in sorted(os.listdir(dir_checkpoint)) if f.startswith("lote_")]
+    filas = [l["filas"] for l in lotes if not l["filas"].empty]
+    df_filas = pd.concat(filas, ignore_index=True) if filas else pd.DataFrame()
+    resumenes = [l["resumen"] for l in lotes] + ([pd.DataFrame(errores)] if errores else [])
+    df_resumen = pd.concat(resumenes, ignore_index=True) if resumenes else pd.DataFrame()
+    if cursos_con_error: # Las filas de curso no tienen tarea: entero con nulos, no float
+        df_resumen["assignment_id"] = df_resumen["assignment_id"].astype("Int64")
+    return df_filas, df_resumen
+
+
+def _escribir_salidas(df_filas, df_resumen, salida, formato, umbral_dias, silencioso):
+    ruta_filas = _escribir(df_filas, os.path.join(salida, "filas"), formato)
+    ruta_resumen = _escribir(df_resumen, os.path.join(salida, "resumen"), formato)
+    total_retrasados = int(df_resumen["retrasados"].sum()) if "retrasados" in df_resumen.columns else 0
+    _log(f"Listo: {len(df_resumen)} tareas, {len(df_filas)} filas, {total_retrasados} calificaciones con "
+         f"más de {umbral_dias} días. Salidas: {ruta_filas}, {ruta_resumen}", silencioso)
+    if hay_errores(df_resumen):
+        errores = df_resumen["error"].value_counts()
+        _log(f"AVISO: {errores.get(ERROR_CURSO, 0)} cursos y {errores.get(ERROR_TAREA, 0)} tareas con error "
+             "(columna `error` del resumen). Repite con --reanudar para reintentarlos.", silencioso)
+
+
+def ejecutar_auditoria(course_ids, salida, umbral_dias=UMBRAL_DIAS_POR_DEFECTO, formato="csv",
+                       max_workers=MAX_WORKERS, chunk_size=ASIGNACIONES_CHUNK_SIZE, reanudar=False,
+                       incremental=False, silencioso=False):
+    """
+    Ejecuta la auditoría completa y escribe en `salida`:
+      - filas.<formato>:   una fila por participante y tarea, con la marca `retrasado`
+      - resumen.<formato>: una fila por tarea (participantes, calificados, retrasados, mediana...)
+        y una por curso o tarea que falló, con el motivo en la columna `error`
+    El avance se guarda en salida/checkpoint/ (tareas consultadas + un archivo por lote de tareas
+    analizadas); con reanudar=True solo se consultan y analizan los cursos y tareas que faltan o
+    fallaron.
+    """
+    df_filas, df_resumen = _auditar_cursos(course_ids, os.path.join(salida, "checkpoint"), umbral_dias,
+                                           max_workers, chunk_size, reanudar, incremental, silencioso)
+    _escribir_salidas(df_filas, df_resumen, salida, formato, umbral_dias, silencioso)
+    return df_filas, df_resumen
+
+
+# --- Modo por shards (varios procesos) ---
+
+def _iniciar_proceso_shard(url_base, token, procesos, log_nivel, log_formato):
+    """
+    Inicializador de cada proceso del pool: cliente propio (sesión HTTP, caché) con su parte
+    de los límites de tráfico (entre todos los procesos no superan los de uno solo) y logging.
+    """
+    configurar(url_base=url_base, token=token, trafico=ControlTrafico.repartido(procesos))
+    if log_nivel:
+        configurar_logging(log_nivel, log_formato)
+
+
+def _procesar_shard(dir_shard, course_ids, umbral_dias, max_workers, chunk_size, incremental):
+    """
+    Audita un shard dentro de un proceso del pool. Si no hubo errores, el resultado se escribe
+    en dir_shard/resultado.pkl con un renombrado atómico: si existe, el shard está completo.
+    Un shard interrumpido o con errores se retoma desde sus lotes en dir_shard/checkpoint/.
+    Devuelve (tareas, cursos y tareas con error, segundos).
+    """
+    inicio = time.time()
+    df_filas, df_resumen = _auditar_cursos(course_ids, os.path.join(dir_shard, "checkpoint"), umbral_dias,
+                                           max_workers, chunk_size, reanudar=True, incremental=incremental,
+                                           silencioso=True)
+    n_errores = int(df_resumen["error"].notna().sum()) if hay_errores(df_resumen) else 0
+    if not n_errores:
+        ruta = os.path.join(dir_shard, "resultado.pkl")
+        pd.to_pickle({"filas": df_filas, "resumen": df_resumen}, ruta + ".tmp")
+        os.replace(ruta + ".tmp", ruta)
+    METRICAS.guardar(os.path.join(dir_shard, "metricas.json"))
+    return len(df_resumen) - n_errores, n_errores, time.time() - inicio
+
+
+def _cargar_manifiesto(dir_shards, course_ids, cursos_por_shard, reanudar, silencioso):
+    """
+    Reparto de cursos en shards y cursos por shard con que se hizo. Al reanudar se reutiliza el
+    del manifiesto guardado, de modo que cada shard completo sigue correspondiendo a los mismos
+    cursos; un `cursos_por_shard` explícito distinto del del manifiesto se rechaza.
+    """
+    ruta = os.path.join(dir_shards, "manifiesto.json")
+    if reanudar and os.path.exists(ruta):
+        with open(ruta, encoding="utf-8") as f:
+            manifiesto = json.load(f)
+        shards = manifiesto["shards"]
+        if sorted(c for shard in shards for c in shard) != sorted(course_ids):
+            raise ValueError(f"Los cursos no coinciden con los del checkpoint en {dir_shards}; "
+                             "ejecuta sin --reanudar para empezar de nuevo")
+        if cursos_por_shard is not None and cursos_por_shard != manifiesto["cursos_por_shard"]:
+            raise ValueError(f"El checkpoint en {dir_shards} usa {manifiesto['cursos_por_shard']} cursos por "
+                             f"shard, no {cursos_por_shard}; omite --cursos-por-shard o ejecuta sin --reanudar")
+        _log(f"Reanudando: {len(shards)} shards según {ruta}.", silencioso)
+        return shards, manifiesto["cursos_por_shard"]
+    if cursos_por_shard is None:
+        cursos_por_shard = CURSOS_POR_SHARD
+    if os.path.isdir(dir_shards):
+        shutil.rmtree(dir_shards)
+    os.makedirs(dir_shards)
+    shards = [course_ids[i:i + cursos_por_shard] for i in range(0, len(course_ids), cursos_por_shard)]
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump({"cursos_por_shard": cursos_por_shard, "shards": shards}, f)
+    return shards, cursos_por_shard
+
+
+def ejecutar_auditoria_por_shards(course_ids, salida, procesos=None, cursos_por_shard=None,
+                                  umbral_dias=UMBRAL_DIAS_POR_DEFECTO, formato="csv", max_workers=MAX_WORKERS,
+                                  chunk_size=ASIGNACIONES_CHUNK_SIZE, reanudar=False, incremental=False,
+                                  silencioso=False, log_nivel=None, log_formato="texto"):
+    """
+    Como ejecutar_auditoria, pero reparte los cursos en shards de `cursos_por_shard` (por defecto
+    CURSOS_POR_SHARD, o los del manifiesto al reanudar) y los procesa en `procesos` procesos (por
+    defecto, uno por núcleo; como mucho MAX_CONCURRENCIA), cada uno con `max_workers` hilos y
+    1/procesos de los límites de tráfico hacia Moodle. Cada shard guarda su resultado en
+    salida/shards/shard_NNNNN/; con reanudar=True solo se procesan los shards sin terminar (y
+    cada uno continúa desde sus propios lotes).
+    Al final se unen todos los shards en las mismas salidas que ejecutar_auditoria. Si algún
+    shard falla o tiene cursos o tareas con error no se escriben las salidas y se devuelve None:
+    basta repetir con --reanudar.
+    """
+    dir_shards = os.path.join(salida, "shards")
+    shards, cursos_por_shard = _cargar_manifiesto(dir_shards, course_ids, cursos_por_shard, reanudar, silencioso)
+    dirs = [os.path.join(dir_shards, f"shard_{i:05d}") for i in range(len(shards))]
+    pendientes = [i for i, d in enumerate(dirs) if not os.path.exists(os.path.join(d, "resultado.pkl"))]
+    procesos = max(1, min(procesos or os.cpu_count() or 1, len(pendientes) or 1))
+    if procesos > MAX_CONCURRENCIA:
+        # Con más procesos, cada uno tendría menos de una petición simultánea y juntos superarían el límite
+        _log(f"Limitando a {MAX_CONCURRENCIA} procesos (concurrencia máxima hacia Moodle).", silencioso)
+        procesos = MAX_CONCURRENCIA
+    _log(f"{len(shards)} shards de hasta {cursos_por_shard} cursos; {len(pendientes)} pendientes, "
+         f"{procesos} procesos x {max_workers} hilos.", silencioso)
+
+    # La configuración se resuelve aquí (entorno o secrets) y se pasa explícitamente a cada proceso.
+    # spawn en lugar de fork: ningún proceso hereda sesiones HTTP ni conexiones SQLite del padre.
+    url_base, token = resolver_configuracion()
+    fallidos = []
+    inicio = time.time()
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_iniciar_proceso_shard, initargs=(url_base, token, procesos, log_nivel, log_formato)) as pool:
+        futuros = {pool.submit(_procesar_shard, dirs[i], shards[i], umbral_dias, max_workers, chunk_size,
+                               incremental): i for i in pendientes}
+        for completados, futuro in enumerate(as_completed(futuros), start=1):
+            i = futuros[futuro]
+            try:
+                n_tareas, n_errores, segundos = futuro.result()
+            except Exception as e:
+                fallidos.append(i)
+                _log(f"  ERROR en shard {i}: {type(e).__name__}: {e}", silencioso)
+                continue
+            if n_errores:
+                fallidos.append(i)
+                _log(f"  ERROR en shard {i}: {n_errores} cursos o tareas con error ({n_tareas} tareas bien)", silencioso)
+                continue
+            _log(f"  shard {i} listo: {n_tareas} tareas en {segundos:.1f} s "
+                 f"({completados}/{len(pendientes)}, {time.time() - inicio:.0f} s transcurridos)", silencioso)
+
+    if fallidos:
+        _log(f"{len(fallidos)} shards fallaron ({sorted(fallidos)[:20]}); no se escriben las salidas. "
+             "Repite con --reanudar para procesar solo los que faltan.", silencioso)
+        return None
+
+    # Unión de los shards en el orden del manifiesto
+    resultados = [pd.read_pickle(os.path.join(d, "resultado.pkl")) for d in dirs]
+    filas = [r["filas"] for r in resultados if not r["filas"].empty]
+    resumenes = [r["resumen"] for r in resultados if not r["resumen"].empty]
+    df_filas = pd.concat(filas, ignore_index=True) if filas else pd.DataFrame()
+    df_resumen = pd.concat(resumenes, ignore_index=True) if resumenes else pd.DataFrame()
+    _escribir_salidas(df_filas, df_resumen, salida, formato, umbral_dias, silencioso)
+    return df_filas, df_resumen
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Auditoría de tiempos de calificación en Moodle (sin interfaz).")
+    parser.add_argument("csv_cursos", help="CSV con una columna 'id' de cursos")
+    parser.add_argument("--salida", default="auditoria_salida", help="Directorio de salida (por defecto: %(default)s)")
+    parser.add_argument("--umbral-dias", type=float, default=UMBRAL_DIAS_POR_DEFECTO,
+                        help="Días a partir de los cuales una calificación se considera con retraso (por defecto: %(default)s)")
+    parser.add_argument("--formato", choices=("csv", "parquet"), default="csv")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Hilos concurrentes (por defecto: %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=ASIGNACIONES_CHUNK_SIZE,
+                        help="Tareas por llamada de submisiones/calificaciones (por defecto: %(default)s)")
+    parser.add_argument("--reanudar", action="store_true", help="Continuar desde el checkpoint de una ejecución anterior")
+    parser.add_argument("--incremental", action="store_true", help="Usar la sincronización incremental (since)")
+    parser.add_argument("--procesos", type=int, nargs="?", const=0,
+                        help="Modo por shards en varios procesos (sin valor: uno por núcleo); --workers son hilos por proceso")
+    parser.add_argument("--cursos-por-shard", type=int,
+                        help=f"Cursos por shard en el modo por shards (por defecto: {CURSOS_POR_SHARD}, "
+                             "o los del checkpoint con --reanudar)")
+    parser.add_argument("--silencioso", action="store_true", help="No mostrar el progreso")
+    parser.add_argument("--log-nivel", choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+                        help="Activa el logging de la capa de servicios (desactivado por defecto)")
+    parser.add_argument("--log-formato", choices=("texto", "json"), default="texto")
+    parser.add_argument("--metricas", help="Guarda las métricas al terminar (.json = JSON, otro = texto Prometheus)")
+    args = parser.parse_args(argv)
+
+    if args.log_nivel:
+        configurar_logging(args.log_nivel, args.log_formato)
+
+    opciones = dict(umbral_dias=args.umbral_dias, formato=args.formato, max_workers=args.workers,
+                    chunk_size=args.chunk_size, reanudar=args.reanudar, incremental=args.incremental,
+                    silencioso=args.silencioso)
+    if args.procesos is not None:
+        # Las métricas de cada proceso quedan en salida/shards/shard_NNNNN/metricas.json
+        resultado = ejecutar_auditoria_por_shards(
+            leer_ids_cursos(args.csv_cursos), args.salida, procesos=args.procesos or None,
+            cursos_por_shard=args.cursos_por_shard, log_nivel=args.log_nivel, log_formato=args.log_formato,
+            **opciones)
+        if resultado is None:
+            sys.exit(1)
+        return
+    _, df_resumen = ejecutar_auditoria(leer_ids_cursos(args.csv_cursos), args.salida, **opciones)
+    if args.metricas:
+        METRICAS.guardar(args.metricas)
+    if hay_errores(df_resumen):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
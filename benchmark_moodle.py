@@ -0,0 +1,195 @@
+# benchmark_moodle.py
+# Benchmarks de extremo a extremo contra el servidor Moodle falso (fake_moodle_server.py).
+#
+# Uso:
+#   python benchmark_moodle.py                                  # todos los tamaños, muestra resultados
+#   python benchmark_moodle.py --guardar-baseline               # guarda benchmark_baseline.json
+#   python benchmark_moodle.py --comparar --tolerancia 0.25     # falla (exit 1) si hay regresiones
+#   python benchmark_moodle.py --tamanos pequeno --latencia-ms 20
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+from analisis_tiempos import ResumenLatencias, reporte_retrasos
+from fake_moodle_server import ConfigFalsa, ServidorMoodleFalso
+from moodle_cache import modo_cache
+from moodle_metricas import METRICAS
+import moodle_services
+
+RUTA_BASELINE = "benchmark_baseline.json"
+
+# Tamaños de datos: cursos a consultar y tamaño de cada curso en el servidor falso
+TAMANOS = {
+    "pequeno": {"cursos": 5,  "tareas_por_curso": 4, "participantes": 50},
+    "mediano": {"cursos": 20, "tareas_por_curso": 5, "participantes": 200},
+    "grande":  {"cursos": 40, "tareas_por_curso": 6, "participantes": 800},
+}
+
+UMBRAL_DIAS = 7
+# Umbrales (días) que se recorren para medir el cambio de umbral en el reporte
+UMBRALES_CAMBIO = (1, 3, 5, 7, 10, 14, 21, 30)
+
+
+def _medir(funcion, repeticiones, servidor):
+    """
+    Ejecuta `funcion` `repeticiones` veces y una vez más bajo tracemalloc. `funcion` devuelve el
+    número de elementos procesados, o (elementos, segundos) si mide ella misma solo una parte.
+    Devuelve mediana de segundos, elementos/s, pico de memoria y peticiones.
+    """
+    tiempos = []
+    for _ in range(repeticiones):
+        servidor.reiniciar_conteo()
+        METRICAS.reiniciar()
+        inicio = time.perf_counter()
+        elementos = funcion()
+        segundos = time.perf_counter() - inicio
+        if isinstance(elementos, tuple):
+            elementos, segundos = elementos
+        tiempos.append(segundos)
+    peticiones = servidor.total_peticiones()
+    transferencia = METRICAS.ahorro_transferencia()
+
+    # Medición de memoria aparte: tracemalloc ralentiza la ejecución y falsearía los tiempos
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    segundos = statistics.median(tiempos)
+    return {
+        "segundos": round(segundos, 4),
+        "elementos": elementos,
+        "elementos_por_s": round(elementos / segundos, 1) if segundos else None,
+        "pico_memoria_mb": round(pico / 2**20, 2),
+        "peticiones": peticiones,
+        "bytes_recibidos": transferencia["bytes_json"],
+        "bytes_red": transferencia["bytes_red"],
+    }
+
+
+def ejecutar_tamano(nombre, tamano, repeticiones=3, latencia_ms=0.0):
+    """Levanta un servidor falso del tamaño indicado y mide cada etapa de la app."""
+    config = ConfigFalsa(tareas_por_curso=tamano["tareas_por_curso"], participantes=tamano["participantes"],
+                         latencia_ms=latencia_ms)
+    servidor = ServidorMoodleFalso(config).iniciar()
+    # Sin caché en disco: se mide el camino completo de red + parseo + análisis
+    moodle_services.configurar(url_base=servidor.url, token="benchmark", cache=None)
+    course_ids = list(range(1, tamano["cursos"] + 1))
+    assignids = [t["id"] for c in course_ids for t in servidor.datos.tareas_de_curso(c)]
+    analisis = {}
+
+    def etapa_tareas():
+        for course_id in course_ids:
+            moodle_services.obtener_tareas_por_curso(course_id)
+        return len(course_ids)
+
+    def etapa_analisis():
+        for assignid in assignids:
+            analisis[assignid] = moodle_services.analizar_tiempos_calificacion_tarea(assignid)
+        return len(assignids)
+
+    def etapa_reporte():
+        reporte_retrasos(analisis, {}, UMBRAL_DIAS)
+        return sum(len(df) for df in analisis.values())
+
+    def etapa_cambios_umbral():
+        # Lo que paga la pestaña 3 al mover el umbral: el resumen ya está construido y formateado
+        resumen = ResumenLatencias(analisis)
+        resumen.reporte({}, 0)
+        inicio = time.perf_counter()
+        for umbral in UMBRALES_CAMBIO:
+            resumen.reporte({}, umbral)
+        return len(UMBRALES_CAMBIO) * sum(len(df) for df in analisis.values()), time.perf_counter() - inicio
+
+    try:
+        with modo_cache("omitir"):
+            resultados = {
+                "obtener_tareas_por_curso": _medir(etapa_tareas, repeticiones, servidor),
+                "analizar_tiempos_calificacion_tarea": _medir(etapa_analisis, repeticiones, servidor),
+                "reporte_retrasos": _medir(etapa_reporte, repeticiones, servidor),
+                "reporte_retrasos_cambio_umbral": _medir(etapa_cambios_umbral, repeticiones, servidor),
+            }
+    finally:
+        servidor.detener()
+        moodle_services.configurar()
+    return {"tamano": tamano, "latencia_ms": latencia_ms, "etapas": resultados}
+
+
+def comparar(actual, baseline, tolerancia):
+    """
+    Lista de regresiones (textos) de `actual` frente a `baseline`: más tiempo o memoria que
+    la baseline * (1 + tolerancia), o más peticiones que la baseline.
+    """
+    regresiones = []
+    for tamano, datos in actual["resultados"].items():
+        base_tamano = baseline.get("resultados", {}).get(tamano)
+        if base_tamano is None:
+            continue
+        for etapa, medida in datos["etapas"].items():
+            base = base_tamano["etapas"].get(etapa)
+            if base is None:
+                continue
+            for campo in ("segundos", "pico_memoria_mb"):
+                if base[campo] and medida[campo] > base[campo] * (1 + tolerancia):
+                    regresiones.append(f"{tamano}/{etapa}: {campo} {base[campo]} -> {medida[campo]} "
+                                       f"(+{(medida[campo] / base[campo] - 1):.0%})")
+            if medida["peticiones"] > base["peticiones"]:
+                regresiones.append(f"{tamano}/{etapa}: peticiones {base['peticiones']} -> {medida['peticiones']}")
+    return regresiones
+
+
+def _imprimir(resultados):
+    print(f"{'tamaño':<9} {'etapa':<38} {'s':>8} {'elem/s':>10} {'pico MB':>8} {'peticiones':>10} "
+          f"{'MB JSON':>8} {'MB red':>8}")
+    for tamano, datos in resultados.items():
+        for etapa, m in datos["etapas"].items():
+            print(f"{tamano:<9} {etapa:<38} {m['segundos']:>8.3f} {m['elementos_por_s'] or 0:>10.1f} "
+                  f"{m['pico_memoria_mb']:>8.2f} {m['peticiones']:>10} {m['bytes_recibidos'] / 2**20:>8.2f} "
+                  f"{m.get('bytes_red', 0) / 2**20:>8.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de extremo a extremo contra un Moodle falso local.")
+    parser.add_argument("--tamanos", nargs="+", choices=tuple(TAMANOS), default=list(TAMANOS))
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--latencia-ms", type=float, default=0.0, help="Latencia simulada por petición")
+    parser.add_argument("--guardar-baseline", nargs="?", const=RUTA_BASELINE, metavar="RUTA")
+    parser.add_argument("--comparar", nargs="?", const=RUTA_BASELINE, metavar="RUTA")
+    parser.add_argument("--tolerancia", type=float, default=0.2,
+                        help="Margen relativo de tiempo/memoria antes de considerar regresión (por defecto: %(default)s)")
+    args = parser.parse_args(argv)
+
+    actual = {
+        "generado": time.time(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "resultados": {nombre: ejecutar_tamano(nombre, TAMANOS[nombre], args.repeticiones, args.latencia_ms)
+                       for nombre in args.tamanos},
+    }
+    _imprimir(actual["resultados"])
+
+    if args.guardar_baseline:
+        with open(args.guardar_baseline, "w", encoding="utf-8") as f:
+            json.dump(actual, f, indent=2)
+        print(f"Baseline guardada en {args.guardar_baseline}")
+
+    if args.comparar:
+        if not os.path.exists(args.comparar):
+            print(f"No existe la baseline {args.comparar}; ejecuta primero con --guardar-baseline", file=sys.stderr)
+            return 2
+        with open(args.comparar, encoding="utf-8") as f:
+            regresiones = comparar(actual, json.load(f), args.tolerancia)
+        if regresiones:
+            print("REGRESIONES:", *regresiones, sep="\n  ")
+            return 1
+        print("Sin regresiones frente a la baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+# catalogo_tareas.py
+# Catálogo indexado de las tareas consultadas en la pestaña 1, construido una vez por consulta y
+# compartido por las pestañas 1 y 2 para seleccionar, filtrar y pintar tablas sin recorrer la lista.
+import numpy as np
+import pandas as pd
+
+from moodle_cache import estimar_bytes
+
+# Columnas de fecha (epoch) por las que se puede filtrar por rango
+CAMPOS_FECHA = ("duedate_ts", "gradingduedate_ts", "allowsubmissionsfromdate_ts", "cutoffdate_ts")
+
+
+def etiqueta_tarea(tarea):
+    """Texto con que se muestra una tarea en los selectores de la app."""
+    return (f"{tarea.get('name', 'Tarea s/n')} (Curso ID: {tarea.get('courseid_original_request', 'Desconocido')}, "
+            f"Tarea ID: {tarea.get('id', 'N/A')})")
+
+
+class _IndiceFechas:
+    """Fechas de un campo ordenadas con los ids de sus tareas: un rango es una búsqueda binaria."""
+    __slots__ = ("fechas", "ids")
+
+    def __init__(self, ids, fechas):
+        fechas = np.asarray(fechas, dtype="float64")
+        validas = np.flatnonzero(fechas > 0) # Sin fecha configurada (0/None) nunca entra en un rango
+        orden = validas[np.argsort(fechas[validas], kind="stable")]
+        self.fechas = fechas[orden]
+        self.ids = np.asarray(ids, dtype="int64")[orden]
+
+    def entre(self, desde=None, hasta=None):
+        inicio = 0 if desde is None else np.searchsorted(self.fechas, desde, side="left")
+        fin = len(self.fechas) if hasta is None else np.searchsorted(self.fechas, hasta, side="right")
+        return self.ids[inicio:fin]
+
+
+class CatalogoTareas:
+    """
+    Índices sobre una lista de tareas (formato de moodle_services._formatear_tarea): por id
+    (dict), por curso (ids en el orden de la consulta) y por rango de cada fecha de CAMPOS_FECHA
+    (arrays ordenados). Las etiquetas y las tablas para mostrar se generan una sola vez.
+    Las tareas son los mismos dicts de la lista de origen, no copias.
+    """
+
+    def __init__(self, tareas):
+        self.por_id = {}
+        self.ids_por_curso = {}
+        for tarea in tareas:
+            if tarea["id"] in self.por_id:
+                continue # Una tarea repetida (mismo curso pedido dos veces) se indexa una vez
+            self.por_id[tarea["id"]] = tarea
+            self.ids_por_curso.setdefault(tarea.get("courseid_original_request"), []).append(tarea["id"])
+        self.ids = list(self.por_id)
+        self.etiquetas = {assignid: etiqueta_tarea(t) for assignid, t in self.por_id.items()}
+        self.curso_por_tarea = {assignid: t.get("courseid_original_request") for assignid, t in self.por_id.items()}
+        self._indices_fecha = {
+            campo: _IndiceFechas(self.ids, [self.por_id[i].get(campo) or 0 for i in self.ids])
+            for campo in CAMPOS_FECHA
+        }
+        self._tabla_consulta = None
+        self._tabla_fechas = None
+
+    def __len__(self):
+        return len(self.por_id)
+
+    def __contains__(self, assignid):
+        return assignid in self.por_id
+
+    def __bool__(self):
+        return bool(self.por_id)
+
+    def get(self, assignid):
+        return self.por_id.get(assignid)
+
+    def memoria_bytes(self):
+        """Tamaño aproximado en memoria (tareas, índices y tablas ya generadas)."""
+        tablas = [t for t in (self._tabla_consulta, self._tabla_fechas) if t is not None]
+        return (estimar_bytes(list(self.por_id.values())) + estimar_bytes(self.etiquetas)
+                + sum(i.fechas.nbytes + i.ids.nbytes for i in self._indices_fecha.values())
+                + sum(estimar_bytes(t) for t in tablas))
+
+    def cursos(self):
+        return list(self.ids_por_curso)
+
+    def filtrar(self, cursos=None, rangos=None):
+        """
+        Ids (en el orden del catálogo) de las tareas de `cursos` (todos si None) cuyas fechas
+        caen en `rangos` = {campo: (desde_ts, hasta_ts)}, con None como extremo abierto.
+        """
+        candidatos = None
+        if cursos is not None:
+            candidatos = {i for c in cursos for i in self.ids_por_curso.get(c, ())}
+        for campo, (desde, hasta) in (rangos or {}).items():
+            if desde is None and hasta is None:
+                continue
+            en_rango = set(self._indices_fecha[campo].entre(desde, hasta).tolist())
+            candidatos = en_rango if candidatos is None else candidatos & en_rango
+        if candidatos is None:
+            return list(self.ids)
+        return [i for i in self.ids if i in candidatos]
+
+    def tabla_consulta(self):
+        """Tabla "Resultados de la consulta" de la pestaña 1 (una fila por tarea)."""
+        if self._tabla_consulta is None:
+            tareas = self.por_id.values()
+            self._tabla_consulta = pd.DataFrame({
+                'ID Curso': [t.get('courseid_original_request', 'N/A') for t in tareas],
+                'ID Tarea': list(self.por_id),
+                'Nombre Tarea': [t.get('name', 'N/A') for t in tareas],
+                'Envíos desde': [t.get('allowsubmissionsfromdate_str', 'N/A') for t in tareas],
+                'Fecha Entrega': [t.get('duedate_str', 'N/A') for t in tareas],
+                'Fecha Límite': [t.get('cutoffdate_str', 'N/A') for t in tareas],
+                'Calificación esperada': [t.get('gradingduedate_str', 'N/A') for t in tareas],
+            })
+        return self._tabla_consulta
+
+    def tabla_fechas(self, assignids):
+        """Fechas de configuración de `assignids` (en ese orden; los que no existen se omiten)."""
+        if self._tabla_fechas is None:
+            consulta = self.tabla_consulta()
+            self._tabla_fechas = pd.DataFrame({
+                "Nombre Tarea": consulta['Nombre Tarea'],
+                "ID Tarea": consulta['ID Tarea'],
+                "Envíos desde": consulta['Envíos desde'],
+                "Entrega": consulta['Fecha Entrega'],
+                "Límite": consulta['Fecha Límite'],
+                "Calificación esperada": consulta['Calificación esperada'],
+            }).set_index(consulta['ID Tarea'].rename(None))
+        ids = [i for i in assignids if i in self.por_id]
+        return self._tabla_fechas.loc[ids].reset_index(drop=True)
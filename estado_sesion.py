@@ -0,0 +1,115 @@
+# estado_sesion.py
+# Resultados de cada sesión de Streamlit guardados fuera de st.session_state, en la CacheMemoria
+# compartida por todas las sesiones y acotada por un presupuesto global de memoria (LRU).
+#
+# La sesión solo guarda asas ligeras: los IDs de curso consultados y los IDs de tarea analizados
+# (más las tablas con error, que no entran en la caché).
+# Si el catálogo o una tabla de análisis se expulsó de la memoria, se vuelve a materializar al
+# leerla: desde el almacén local o la caché en disco si están, o descargándola de Moodle.
+import logging
+import os
+import uuid
+
+import streamlit as st
+
+from analisis_tiempos import ResumenLatencias, es_error, tabla_vacia
+from catalogo_tareas import CatalogoTareas
+from moodle_cache import CacheMemoria
+from moodle_metricas import log_evento
+from moodle_services import clave_memo, iterar_analisis_memo, obtener_tareas_por_cursos_memo
+
+# Presupuesto de memoria (MB) para los resultados de todas las sesiones del proceso
+MEMORIA_MAX_MB = float(os.environ.get("MOODLE_MEMORIA_MAX_MB", 1024))
+# TTL en memoria de lo que pertenece a una sesión (catálogo, resumen): lo acota sobre todo el LRU
+TTL_RESULTADOS_SESION = 12 * 3600
+
+
+@st.cache_resource(show_spinner=False)
+def cache_compartida():
+    """CacheMemoria única del proceso: tareas, análisis, catálogos y resúmenes de todas las sesiones."""
+    return CacheMemoria(max_entries=5000, max_bytes=int(MEMORIA_MAX_MB * 2**20))
+
+
+def limpiar_sesion():
+    """Olvida la consulta y el análisis de la sesión (lo compartido sigue en la caché)."""
+    st.session_state.consulta_cursos = ()
+    st.session_state.asa_analisis = None
+
+
+def guardar_consulta(course_ids, catalogo):
+    """Publica el catálogo de la consulta en la caché compartida; la sesión guarda solo los IDs."""
+    course_ids = tuple(course_ids)
+    catalogo.tabla_consulta() # Se mide al guardarlo: mejor con la tabla ya generada
+    cache_compartida().set(clave_memo("catalogo", course_ids), catalogo, ttl=TTL_RESULTADOS_SESION)
+    st.session_state.consulta_cursos = course_ids
+
+
+def catalogo_sesion():
+    """CatalogoTareas de la última consulta de la sesión (vacío si no hay), rematerializado si hace falta."""
+    course_ids = st.session_state.get("consulta_cursos")
+    if not course_ids:
+        return CatalogoTareas([])
+    memo = cache_compartida()
+    catalogo = memo.get(clave_memo("catalogo", course_ids))
+    if catalogo is None:
+        log_evento(logging.INFO, "sesion_rematerializada", tipo="catalogo", cursos=len(course_ids))
+        tareas_por_curso = obtener_tareas_por_cursos_memo(memo, course_ids)
+        catalogo = CatalogoTareas([t for tareas in tareas_por_curso.values() if tareas for t in tareas])
+        guardar_consulta(course_ids, catalogo)
+    return catalogo
+
+
+def guardar_analisis(analisis_por_tarea):
+    """
+    Registra en la sesión un análisis completo ({assignid: tabla}) y construye su resumen de
+    latencias con esas mismas tablas, sin volver a leerlas. Las tablas con datos ya están en la
+    caché compartida (iterar_analisis_memo las guarda); la sesión se queda con los IDs, en orden,
+    cuáles salieron vacías y, enteras y con su marca, las que tienen error (no entran en la caché).
+    """
+    asa = {
+        "id": uuid.uuid4().hex,
+        "tareas": tuple(analisis_por_tarea),
+        "vacias": frozenset(a for a, df in analisis_por_tarea.items() if df.empty and not es_error(df)),
+        "errores": {a: df for a, df in analisis_por_tarea.items() if es_error(df)},
+    }
+    st.session_state.asa_analisis = asa
+    resumen = ResumenLatencias(analisis_por_tarea, catalogo_sesion().curso_por_tarea)
+    cache_compartida().set(("resumen", asa["id"]), resumen, ttl=TTL_RESULTADOS_SESION)
+
+
+def hay_analisis():
+    return bool(st.session_state.get("asa_analisis"))
+
+
+def analisis_sesion():
+    """{assignid: tabla de análisis} del último análisis de la sesión, rematerializando lo expulsado."""
+    asa = st.session_state.get("asa_analisis")
+    if not asa:
+        return {}
+    memo = cache_compartida()
+    analisis = {}
+    for assignid in asa["tareas"]:
+        if assignid in asa["errores"]:
+            analisis[assignid] = asa["errores"][assignid]
+        elif assignid in asa["vacias"]:
+            analisis[assignid] = tabla_vacia(assignid)
+        else:
+            analisis[assignid] = memo.get(clave_memo("analisis", assignid))
+    faltantes = [assignid for assignid, df in analisis.items() if df is None]
+    if faltantes:
+        log_evento(logging.INFO, "sesion_rematerializada", tipo="analisis", tareas=len(faltantes))
+        analisis.update(iterar_analisis_memo(memo, faltantes))
+    return analisis
+
+
+def resumen_sesion():
+    """ResumenLatencias del análisis de la sesión (None si no hay), construido una vez y compartido en la caché."""
+    asa = st.session_state.get("asa_analisis")
+    if not asa:
+        return None
+    memo = cache_compartida()
+    resumen = memo.get(("resumen", asa["id"]))
+    if resumen is None:
+        resumen = ResumenLatencias(analisis_sesion(), catalogo_sesion().curso_por_tarea)
+        memo.set(("resumen", asa["id"]), resumen, ttl=TTL_RESULTADOS_SESION)
+    return resumen
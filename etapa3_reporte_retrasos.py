@@ -2,70 +2,91 @@
 import streamlit as st
 import pandas as pd # Necesitarás pandas: pip install pandas
 
-def display_reporte_retrasos():
-    st.header("3. Reporte de Tareas Calificadas con Retraso (+7 días)")
+from almacen_resultados import get_almacen_resultados
+from estado_sesion import catalogo_sesion, hay_analisis, resumen_sesion
 
-    if 'analisis_completos' not in st.session_state or not st.session_state.analisis_completos:
-        st.info("Realiza un análisis de tiempos de calificación en la Pestaña 2 para ver este reporte.")
+def obtener_resumen_latencias():
+    """
+    ResumenLatencias del análisis actual. Se construye una sola vez por análisis (la pestaña 2
+    lo construye al terminar) y se guarda en la caché compartida, no en la sesión: si se
+    expulsó por memoria, se reconstruye aquí.
+    """
+    return resumen_sesion()
+
+
+def display_reporte_historico(umbral_dias):
+    """
+    Reporte de retrasos sobre análisis guardados en el histórico (almacen_resultados). Solo se
+    leen del disco las columnas del reporte y las filas por encima del umbral.
+    """
+    almacen = get_almacen_resultados()
+    if almacen is None:
         return
+    with st.expander("Histórico de análisis anteriores", expanded=False):
+        ejecuciones = almacen.ejecuciones()
+        if ejecuciones.empty:
+            st.info("Todavía no hay análisis guardados en el histórico.")
+            return
+        etiquetas = {
+            fila.run_id: f"{fila.run_id} ({fila.tareas} tareas, {fila.filas} participantes)"
+            for fila in ejecuciones.itertuples()
+        }
+        seleccion = st.multiselect(
+            "Análisis a comparar", options=list(etiquetas), default=list(etiquetas)[:2],
+            format_func=etiquetas.get, key="historico_ejecuciones_tab3",
+        )
+        if not seleccion:
+            return
+        resumen, detalle = almacen.reporte_retrasos(umbral_dias, ejecuciones=seleccion)
+        if resumen.empty:
+            st.success(f"Ningún análisis seleccionado tiene calificaciones con más de {umbral_dias:g} días.")
+            return
+        st.dataframe(resumen, use_container_width=True)
+        st.dataframe(detalle, use_container_width=True)
 
-    # st.session_state.analisis_completos es un diccionario {assign_id: [lista_de_resultados_analisis]}
-    
-    tareas_con_retraso_general = {} # {assign_id: contador_retrasos}
-    estudiantes_con_retraso_detalle = [] # Lista de diccionarios para tabla detallada
 
-    # Definir el umbral de retraso (7 días en segundos)
-    RETRASO_UMBRAL_DIAS = 7
-    RETRASO_UMBRAL_SEGUNDOS = RETRASO_UMBRAL_DIAS * 24 * 60 * 60
+def display_reporte_retrasos():
+    st.header("3. Reporte de Tareas Calificadas con Retraso")
+
+    if not hay_analisis():
+        st.info("Realiza un análisis de tiempos de calificación en la Pestaña 2 para ver este reporte.")
+        umbral_historico = st.number_input(
+            "Umbral de retraso (días)", min_value=0.0, max_value=365.0, value=7.0, step=0.5,
+            key="umbral_retraso_dias_tab3",
+        )
+        display_reporte_historico(umbral_historico)
+        return
 
-    for assign_id, resultados_analisis in st.session_state.analisis_completos.items():
-        if not resultados_analisis: # Si no hay resultados para esta tarea
-            continue
+    # El análisis de la sesión es un diccionario {assign_id: tabla_de_analisis (DataFrame columnar)}.
+    # Las latencias ya están ordenadas y agregadas en el ResumenLatencias: cambiar el umbral es una
+    # búsqueda binaria por tarea, sin recorrer las filas.
+    resumen = obtener_resumen_latencias()
+    RETRASO_UMBRAL_DIAS = st.number_input(
+        "Umbral de retraso (días)", min_value=0.0, max_value=365.0, value=7.0, step=0.5,
+        key="umbral_retraso_dias_tab3",
+    )
 
-        # Obtener nombre de la tarea para el reporte
-        # Asumimos que 'tasks_for_analysis_options_display' tiene la info
-        task_display_name = st.session_state.get('tasks_for_analysis_options_display', {}).get(assign_id, f"Tarea ID: {assign_id}")
-        
-        contador_retrasos_tarea = 0
-        for res in resultados_analisis:
-            # Necesitamos la diferencia en segundos o días numéricamente.
-            # La función calculate_time_difference devuelve un string.
-            # Deberíamos modificar analizar_tiempos_calificacion_tarea para que también devuelva la diferencia numérica.
-            # Por ahora, vamos a *asumir* que tenemos acceso a los timestamps.
-            
-            submission_ts = res.get('submission_date_ts')
-            graded_ts = res.get('graded_date_ts')
+    # Nombres de las tareas para el reporte (etiquetas del catálogo de la consulta de la pestaña 1)
+    nombres_tareas = catalogo_sesion().etiquetas
+    tareas_con_retraso_general, df_retrasos = resumen.reporte(nombres_tareas, RETRASO_UMBRAL_DIAS)
+    display_reporte_historico(RETRASO_UMBRAL_DIAS)
 
-            if submission_ts and graded_ts and submission_ts > 0 and graded_ts > 0:
-                diferencia_segundos = graded_ts - submission_ts
-                if graded_ts > submission_ts and diferencia_segundos > RETRASO_UMBRAL_SEGUNDOS:
-                    contador_retrasos_tarea += 1
-                    dias_retraso = diferencia_segundos / (24 * 60 * 60)
-                    estudiantes_con_retraso_detalle.append({
-                        "Tarea": task_display_name,
-                        "Estudiante": res.get('student_name', 'N/A'),
-                        "Fecha Envío": res.get('submission_date_str', 'N/A'),
-                        "Fecha Calificación": res.get('graded_date_str', 'N/A'),
-                        "Días de Retraso (Profesor)": f"{dias_retraso:.1f}"
-                    })
-        
-        if contador_retrasos_tarea > 0:
-            tareas_con_retraso_general[task_display_name] = contador_retrasos_tarea
+    with st.expander("Distribución de tiempos de calificación", expanded=False):
+        total = resumen.total
+        columnas = st.columns(4)
+        columnas[0].metric("Calificaciones", len(total))
+        for columna, (p, valor) in zip(columnas[1:], total.percentiles.items()):
+            columna.metric(f"p{p}", "N/A" if valor is None else f"{valor:.1f} días")
+        st.bar_chart(resumen.histograma())
+        st.dataframe(resumen.tabla_percentiles(nombres_tareas, RETRASO_UMBRAL_DIAS), use_container_width=True)
 
-    if not tareas_con_retraso_general and not estudiantes_con_retraso_detalle:
-        st.success(f"¡Excelente! Ningún profesor tardó más de {RETRASO_UMBRAL_DIAS} días en calificar las tareas analizadas.")
+    if not tareas_con_retraso_general:
+        st.success(f"¡Excelente! Ningún profesor tardó más de {RETRASO_UMBRAL_DIAS:g} días en calificar las tareas analizadas.")
         return
 
     st.subheader("Resumen de Tareas con Calificaciones Retrasadas")
-    if tareas_con_retraso_general:
-        for tarea, count in tareas_con_retraso_general.items():
-            st.write(f"- **{tarea}**: {count} estudiante(s) calificado(s) con más de {RETRASO_UMBRAL_DIAS} días de retraso.")
-    else:
-        st.write(f"No hay tareas con más de {RETRASO_UMBRAL_DIAS} días de retraso en la calificación de los estudiantes analizados.")
+    for tarea, count in tareas_con_retraso_general.items():
+        st.write(f"- **{tarea}**: {count} estudiante(s) calificado(s) con más de {RETRASO_UMBRAL_DIAS:g} días de retraso.")
 
     st.subheader("Detalle de Estudiantes Calificados con Retraso")
-    if estudiantes_con_retraso_detalle:
-        df_retrasos = pd.DataFrame(estudiantes_con_retraso_detalle)
-        st.dataframe(df_retrasos, use_container_width=True)
-    else:
-        st.write("No hay detalles de estudiantes calificados con retraso para mostrar.")
\ No newline at end of file
+    st.dataframe(df_retrasos, use_container_width=True)
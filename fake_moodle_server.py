@@ -0,0 +1,243 @@
+# fake_moodle_server.py
+# Servidor HTTP local que imita los web services de Moodle que usa la app, con datos sintéticos.
+#
+# Uso independiente (para probar la app sin tocar el Moodle de producción):
+#   python fake_moodle_server.py --puerto 8765 --tareas-por-curso 5 --participantes 300
+#   MOODLE_API_URL_BASE=http://127.0.0.1:8765/webservice/rest/server.php MOODLE_API_TOKEN=x streamlit run app.py
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+RUTA_WS = "/webservice/rest/server.php"
+
+# Momento de referencia de los datos sintéticos (fijo para que las ejecuciones sean reproducibles)
+EPOCH_BASE = 1_700_000_000
+DIA = 24 * 3600
+
+
+@dataclass
+class ConfigFalsa:
+    """Tamaño de los datos sintéticos y fallos inyectados."""
+    tareas_por_curso: int = 5
+    participantes: int = 200       # por tarea
+    tasa_envio: float = 0.8        # fracción de participantes con envío "submitted"
+    tasa_calificacion: float = 0.7 # fracción de envíos calificados
+    latencia_ms: float = 0.0       # latencia añadida a cada respuesta
+    jitter_ms: float = 0.0         # +- aleatorio sobre latencia_ms
+    tasa_error: float = 0.0        # probabilidad de responder HTTP 503
+    tasa_excepcion: float = 0.0    # probabilidad de responder un payload {"exception": ...}
+    comprimir: bool = True         # gzip si el cliente envía Accept-Encoding: gzip (como Apache/nginx)
+    semilla: int = 42
+
+
+class DatosSinteticos:
+    """Genera de forma determinista (por semilla + id) cursos, tareas, participantes, envíos y notas."""
+
+    def __init__(self, config):
+        self.config = config
+
+    def _rng(self, *claves):
+        # Semilla de texto: a diferencia de hash(), es estable entre procesos
+        return random.Random(":".join(map(str, (self.config.semilla,) + claves)))
+
+    def tareas_de_curso(self, course_id):
+        rng = self._rng("curso", course_id)
+        tareas = []
+        for k in range(self.config.tareas_por_curso):
+            duedate = EPOCH_BASE + rng.randint(0, 120) * DIA
+            tareas.append({
+                "id": course_id * 1000 + k, "cmid": course_id * 10000 + k, "course": course_id,
+                "name": f"Tarea {k + 1} del curso {course_id}",
+                "duedate": duedate, "allowsubmissionsfromdate": duedate - 14 * DIA,
+                "gradingduedate": duedate + 7 * DIA, "cutoffdate": duedate + 3 * DIA,
+                "intro": "<p>" + "Descripción de la tarea. " * 20 + "</p>",
+                "configs": [{"plugin": "file", "subtype": "assignsubmission", "name": "enabled", "value": "1"}] * 6,
+                "introattachments": [],
+            })
+        return tareas
+
+    def participantes(self, assignid):
+        return [{
+            "id": userid, "fullname": f"Estudiante {userid}", "email": f"e{userid}@example.org",
+            "groups": [], "submitted": False, "requiregrading": False,
+        } for userid in range(1, self.config.participantes + 1)]
+
+    def submisiones(self, assignid):
+        rng = self._rng("subs", assignid)
+        subs = []
+        for userid in range(1, self.config.participantes + 1):
+            enviado = rng.random() < self.config.tasa_envio
+            subs.append({
+                "id": assignid * 100000 + userid, "userid": userid, "attemptnumber": 0,
+                "status": "submitted" if enviado else "new",
+                "timecreated": EPOCH_BASE, "timemodified": EPOCH_BASE + rng.randint(0, 60) * DIA + rng.randint(0, DIA),
+                "plugins": [{"type": "file", "name": "Envíos de archivos",
+                             "fileareas": [{"area": "submission_files", "files": [
+                                 {"filename": f"entrega_{userid}.pdf", "filesize": rng.randint(10_000, 900_000)}]}]}],
+            })
+        return subs
+
+    def calificaciones(self, assignid):
+        rng = self._rng("notas", assignid)
+        notas = []
+        for sub in self.submisiones(assignid):
+            if sub["status"] == "submitted" and rng.random() < self.config.tasa_calificacion:
+                notas.append({
+                    "id": sub["id"], "userid": sub["userid"], "attemptnumber": 0, "grader": 2,
+                    "grade": f"{rng.uniform(0, 20):.5f}",
+                    "timecreated": sub["timemodified"],
+                    "timemodified": sub["timemodified"] + int(rng.expovariate(1 / (5 * DIA))),
+                })
+        return notas
+
+
+class ServidorMoodleFalso:
+    """Servidor en un hilo de fondo. `conteo_peticiones` cuenta las peticiones por wsfunction."""
+
+    def __init__(self, config=None, host="127.0.0.1", puerto=0):
+        self.config = config or ConfigFalsa()
+        self.datos = DatosSinteticos(self.config)
+        self.conteo_peticiones = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(self.config.semilla)
+        self._httpd = ThreadingHTTPServer((host, puerto), self._crear_handler())
+        self._httpd.daemon_threads = True
+        self._hilo = None
+
+    @property
+    def url(self):
+        host, puerto = self._httpd.server_address[:2]
+        return f"http://{host}:{puerto}{RUTA_WS}"
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def total_peticiones(self):
+        with self._lock:
+            return sum(self.conteo_peticiones.values())
+
+    def reiniciar_conteo(self):
+        with self._lock:
+            self.conteo_peticiones.clear()
+
+    # --- Implementación de cada wsfunction ---
+
+    def _mod_assign_get_assignments(self, p):
+        course_ids = [int(v[0]) for k, v in p.items() if k.startswith("courseids[")]
+        return {"courses": [{"id": c, "fullname": f"Curso {c}", "assignments": self.datos.tareas_de_curso(c)}
+                            for c in course_ids], "warnings": []}
+
+    def _mod_assign_list_participants(self, p):
+        participantes = self.datos.participantes(int(p["assignid"][0]))
+        skip, limit = int(p.get("skip", ["0"])[0]), int(p.get("limit", ["0"])[0])
+        participantes = participantes[skip:skip + limit] if limit else participantes[skip:]
+        if p.get("onlyids", ["0"])[0] == "1":
+            # Como Moodle: onlyids omite los datos de usuario pero mantiene fullname y los indicadores
+            return [{"id": x["id"], "fullname": x["fullname"], "submitted": x["submitted"],
+                     "requiregrading": x["requiregrading"]} for x in participantes]
+        if p.get("includeenrolments", ["1"])[0] == "1":
+            for x in participantes:
+                x["enrolledcourses"] = [{"id": 1, "fullname": "Curso", "shortname": "C1"}] * 3
+        return participantes
+
+    def _por_tareas(self, p, generador, clave):
+        assignids = [int(v[0]) for k, v in p.items() if k.startswith("assignmentids[")]
+        since = int(p.get("since", ["0"])[0])
+        status = p.get("status", [""])[0]
+        return {"assignments": [
+            {"assignmentid": a, clave: [r for r in generador(a)
+                                        if r["timemodified"] >= since and (not status or r.get("status") == status)]}
+            for a in assignids], "warnings": []}
+
+    def _mod_assign_get_submissions(self, p):
+        return self._por_tareas(p, self.datos.submisiones, "submissions")
+
+    def _mod_assign_get_grades(self, p):
+        return self._por_tareas(p, self.datos.calificaciones, "grades")
+
+    def _responder(self, wsfunction, params):
+        """Devuelve (status_http, cuerpo_json) para una petición."""
+        with self._lock:
+            self.conteo_peticiones[wsfunction] = self.conteo_peticiones.get(wsfunction, 0) + 1
+            r_error, r_excepcion, r_jitter = self._rng.random(), self._rng.random(), self._rng.uniform(-1, 1)
+
+        latencia = max(0.0, self.config.latencia_ms + r_jitter * self.config.jitter_ms) / 1000
+        if latencia:
+            time.sleep(latencia)
+        if r_error < self.config.tasa_error:
+            return 503, {"error": "Servicio no disponible (simulado)"}
+        if r_excepcion < self.config.tasa_excepcion:
+            return 200, {"exception": "moodle_exception", "errorcode": "simulado", "message": "Excepción simulada"}
+
+        metodo = getattr(self, f"_{wsfunction}", None)
+        if metodo is None:
+            return 200, {"exception": "invalid_parameter_exception", "errorcode": "invalidrecord",
+                         "message": f"Función no implementada en el servidor falso: {wsfunction}"}
+        return 200, metodo(params)
+
+    def _crear_handler(self):
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive, como un front end real
+            # Cabeceras y cuerpo van en escrituras separadas: sin esto Nagle + ACK retardado añaden ~40 ms
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                longitud = int(self.headers.get("Content-Length", 0))
+                params = parse_qs(self.rfile.read(longitud).decode("utf-8"), keep_blank_values=True)
+                status, cuerpo = servidor._responder(params.get("wsfunction", [""])[0], params)
+                datos = json.dumps(cuerpo).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if servidor.config.comprimir and "gzip" in self.headers.get("Accept-Encoding", ""):
+                    datos = gzip.compress(datos, compresslevel=1)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def log_message(self, *args): # Silenciar el log por petición de http.server
+                pass
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor Moodle falso con datos sintéticos.")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--tareas-por-curso", type=int, default=ConfigFalsa.tareas_por_curso)
+    parser.add_argument("--participantes", type=int, default=ConfigFalsa.participantes)
+    parser.add_argument("--latencia-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--tasa-error", type=float, default=0.0)
+    parser.add_argument("--tasa-excepcion", type=float, default=0.0)
+    parser.add_argument("--sin-compresion", action="store_true", help="No comprimir las respuestas con gzip")
+    args = parser.parse_args(argv)
+
+    config = ConfigFalsa(tareas_por_curso=args.tareas_por_curso, participantes=args.participantes,
+                         latencia_ms=args.latencia_ms, jitter_ms=args.jitter_ms,
+                         tasa_error=args.tasa_error, tasa_excepcion=args.tasa_excepcion,
+                         comprimir=not args.sin_compresion)
+    servidor = ServidorMoodleFalso(config, puerto=args.puerto)
+    print(f"Servidor Moodle falso escuchando en {servidor.url} (Ctrl+C para salir)")
+    try:
+        servidor._httpd.serve_forever()
+    except KeyboardInterrupt:
+        servidor.detener()
+
+
+if __name__ == "__main__":
+    main()
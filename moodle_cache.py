@@ -0,0 +1,355 @@
+# moodle_cache.py
+# Cachés de respuestas de los web services de Moodle: persistente en disco (SQLite) y en memoria,
+# y almacén local de resultados por entidad con refresco en segundo plano.
+import contextvars
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from moodle_metricas import logger
+
+# Directorio por defecto de la caché; se puede cambiar con la variable de entorno MOODLE_CACHE_DIR
+CACHE_DIR_POR_DEFECTO = os.environ.get("MOODLE_CACHE_DIR", ".cache_moodle")
+
+# Tamaño máximo de la caché en disco (bytes comprimidos) antes de expulsar entradas por LRU
+CACHE_MAX_BYTES_POR_DEFECTO = 512 * 1024 * 1024
+
+# TTL en segundos por wsfunction. Las tareas de un curso cambian poco; envíos y notas más a menudo.
+TTL_POR_FUNCION = {
+    "mod_assign_get_assignments":   24 * 3600,
+    "mod_assign_list_participants": 12 * 3600,
+    "mod_assign_get_submissions":   6 * 3600,
+    "mod_assign_get_grades":        6 * 3600,
+}
+TTL_POR_DEFECTO = 3600
+
+# Modos de uso de la caché:
+#   "usar"      -> lee de la caché si la entrada está vigente y guarda lo descargado (normal)
+#   "obsoleto"  -> como "usar", pero del almacén local también sirve lo caducado y lo refresca en
+#                  segundo plano (stale-while-revalidate; para la app interactiva)
+#   "refrescar" -> ignora lo guardado, descarga siempre y actualiza la caché
+#   "omitir"    -> ni lee ni escribe
+MODOS_CACHE = ("usar", "obsoleto", "refrescar", "omitir")
+# Modos en los que se lee lo guardado
+MODOS_LECTURA = ("usar", "obsoleto")
+_modo_cache = contextvars.ContextVar("modo_cache", default="usar")
+
+
+def modo_cache_actual():
+    return _modo_cache.get()
+
+
+@contextmanager
+def modo_cache(modo):
+    """Fija el modo de la caché para las llamadas hechas dentro del bloque `with` (por sesión/hilo)."""
+    if modo not in MODOS_CACHE:
+        raise ValueError(f"Modo de caché desconocido: {modo!r}. Opciones: {MODOS_CACHE}")
+    token = _modo_cache.set(modo)
+    try:
+        yield
+    finally:
+        _modo_cache.reset(token)
+
+
+def clave_cache(wsfunction, params):
+    """Clave estable: wsfunction + parámetros ordenados. El token nunca forma parte de la clave."""
+    normalizados = sorted((str(k), str(v)) for k, v in params.items()
+                          if k not in ("wstoken", "wsfunction", "moodlewsrestformat"))
+    texto = json.dumps([wsfunction, normalizados], separators=(",", ":"))
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+class CacheRespuestas:
+    """
+    Caché SQLite de respuestas JSON ya decodificadas, con TTL por wsfunction y expulsión LRU
+    cuando el tamaño total supera `max_bytes`. Segura entre hilos (una conexión + lock).
+    """
+
+    def __init__(self, directorio=CACHE_DIR_POR_DEFECTO, max_bytes=CACHE_MAX_BYTES_POR_DEFECTO, ttls=None):
+        os.makedirs(directorio, exist_ok=True)
+        self.ruta = os.path.join(directorio, "respuestas.sqlite3")
+        self.max_bytes = max_bytes
+        self.ttls = dict(TTL_POR_FUNCION, **(ttls or {}))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.ruta, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS respuestas ("
+            " clave TEXT PRIMARY KEY, wsfunction TEXT NOT NULL, guardado REAL NOT NULL,"
+            " ultimo_acceso REAL NOT NULL, tamano INTEGER NOT NULL, datos BLOB NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ultimo_acceso ON respuestas (ultimo_acceso)")
+        self._conn.commit()
+
+    def ttl(self, wsfunction):
+        return self.ttls.get(wsfunction, TTL_POR_DEFECTO)
+
+    def get(self, wsfunction, params):
+        """Devuelve la respuesta guardada si existe y no ha caducado; si no, None."""
+        clave = clave_cache(wsfunction, params)
+        ahora = time.time()
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT guardado, datos FROM respuestas WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is None:
+                return None
+            guardado, datos = fila
+            if ahora - guardado > self.ttl(wsfunction):
+                self._conn.execute("DELETE FROM respuestas WHERE clave = ?", (clave,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE respuestas SET ultimo_acceso = ? WHERE clave = ?", (ahora, clave))
+            self._conn.commit()
+        return json.loads(zlib.decompress(datos))
+
+    def set(self, wsfunction, params, respuesta):
+        datos = zlib.compress(json.dumps(respuesta, separators=(",", ":")).encode("utf-8"))
+        ahora = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO respuestas (clave, wsfunction, guardado, ultimo_acceso, tamano, datos)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (clave_cache(wsfunction, params), wsfunction, ahora, ahora, len(datos), datos),
+            )
+            self._expulsar_lru()
+            self._conn.commit()
+
+    def _expulsar_lru(self):
+        """Borra las entradas menos usadas recientemente hasta quedar por debajo de max_bytes."""
+        total = self._conn.execute("SELECT COALESCE(SUM(tamano), 0) FROM respuestas").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for clave, tamano in self._conn.execute(
+                "SELECT clave, tamano FROM respuestas ORDER BY ultimo_acceso ASC").fetchall():
+            self._conn.execute("DELETE FROM respuestas WHERE clave = ?", (clave,))
+            total -= tamano
+            if total <= self.max_bytes:
+                break
+
+    def limpiar(self, wsfunction=None):
+        """Vacía la caché completa o solo las entradas de una wsfunction."""
+        with self._lock:
+            if wsfunction is None:
+                self._conn.execute("DELETE FROM respuestas")
+            else:
+                self._conn.execute("DELETE FROM respuestas WHERE wsfunction = ?", (wsfunction,))
+            self._conn.commit()
+
+    def estadisticas(self):
+        with self._lock:
+            entradas, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM respuestas").fetchone()
+        return {"entradas": entradas, "bytes": total}
+
+
+def estimar_bytes(valor, _profundidad=0):
+    """
+    Tamaño aproximado en memoria de `valor`: los objetos con memoria_bytes() se miden solos,
+    los DataFrame/Series con memory_usage(deep=True) y los contenedores se recorren hasta tres
+    niveles con sys.getsizeof. Las cadenas compartidas se cuentan cada vez (estimación al alza).
+    """
+    if hasattr(valor, "memoria_bytes"):
+        return valor.memoria_bytes()
+    if hasattr(valor, "memory_usage"):
+        uso = valor.memory_usage(deep=True)
+        return int(uso.sum()) if hasattr(uso, "sum") else int(uso)
+    tamano = sys.getsizeof(valor)
+    if _profundidad < 3:
+        if isinstance(valor, dict):
+            tamano += sum(estimar_bytes(k, _profundidad + 1) + estimar_bytes(v, _profundidad + 1)
+                          for k, v in valor.items())
+        elif isinstance(valor, (list, tuple, set, frozenset)):
+            tamano += sum(estimar_bytes(v, _profundidad + 1) for v in valor)
+    return tamano
+
+
+class CacheMemoria:
+    """
+    Caché en memoria del proceso, compartida entre hilos (y, en Streamlit, entre sesiones).
+    Claves explícitas (tuplas hashables), TTL por entrada y como máximo `max_entries`
+    entradas y `max_bytes` bytes (estimados con estimar_bytes): al superar cualquiera de los
+    dos se expulsan las entradas usadas hace más tiempo (LRU).
+    Los valores se comparten por referencia: quien los lee no debe modificarlos.
+    """
+
+    def __init__(self, ttl=600, max_entries=5000, max_bytes=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._datos = OrderedDict() # clave -> (caduca_en, valor, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+
+    def _quitar(self, clave):
+        self._bytes -= self._datos.pop(clave)[2]
+
+    def get(self, clave):
+        ahora = time.time()
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None or entrada[0] < ahora:
+                if entrada is not None:
+                    self._quitar(clave)
+                self.fallos += 1
+                return None
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+
+    def set(self, clave, valor, ttl=None):
+        # Medir fuera del lock: recorrer un valor grande no debe bloquear al resto de sesiones
+        tamano = estimar_bytes(valor) if self.max_bytes is not None else 0
+        with self._lock:
+            if clave in self._datos:
+                self._quitar(clave)
+            self._datos[clave] = (time.time() + (self.ttl if ttl is None else ttl), valor, tamano)
+            self._bytes += tamano
+            # La entrada recién guardada no se expulsa aunque ella sola supere max_bytes
+            while len(self._datos) > 1 and (len(self._datos) > self.max_entries or
+                                            (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                self._quitar(next(iter(self._datos)))
+                self.expulsiones += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+            self._bytes = 0
+
+    def estadisticas(self):
+        with self._lock:
+            return {"entradas": len(self._datos), "aciertos": self.aciertos, "fallos": self.fallos,
+                    "bytes": self._bytes, "expulsiones": self.expulsiones}
+
+
+# TTL (segundos) de las entradas del almacén local por tipo. Pasado el TTL, en modo de caché
+# "obsoleto" la entrada se sigue sirviendo (stale-while-revalidate) mientras se refresca en
+# segundo plano, hasta MAX_OBSOLETO_S.
+TTL_ALMACEN = {
+    "tareas":   12 * 3600,
+    "analisis": 30 * 60,
+}
+MAX_OBSOLETO_S = 7 * 24 * 3600
+
+
+class AlmacenLocal:
+    """
+    Almacén persistente (SQLite) de resultados ya procesados por entidad: las tareas de cada
+    curso y la tabla de análisis de cada tarea. A diferencia de CacheRespuestas, la clave no
+    depende de cómo se agruparon las llamadas a Moodle, así que lo que precarga el prefetch en
+    segundo plano lo encuentra cualquier consulta interactiva. Los valores se guardan con pickle.
+    `variante` separa entradas de una misma entidad obtenidas de forma distinta (p. ej. en
+    descarga ligera); se guarda como parte del tipo ("tareas:ligera").
+    """
+
+    def __init__(self, directorio=CACHE_DIR_POR_DEFECTO, ttls=None, max_obsoleto=MAX_OBSOLETO_S):
+        os.makedirs(directorio, exist_ok=True)
+        self.ruta = os.path.join(directorio, "almacen.sqlite3")
+        self.ttls = dict(TTL_ALMACEN, **(ttls or {}))
+        self.max_obsoleto = max_obsoleto
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.ruta, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS almacen ("
+            " tipo TEXT NOT NULL, id INTEGER NOT NULL, guardado REAL NOT NULL, datos BLOB NOT NULL,"
+            " PRIMARY KEY (tipo, id))"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _tipo_guardado(tipo, variante):
+        return f"{tipo}:{variante}" if variante else tipo
+
+    def get(self, tipo, ident, variante=""):
+        """
+        (valor, caducado) si hay entrada de menos de TTL + max_obsoleto segundos; si no, None.
+        caducado=True indica que conviene refrescarla (el valor se puede servir igualmente).
+        """
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT guardado, datos FROM almacen WHERE tipo = ? AND id = ?",
+                (self._tipo_guardado(tipo, variante), ident)
+            ).fetchone()
+        if fila is None:
+            return None
+        edad = time.time() - fila[0]
+        ttl = self.ttls.get(tipo, TTL_POR_DEFECTO)
+        if edad > ttl + self.max_obsoleto:
+            return None
+        return pickle.loads(zlib.decompress(fila[1])), edad > ttl
+
+    def set(self, tipo, ident, valor, variante=""):
+        datos = zlib.compress(pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO almacen (tipo, id, guardado, datos) VALUES (?, ?, ?, ?)",
+                (self._tipo_guardado(tipo, variante), ident, time.time(), datos),
+            )
+            self._conn.commit()
+
+    def limpiar(self, tipo=None):
+        """Vacía el almacén completo o solo las entradas de un tipo (de todas sus variantes)."""
+        with self._lock:
+            if tipo is None:
+                self._conn.execute("DELETE FROM almacen")
+            else:
+                self._conn.execute("DELETE FROM almacen WHERE tipo = ? OR tipo LIKE ?", (tipo, f"{tipo}:%"))
+            self._conn.commit()
+
+    def estadisticas(self):
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT tipo, COUNT(*), COALESCE(SUM(LENGTH(datos)), 0) FROM almacen GROUP BY tipo").fetchall()
+        return {tipo: {"entradas": n, "bytes": total} for tipo, n, total in filas}
+
+
+class Revalidador:
+    """
+    Ejecuta en segundo plano los refrescos de entradas caducadas. Cada clave se refresca como
+    mucho una vez a la vez: programar() descarta las que ya tienen un refresco en curso.
+    """
+
+    def __init__(self, max_workers=2):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="revalidar")
+        self._en_curso = set()
+        self._lock = threading.Lock()
+
+    def programar(self, claves, funcion):
+        """
+        Programa una sola llamada funcion(nuevas) para refrescar juntas las `claves` que no
+        tienen ya un refresco en curso. Devuelve esas claves (vacío si no se programó nada).
+        """
+        with self._lock:
+            nuevas = [clave for clave in dict.fromkeys(claves) if clave not in self._en_curso]
+            self._en_curso.update(nuevas)
+        if not nuevas:
+            return nuevas
+
+        def _ejecutar():
+            try:
+                funcion(nuevas)
+            except Exception:
+                logger.exception("revalidacion_error", extra={"campos": {"claves": nuevas[:20]}})
+            finally:
+                with self._lock:
+                    self._en_curso.difference_update(nuevas)
+
+        self._pool.submit(_ejecutar)
+        return nuevas
+
+    def pendientes(self):
+        with self._lock:
+            return len(self._en_curso)
@@ -0,0 +1,328 @@
+# moodle_client.py
+# Cliente HTTP compartido para los web services REST de Moodle.
+import json
+import logging
+import random
+import threading
+import time
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from moodle_cache import MODOS_LECTURA, clave_cache, modo_cache_actual
+from moodle_metricas import METRICAS, log_evento, logger, redactar
+from moodle_stream import LectorContado, RegistrosColumnares, extraer_registros
+from moodle_trafico import CircuitoAbiertoError, ControlTrafico
+
+# Códigos HTTP transitorios que vale la pena reintentar (front end de Moodle saturado, proxy caído...)
+CODIGOS_REINTENTABLES = {429, 500, 502, 503, 504}
+# Errores de red que vale la pena reintentar, también a mitad de leer el cuerpo (en streaming
+# urllib3 los lanza sin envolver en excepciones de requests)
+ERRORES_RED_REINTENTABLES = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    urllib3.exceptions.ProtocolError,
+    urllib3.exceptions.ReadTimeoutError,
+)
+
+
+def _segundos_retry_after(r):
+    """Segundos pedidos por el servidor en la cabecera Retry-After (solo la forma numérica), o 0."""
+    valor = r.headers.get("Retry-After", "")
+    return min(float(valor), 120.0) if valor.isdigit() else 0.0
+
+
+class MoodleAPIError(Exception):
+    """Moodle respondió HTTP 200 pero con un payload {"exception": ..., "errorcode": ..., "message": ...}."""
+
+    def __init__(self, wsfunction, data):
+        self.wsfunction = wsfunction
+        self.errorcode = data.get("errorcode", "N/A")
+        self.debuginfo = data.get("debuginfo", "N/A")
+        self.message = data.get("message", "Sin mensaje")
+        super().__init__(f"{wsfunction}: {self.message} (errorcode='{self.errorcode}', debuginfo='{self.debuginfo}')")
+
+
+class _LlamadaEnCurso:
+    __slots__ = ("terminada", "resultado", "error")
+
+    def __init__(self):
+        self.terminada = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class LlamadasCompartidas:
+    """
+    Single-flight: si llega una llamada idéntica (misma clave) mientras otra está en curso, no se
+    repite contra Moodle; espera y comparte el resultado (o la excepción) de la primera.
+    El resultado se comparte por referencia: quien lo recibe no debe modificarlo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._en_curso = {}
+
+    def ejecutar(self, clave, funcion):
+        """Devuelve (resultado, compartido). compartido=True si se reutilizó una llamada en curso."""
+        with self._lock:
+            llamada = self._en_curso.get(clave)
+            propia = llamada is None
+            if propia:
+                llamada = self._en_curso[clave] = _LlamadaEnCurso()
+        if not propia:
+            llamada.terminada.wait()
+            if llamada.error is not None:
+                raise llamada.error
+            return llamada.resultado, True
+
+        try:
+            llamada.resultado = funcion()
+        except BaseException as e:
+            llamada.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._en_curso[clave]
+            llamada.terminada.set()
+        return llamada.resultado, False
+
+
+class MoodleClient:
+    """
+    Cliente de web services de Moodle con una requests.Session compartida.
+
+    La sesión mantiene las conexiones TCP/TLS abiertas (keep-alive) en un pool de tamaño
+    `pool_size`. Todas las funciones que usamos (mod_assign_get_*, mod_assign_list_participants)
+    son lecturas idempotentes, así que los errores de red y los códigos de CODIGOS_REINTENTABLES
+    se reintentan hasta `max_retries` veces con backoff exponencial y jitter.
+    Las llamadas idénticas concurrentes (p. ej. varias sesiones analizando la misma tarea) se
+    fusionan en una sola petición (ver LlamadasCompartidas), y el ritmo de peticiones se adapta
+    a la salud del servidor (ver moodle_trafico.ControlTrafico).
+    """
+
+    def __init__(self, url_base, token, timeout=(10, 120), pool_size=10, max_retries=3,
+                 backoff_base=0.5, backoff_max=10.0, verify=False, cache=None, trafico=None):
+        self.url_base = url_base
+        self.token = token
+        self.cache = cache # CacheRespuestas opcional (ver moodle_cache.py)
+        self.timeout = timeout # (conexión, lectura) en segundos
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.verify = verify
+
+        self.compartidas = LlamadasCompartidas()
+        # Límite de tasa + concurrencia adaptativa + circuit breaker (trafico=False lo desactiva)
+        self.trafico = ControlTrafico(max_concurrencia=pool_size) if trafico is None else trafico
+
+        self.session = requests.Session()
+        # requests ya lo envía por defecto; explícito porque las respuestas JSON de Moodle comprimen ~10x
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _espera_backoff(self, intento):
+        """Backoff exponencial con 'full jitter': uniforme entre 0 y base * 2^intento (acotado)."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** intento)))
+
+    def call(self, wsfunction, params):
+        """
+        Ejecuta `wsfunction` con `params` y devuelve el JSON decodificado.
+
+        Lanza MoodleAPIError si Moodle devuelve un payload de excepción, y las excepciones de
+        requests / json.JSONDecodeError si la llamada sigue fallando tras los reintentos.
+        Si hay caché configurada se respeta el modo activo (ver moodle_cache.modo_cache); las
+        respuestas con excepción de Moodle nunca se guardan, y un error al guardar no se propaga.
+        """
+        modo = modo_cache_actual() if self.cache is not None else "omitir"
+        if modo in MODOS_LECTURA:
+            guardada = self.cache.get(wsfunction, params)
+            if guardada is not None:
+                METRICAS.incrementar(wsfunction, "aciertos_cache")
+                log_evento(logging.DEBUG, "cache_hit", wsfunction=wsfunction)
+                return guardada
+
+        respuesta = self._call_compartida(wsfunction, params, lambda: self._call_red(wsfunction, params))
+        if modo != "omitir":
+            self._guardar_en_cache(wsfunction, params, respuesta)
+        return respuesta
+
+    def call_decodificado(self, wsfunction, params, decodificar, campos, a_cache=None, desde_cache=None):
+        """
+        Como call, pero parseando el cuerpo de forma incremental con decodificar(fuente), que
+        reduce la respuesta a `campos`. En la caché se guarda ya reducida, con una clave distinta
+        de la respuesta completa; a_cache/desde_cache convierten la respuesta a/desde JSON si no
+        es serializable tal cual.
+        """
+        params_cache = {**params, "_campos": ",".join(campos)}
+        modo = modo_cache_actual() if self.cache is not None else "omitir"
+        if modo in MODOS_LECTURA:
+            guardada = self.cache.get(wsfunction, params_cache)
+            if guardada is not None:
+                METRICAS.incrementar(wsfunction, "aciertos_cache")
+                log_evento(logging.DEBUG, "cache_hit", wsfunction=wsfunction)
+                return desde_cache(guardada) if desde_cache else guardada
+
+        respuesta = self._call_compartida(wsfunction, params_cache, lambda: self._call_red(
+            wsfunction, params, decodificar=decodificar))
+        if modo != "omitir":
+            self._guardar_en_cache(wsfunction, params_cache, respuesta, a_cache)
+        return respuesta
+
+    def call_registros(self, wsfunction, params, clave_lista, campos):
+        """
+        call_decodificado para respuestas {"assignments": [{"assignmentid", clave_lista: [...]}]},
+        reduciendo cada registro a `campos` en un RegistrosColumnares (ver moodle_stream.extraer_registros).
+        """
+        def desde_cache(guardada):
+            for tarea in guardada.get("assignments", []):
+                tarea[clave_lista] = RegistrosColumnares.desde_json(tarea[clave_lista])
+            return guardada
+
+        def a_cache(respuesta):
+            # RegistrosColumnares no es serializable tal cual: en la caché se guardan sus columnas como listas
+            return {"assignments": [{**t, clave_lista: t[clave_lista].a_json()} for t in respuesta["assignments"]]}
+
+        return self.call_decodificado(wsfunction, params, lambda fuente: extraer_registros(fuente, clave_lista, campos),
+                                      campos, a_cache, desde_cache)
+
+    def _guardar_en_cache(self, wsfunction, params, respuesta, a_cache=None):
+        """
+        Guarda la respuesta en la caché. Un fallo de la caché (SQLite bloqueada, disco lleno...)
+        se registra y no se propaga: la respuesta ya descargada sigue siendo válida.
+        """
+        try:
+            self.cache.set(wsfunction, params, a_cache(respuesta) if a_cache else respuesta)
+        except Exception:
+            logger.exception("cache_error_escritura", extra={"campos": {"wsfunction": wsfunction}})
+
+    def _call_compartida(self, wsfunction, params, funcion):
+        """Ejecuta funcion() salvo que ya haya en curso una llamada idéntica, cuyo resultado se comparte."""
+        respuesta, compartida = self.compartidas.ejecutar(clave_cache(wsfunction, params), funcion)
+        if compartida:
+            METRICAS.incrementar(wsfunction, "coalescidas")
+            log_evento(logging.DEBUG, "ws_coalescida", wsfunction=wsfunction)
+        return respuesta
+
+    def _post_regulado(self, data, stream=False):
+        """Un intento HTTP, esperando turno en el control de tráfico y devolviéndole el resultado."""
+        if not self.trafico:
+            return self.session.post(self.url_base, data=data, timeout=self.timeout, verify=self.verify, stream=stream)
+        inicio = self.trafico.adquirir()
+        try:
+            r = self.session.post(self.url_base, data=data, timeout=self.timeout, verify=self.verify, stream=stream)
+        except Exception:
+            self.trafico.liberar(inicio, error_red=True, clase=data["wsfunction"])
+            raise
+        self.trafico.liberar(inicio, status=r.status_code, clase=data["wsfunction"])
+        return r
+
+    def _call_red(self, wsfunction, params, decodificar=None):
+        """
+        Hace la llamada HTTP con reintentos; no consulta la caché. Con `decodificar` la respuesta
+        se pide en streaming y se pasa el cuerpo (objeto tipo archivo) a decodificar(fuente) en
+        lugar de cargarlo entero con r.json().
+        """
+        data = {
+            "wstoken":            self.token,
+            "wsfunction":         wsfunction,
+            "moodlewsrestformat": "json",
+            **params,
+        }
+
+        log_evento(logging.DEBUG, "ws_llamada", wsfunction=wsfunction, params=redactar(params))
+        METRICAS.incrementar(wsfunction, "llamadas")
+        inicio = time.perf_counter()
+        intento = 0
+        try:
+            while True:
+                espera_servidor = 0.0
+                try:
+                    r = self._post_regulado(data, stream=decodificar is not None)
+                    # Con stream=True la conexión no vuelve al pool hasta cerrar la respuesta: se cierra siempre
+                    with r:
+                        if r.status_code in CODIGOS_REINTENTABLES and intento < self.max_retries:
+                            espera_servidor = _segundos_retry_after(r)
+                            log_evento(logging.INFO, "ws_reintento", wsfunction=wsfunction,
+                                       status=r.status_code, intento=intento + 1, max_reintentos=self.max_retries)
+                        else:
+                            if not r.ok:
+                                r.content # El cuerpo del error (breve) se lee antes de cerrar: llamar_ws lo registra
+                            r.raise_for_status()
+                            respuesta, n_bytes, n_bytes_red = self._leer_cuerpo(r, decodificar)
+                            break
+                except ERRORES_RED_REINTENTABLES as e_red:
+                    if intento >= self.max_retries:
+                        raise
+                    log_evento(logging.INFO, "ws_reintento", wsfunction=wsfunction,
+                               error=str(e_red), intento=intento + 1, max_reintentos=self.max_retries)
+                METRICAS.incrementar(wsfunction, "reintentos")
+                time.sleep(max(self._espera_backoff(intento), espera_servidor))
+                intento += 1
+
+            METRICAS.incrementar(wsfunction, "bytes_recibidos", n_bytes)
+            # Bytes tal como llegaron por la red (comprimidos si el servidor aplicó gzip/deflate)
+            METRICAS.incrementar(wsfunction, "bytes_red", n_bytes_red)
+            if isinstance(respuesta, dict) and "exception" in respuesta:
+                raise MoodleAPIError(wsfunction, respuesta)
+        except CircuitoAbiertoError:
+            METRICAS.incrementar(wsfunction, "rechazadas_circuito")
+            raise
+        except Exception:
+            METRICAS.incrementar(wsfunction, "errores")
+            raise
+        finally:
+            METRICAS.observar_latencia(wsfunction, time.perf_counter() - inicio)
+
+        log_evento(logging.DEBUG, "ws_respuesta", wsfunction=wsfunction, status=r.status_code,
+                   bytes=n_bytes, ms=round((time.perf_counter() - inicio) * 1000, 1))
+        return respuesta
+
+    @staticmethod
+    def _leer_cuerpo(r, decodificar):
+        """(respuesta decodificada, bytes del cuerpo, bytes recibidos por la red) de una respuesta abierta."""
+        if decodificar is None:
+            n_bytes = len(r.content)
+            respuesta = r.json()
+        else:
+            r.raw.decode_content = True # Descomprime gzip/deflate al leer
+            fuente = LectorContado(r.raw)
+            respuesta = decodificar(fuente)
+            n_bytes = fuente.bytes
+        return respuesta, n_bytes, r.raw.tell() or n_bytes
+
+    def close(self):
+        self.session.close()
+
+
+def llamar_ws(client, wsfunction, params, contexto="", registros=None, decodificar=None):
+    """
+    Envoltorio de MoodleClient.call con el manejo de errores común de moodle_services.
+    Registra el error y devuelve None si la llamada falla por cualquier motivo.
+    Con registros=(clave_lista, campos) usa MoodleClient.call_registros (parseo incremental), y con
+    decodificar=(funcion, campos) MoodleClient.call_decodificado.
+    """
+    try:
+        if registros is not None:
+            return client.call_registros(wsfunction, params, *registros)
+        if decodificar is not None:
+            funcion, campos = decodificar
+            return client.call_decodificado(wsfunction, params, funcion, campos)
+        return client.call(wsfunction, params)
+    except MoodleAPIError as e_moodle:
+        log_evento(logging.ERROR, "moodle_api_exception", wsfunction=wsfunction, contexto=contexto,
+                   errorcode=e_moodle.errorcode, mensaje=e_moodle.message, debuginfo=e_moodle.debuginfo)
+    except requests.exceptions.HTTPError as e_http:
+        log_evento(logging.ERROR, "ws_http_error", wsfunction=wsfunction, contexto=contexto, error=str(e_http),
+                   respuesta=e_http.response.text[:500] if e_http.response is not None else None)
+    except requests.exceptions.RequestException as e_req:
+        log_evento(logging.ERROR, "ws_request_error", wsfunction=wsfunction, contexto=contexto, error=str(e_req))
+    except json.JSONDecodeError as e_json:
+        log_evento(logging.ERROR, "ws_json_error", wsfunction=wsfunction, contexto=contexto, error=str(e_json))
+    except Exception:
+        logger.exception("ws_error_inesperado", extra={"campos": {"wsfunction": wsfunction, "contexto": contexto}})
+    return None
@@ -0,0 +1,65 @@
+# moodle_config.py
+# Resolución perezosa de la URL y el token de Moodle, sin depender de Streamlit.
+import os
+import sys
+
+# Nombres de las claves, iguales en variables de entorno y en .streamlit/secrets.toml
+CLAVE_URL = "MOODLE_API_URL_BASE"
+CLAVE_TOKEN = "MOODLE_API_TOKEN"
+
+# Archivos de secrets que se leen directamente cuando Streamlit no está cargado
+RUTAS_SECRETS = (
+    os.path.join(".streamlit", "secrets.toml"),
+    os.path.join(os.path.expanduser("~"), ".streamlit", "secrets.toml"),
+)
+
+
+class ConfiguracionMoodleError(Exception):
+    """No se encontró la URL o el token de Moodle en ninguna de las fuentes de configuración."""
+
+
+def _leer_secrets():
+    """
+    Secrets de Streamlit. Si Streamlit ya está importado (la app) se usa st.secrets; si no
+    (scripts, workers, tests) se lee el secrets.toml con tomllib para no pagar la importación.
+    """
+    st = sys.modules.get("streamlit")
+    if st is not None:
+        try:
+            return {clave: st.secrets[clave] for clave in (CLAVE_URL, CLAVE_TOKEN) if clave in st.secrets}
+        except Exception: # Sin secrets.toml, st.secrets lanza al primer acceso
+            return {}
+    try:
+        import tomllib
+    except ImportError: # Python < 3.11
+        return {}
+    for ruta in RUTAS_SECRETS:
+        if os.path.exists(ruta):
+            with open(ruta, "rb") as f:
+                return tomllib.load(f)
+    return {}
+
+
+def resolver_configuracion(url_base=None, token=None):
+    """
+    Devuelve (url_base, token) buscando cada valor, en este orden, en: los argumentos
+    explícitos, las variables de entorno MOODLE_API_URL_BASE / MOODLE_API_TOKEN y los
+    secrets de Streamlit. Lanza ConfiguracionMoodleError si alguno falta.
+    """
+    url_base = url_base or os.environ.get(CLAVE_URL)
+    token = token or os.environ.get(CLAVE_TOKEN)
+    if not (url_base and token):
+        secrets = _leer_secrets()
+        url_base = url_base or secrets.get(CLAVE_URL)
+        token = token or secrets.get(CLAVE_TOKEN)
+
+    faltante = CLAVE_URL if not url_base else CLAVE_TOKEN if not token else None
+    if faltante:
+        raise ConfiguracionMoodleError(
+            f"ERROR CRÍTICO: La clave secreta '{faltante}' no fue encontrada.\n"
+            f"Por favor, asegúrate de que {CLAVE_URL} y {CLAVE_TOKEN} estén definidos:\n"
+            "- Como argumentos explícitos o variables de entorno (scripts y ejecuciones por lotes).\n"
+            "- En Streamlit Community Cloud: En la configuración 'Secrets' de tu aplicación.\n"
+            "- Para desarrollo local: En un archivo llamado '.streamlit/secrets.toml' en la raíz de tu proyecto."
+        )
+    return url_base, token
@@ -0,0 +1,163 @@
+# moodle_metricas.py
+# Logging estructurado (desactivado por defecto) y métricas por wsfunction de las llamadas a Moodle.
+import json
+import logging
+import os
+import threading
+import time
+
+# Logger de la capa de servicios. Sin handler propio: no escribe nada hasta configurar_logging()
+logger = logging.getLogger("moodle")
+logger.addHandler(logging.NullHandler())
+logger.propagate = False
+
+# Parámetros que nunca deben aparecer en logs
+PARAMS_SENSIBLES = ("wstoken",)
+
+
+def redactar(params):
+    """Copia de `params` con el token (y demás PARAMS_SENSIBLES) reemplazado por '***'."""
+    return {k: ("***" if k in PARAMS_SENSIBLES else v) for k, v in params.items()}
+
+
+def log_evento(nivel, evento, **campos):
+    """
+    Registra `evento` con campos estructurados. Si el nivel no está activo no se formatea nada,
+    así que en el camino caliente cuesta una comparación.
+    """
+    if logger.isEnabledFor(nivel):
+        logger.log(nivel, evento, extra={"campos": campos})
+
+
+class _FormatoJSON(logging.Formatter):
+    def format(self, record):
+        datos = {
+            "ts": round(record.created, 3),
+            "nivel": record.levelname,
+            "evento": record.getMessage(),
+            **getattr(record, "campos", {}),
+        }
+        if record.exc_info:
+            datos["excepcion"] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class _FormatoTexto(logging.Formatter):
+    def format(self, record):
+        campos = " ".join(f"{k}={v}" for k, v in getattr(record, "campos", {}).items())
+        texto = f"{record.levelname}: {record.getMessage()} {campos}".rstrip()
+        if record.exc_info:
+            texto += "\n" + self.formatException(record.exc_info)
+        return texto
+
+
+def configurar_logging(nivel="INFO", formato="texto", stream=None):
+    """Activa el logging de la capa de servicios en `stream` (stderr por defecto), en texto o JSON por línea."""
+    for handler in list(logger.handlers):
+        if not isinstance(handler, logging.NullHandler):
+            logger.removeHandler(handler)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(_FormatoJSON() if formato == "json" else _FormatoTexto())
+    logger.addHandler(handler)
+    logger.setLevel(nivel)
+
+
+# Límites superiores (segundos) de los buckets del histograma de latencia, como en Prometheus
+BUCKETS_LATENCIA = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metricas:
+    """Contadores e histograma de latencia por wsfunction. Seguro entre hilos."""
+
+    CONTADORES = ("llamadas", "errores", "reintentos", "bytes_recibidos", "bytes_red", "aciertos_cache",
+                  "coalescidas", "rechazadas_circuito")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._por_funcion = {}
+
+    def _funcion(self, wsfunction):
+        datos = self._por_funcion.get(wsfunction)
+        if datos is None:
+            datos = {c: 0 for c in self.CONTADORES}
+            datos.update(latencia_suma=0.0, latencia_buckets=[0] * len(BUCKETS_LATENCIA), latencia_n=0)
+            self._por_funcion[wsfunction] = datos
+        return datos
+
+    def incrementar(self, wsfunction, contador, valor=1):
+        with self._lock:
+            self._funcion(wsfunction)[contador] += valor
+
+    def observar_latencia(self, wsfunction, segundos):
+        with self._lock:
+            datos = self._funcion(wsfunction)
+            datos["latencia_suma"] += segundos
+            datos["latencia_n"] += 1
+            for i, limite in enumerate(BUCKETS_LATENCIA):
+                if segundos <= limite:
+                    datos["latencia_buckets"][i] += 1
+
+    def reiniciar(self):
+        with self._lock:
+            self._por_funcion.clear()
+
+    def snapshot(self):
+        """Copia de las métricas: {wsfunction: {contador: valor, ..., latencia: {...}}}."""
+        with self._lock:
+            resultado = {}
+            for wsfunction, datos in self._por_funcion.items():
+                resultado[wsfunction] = {c: datos[c] for c in self.CONTADORES}
+                resultado[wsfunction]["latencia"] = {
+                    "suma_s": round(datos["latencia_suma"], 6),
+                    "n": datos["latencia_n"],
+                    "buckets": dict(zip((str(b) for b in BUCKETS_LATENCIA), datos["latencia_buckets"])),
+                }
+            return resultado
+
+    def ahorro_transferencia(self):
+        """
+        Totales de todas las funciones: bytes por la red (comprimidos), bytes de JSON decodificado
+        y fracción ahorrada por la compresión de la transferencia.
+        """
+        with self._lock:
+            red = sum(d["bytes_red"] for d in self._por_funcion.values())
+            decodificados = sum(d["bytes_recibidos"] for d in self._por_funcion.values())
+        return {"bytes_red": red, "bytes_json": decodificados,
+                "ahorro": round(1 - red / decodificados, 4) if decodificados else 0.0}
+
+    def exportar_json(self):
+        return json.dumps({"generado": time.time(), "funciones": self.snapshot()}, indent=2)
+
+    def exportar_prometheus(self):
+        """Formato de exposición de texto de Prometheus (apto para node_exporter textfile)."""
+        lineas = []
+        snapshot = self.snapshot()
+        for contador in self.CONTADORES:
+            nombre = f"moodle_ws_{contador}_total"
+            lineas.append(f"# TYPE {nombre} counter")
+            for wsfunction, datos in snapshot.items():
+                lineas.append(f'{nombre}{{wsfunction="{wsfunction}"}} {datos[contador]}')
+        nombre = "moodle_ws_latencia_segundos"
+        lineas.append(f"# TYPE {nombre} histogram")
+        for wsfunction, datos in snapshot.items():
+            latencia = datos["latencia"]
+            for limite, cuenta in latencia["buckets"].items():
+                lineas.append(f'{nombre}_bucket{{wsfunction="{wsfunction}",le="{limite}"}} {cuenta}')
+            lineas.append(f'{nombre}_bucket{{wsfunction="{wsfunction}",le="+Inf"}} {latencia["n"]}')
+            lineas.append(f'{nombre}_sum{{wsfunction="{wsfunction}"}} {latencia["suma_s"]}')
+            lineas.append(f'{nombre}_count{{wsfunction="{wsfunction}"}} {latencia["n"]}')
+        return "\n".join(lineas) + "\n"
+
+    def guardar(self, ruta):
+        """Escribe las métricas en `ruta`: JSON si termina en .json, texto Prometheus en otro caso."""
+        contenido = self.exportar_json() if ruta.endswith(".json") else self.exportar_prometheus()
+        with open(ruta, "w", encoding="utf-8") as f:
+            f.write(contenido)
+
+
+# Métricas globales del proceso
+METRICAS = Metricas()
+
+# MOODLE_LOG_NIVEL=DEBUG|INFO|... (y opcionalmente MOODLE_LOG_FORMATO=json) activa el logging sin tocar código
+if os.environ.get("MOODLE_LOG_NIVEL"):
+    configurar_logging(os.environ["MOODLE_LOG_NIVEL"].upper(), os.environ.get("MOODLE_LOG_FORMATO", "texto"))
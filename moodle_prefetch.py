@@ -0,0 +1,131 @@
+# moodle_prefetch.py
+# Precarga periódica en segundo plano de tareas y análisis de una lista de cursos en el almacén
+# local (moodle_cache.AlmacenLocal), para que la app responda sin esperar a Moodle.
+#
+# Uso:
+#   python moodle_prefetch.py cursos.csv --una-vez           # p. ej. desde cron, de madrugada
+#   python moodle_prefetch.py cursos.csv --intervalo 3600    # proceso residente
+# En la app se activa con MOODLE_PREFETCH_CURSOS=<csv o ids separados por comas>.
+import argparse
+import logging
+import os
+import threading
+import time
+
+from moodle_cache import modo_cache
+from moodle_metricas import configurar_logging, log_evento, logger
+from moodle_services import (
+    ASIGNACIONES_CHUNK_SIZE,
+    analizar_tiempos_calificacion_tareas,
+    obtener_tareas_por_cursos,
+)
+
+# Segundos entre pasadas completas de precarga
+INTERVALO_POR_DEFECTO = 3600
+# Hilos para el análisis durante la precarga: pocos, para no competir con los usuarios
+WORKERS_PREFETCH = 2
+
+
+def leer_cursos_prefetch(valor):
+    """IDs de curso desde una ruta a CSV con columna 'id' o desde una lista '101,102,...'."""
+    if os.path.exists(valor):
+        from auditoria_cli import leer_ids_cursos
+        return leer_ids_cursos(valor)
+    return [int(v) for v in valor.split(",") if v.strip().isdigit()]
+
+
+def ordenar_por_prioridad(tareas_por_curso, ahora=None):
+    """
+    Cursos ordenados por la distancia (en el tiempo) de su fecha de entrega más próxima a hoy:
+    primero los que tienen entregas recientes o inminentes, que son los que se auditan.
+    Los cursos sin fechas de entrega (o con error) van al final, en su orden original.
+    """
+    ahora = time.time() if ahora is None else ahora
+
+    def distancia(course_id):
+        fechas = [t["duedate_ts"] for t in tareas_por_curso.get(course_id) or [] if t.get("duedate_ts")]
+        return min(abs(ahora - f) for f in fechas) if fechas else float("inf")
+
+    return sorted(tareas_por_curso, key=distancia)
+
+
+class Prefetcher:
+    """
+    Hilo en segundo plano que cada `intervalo` segundos refresca las tareas de `course_ids` y
+    el análisis de todas sus tareas (modo de caché "refrescar"), por orden de prioridad, dejando
+    el resultado en el almacén local y en la caché de respuestas.
+    """
+
+    def __init__(self, course_ids, intervalo=INTERVALO_POR_DEFECTO, max_workers=WORKERS_PREFETCH,
+                 chunk_size=ASIGNACIONES_CHUNK_SIZE):
+        self.course_ids = list(dict.fromkeys(int(c) for c in course_ids))
+        self.intervalo = intervalo
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.ultima_pasada = None # {"inicio", "segundos", "cursos", "tareas"} de la última pasada completa
+        self._parar = threading.Event()
+        self._hilo = None
+
+    def ejecutar_pasada(self):
+        """Una pasada completa de precarga. Devuelve el número de tareas analizadas."""
+        inicio = time.time()
+        with modo_cache("refrescar"):
+            tareas_por_curso = obtener_tareas_por_cursos(self.course_ids)
+            analizadas = 0
+            for course_id in ordenar_por_prioridad(tareas_por_curso, inicio):
+                if self._parar.is_set():
+                    break
+                assignids = [t["id"] for t in tareas_por_curso.get(course_id) or []]
+                if assignids:
+                    analizar_tiempos_calificacion_tareas(assignids, chunk_size=self.chunk_size,
+                                                         max_workers=self.max_workers)
+                    analizadas += len(assignids)
+        self.ultima_pasada = {"inicio": inicio, "segundos": round(time.time() - inicio, 1),
+                              "cursos": len(tareas_por_curso), "tareas": analizadas}
+        log_evento(logging.INFO, "prefetch_pasada", **self.ultima_pasada)
+        return analizadas
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            try:
+                self.ejecutar_pasada()
+            except Exception:
+                logger.exception("prefetch_error")
+            self._parar.wait(self.intervalo)
+
+    def iniciar(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._parar.clear()
+            self._hilo = threading.Thread(target=self._bucle, name="prefetch-moodle", daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self):
+        self._parar.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precarga de tareas y análisis de Moodle en el almacén local.")
+    parser.add_argument("cursos", help="CSV con una columna 'id' de cursos, o IDs separados por comas")
+    parser.add_argument("--intervalo", type=float, default=INTERVALO_POR_DEFECTO,
+                        help="Segundos entre pasadas (por defecto: %(default)s)")
+    parser.add_argument("--una-vez", action="store_true", help="Hacer una sola pasada y salir")
+    parser.add_argument("--workers", type=int, default=WORKERS_PREFETCH)
+    parser.add_argument("--log-nivel", choices=("DEBUG", "INFO", "WARNING", "ERROR"), default="INFO")
+    args = parser.parse_args(argv)
+
+    configurar_logging(args.log_nivel)
+    prefetcher = Prefetcher(leer_cursos_prefetch(args.cursos), intervalo=args.intervalo, max_workers=args.workers)
+    if args.una_vez:
+        prefetcher.ejecutar_pasada()
+        return
+    prefetcher.iniciar()
+    try:
+        while prefetcher._hilo.is_alive():
+            prefetcher._hilo.join(1)
+    except KeyboardInterrupt:
+        prefetcher.detener()
+
+
+if __name__ == "__main__":
+    main()
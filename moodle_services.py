@@ -1,33 +1,35 @@
-import streamlit as st # <--- IMPORTANTE: Añade esta línea
-import requests
-import json
+import contextvars
+import logging
+import os
+import threading
+import time
 import urllib3
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
+from functools import partial
+from itertools import islice
+
+# Este módulo no importa Streamlit: la configuración se resuelve al crear el cliente (ver
+# moodle_config.py) y pandas (analisis_tiempos) solo se importa al analizar, para que scripts
+# y workers que solo descargan datos arranquen rápido.
+from moodle_cache import MODOS_LECTURA, AlmacenLocal, CacheRespuestas, Revalidador, modo_cache, modo_cache_actual
+from moodle_client import MoodleClient, llamar_ws
+from moodle_config import resolver_configuracion
+from moodle_metricas import log_evento, logger
+from moodle_stream import CAMPOS_CALIFICACION, CAMPOS_SUBMISION, CAMPOS_TAREA, extraer_tareas
+from moodle_sync import EstadoSincronizacion, MARGEN_SYNC_SEGUNDOS
 
 # Suprimir warnings de SSL no verificado (NO RECOMENDADO PARA PRODUCCIÓN SIN VALIDACIÓN)
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-try:
-    # Intenta acceder a los secrets. Esto funcionará en Streamlit Cloud si están configurados,
-    # o localmente si tienes un archivo .streamlit/secrets.toml
-    MOODLE_URL_BASE = st.secrets["MOODLE_API_URL_BASE"]
-    MOODLE_TOKEN    = st.secrets["MOODLE_API_TOKEN"]
-
-except KeyError as e:
-    # Este bloque se ejecuta si el archivo secrets.toml existe (o los secrets están configurados en la nube)
-    # PERO una de las claves específicas (MOODLE_API_URL_BASE o MOODLE_API_TOKEN) no se encuentra.
-    error_message = (
-        f"ERROR CRÍTICO: La clave secreta '{e.args[0]}' no fue encontrada.\n"
-        "Por favor, asegúrate de que MOODLE_API_URL_BASE y MOODLE_API_TOKEN estén definidos:\n"
-        "- En Streamlit Community Cloud: En la configuración 'Secrets' de tu aplicación.\n"
-        "- Para desarrollo local: En un archivo llamado '.streamlit/secrets.toml' en la raíz de tu proyecto."
-    )
-    print(error_message)
-    # Detener la aplicación si faltan secretos cruciales
-    # MOODLE_URL_BASE = "ERROR_URL_NO_CONFIGURADA" # Para evitar NameError más adelante
-    # MOODLE_TOKEN = "ERROR_TOKEN_NO_CONFIGURADO" # Para evitar NameError más adelante
-    st.error(error_message)
-    st.stop() # Detiene la ejecución del script de Streamlit
+
+def __getattr__(nombre):
+    """Compatibilidad: MOODLE_URL_BASE / MOODLE_TOKEN se resuelven de forma perezosa al pedirlos."""
+    if nombre == "MOODLE_URL_BASE":
+        return get_client().url_base
+    if nombre == "MOODLE_TOKEN":
+        return get_client().token
+    raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
 
 # --- FUNCIONES AUXILIARES ---
 # (tus funciones timestamp_to_datetime_str y calculate_time_difference se mantienen igual)
@@ -59,317 +61,689 @@ def calculate_time_difference(start_ts, end_ts):
     return "N/A"
 
 
+def _formatear_tarea(assign_data, course_id):
+    """Convierte una tarea cruda de mod_assign_get_assignments al formato que usa la app."""
+    return {
+        "id": assign_data.get("id"), # Este es el assignmentid
+        "cmid": assign_data.get("cmid"),
+        "courseid_original_request": course_id,
+        "name": assign_data.get("name"),
+        "duedate_ts": assign_data.get("duedate"),
+        "allowsubmissionsfromdate_ts": assign_data.get("allowsubmissionsfromdate"),
+        "gradingduedate_ts": assign_data.get("gradingduedate"),
+        "cutoffdate_ts": assign_data.get("cutoffdate"),
+        "duedate_str": timestamp_to_datetime_str(assign_data.get("duedate")),
+        "allowsubmissionsfromdate_str": timestamp_to_datetime_str(assign_data.get("allowsubmissionsfromdate")),
+        "gradingduedate_str": timestamp_to_datetime_str(assign_data.get("gradingduedate")),
+        "cutoffdate_str": timestamp_to_datetime_str(assign_data.get("cutoffdate")),
+    }
+
+
 # --- FUNCIONES WEB SERVICES MOODLE ---
 
-def obtener_tareas_por_curso(course_id):
+# Cliente compartido: una sola requests.Session (keep-alive + reintentos) para todas las llamadas
+_client = None
+_client_lock = threading.Lock()
+_config_explicita = {}
+
+def configurar(url_base=None, token=None, **opciones_cliente):
     """
-    Obtiene todas las tareas (assignments) de un curso específico.
+    Fija explícitamente la URL/token (tienen prioridad sobre entorno y secrets) y opciones
+    extra de MoodleClient. Descarta el cliente actual para que el siguiente get_client lo use.
+    """
+    global _client
+    with _client_lock:
+        _config_explicita.clear()
+        _config_explicita.update(opciones_cliente, url_base=url_base, token=token)
+        _client = None
+
+
+def get_client():
+    """
+    Devuelve el MoodleClient compartido del módulo, creándolo en el primer uso (seguro entre hilos).
+    Lanza moodle_config.ConfiguracionMoodleError si no hay URL o token configurados.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                opciones = dict(_config_explicita)
+                url_base, token = resolver_configuracion(opciones.pop("url_base", None), opciones.pop("token", None))
+                # MOODLE_CACHE_DISABLED=1 desactiva la caché en disco (p. ej. en entornos de solo lectura)
+                if "cache" not in opciones:
+                    opciones["cache"] = None if os.environ.get("MOODLE_CACHE_DISABLED") == "1" else CacheRespuestas()
+                _client = MoodleClient(url_base, token, **opciones)
+    return _client
+
+
+# Almacén local por entidad (tareas de cada curso, análisis de cada tarea), lo llena también el
+# prefetch en segundo plano (moodle_prefetch.py), y refrescos en segundo plano de lo caducado
+_almacen = None
+_almacen_configurado = False
+_revalidador = None
+
+
+def configurar_almacen(almacen):
+    """Fija el AlmacenLocal que usan las consultas (None lo desactiva)."""
+    global _almacen, _almacen_configurado
+    with _client_lock:
+        _almacen = almacen
+        _almacen_configurado = True
+
+
+def get_almacen():
+    """
+    Devuelve el AlmacenLocal compartido, creándolo en el primer uso si no se configuró uno.
+    None si MOODLE_CACHE_DISABLED=1 (mismo interruptor que la caché en disco).
+    """
+    global _almacen, _almacen_configurado
+    if not _almacen_configurado:
+        with _client_lock:
+            if not _almacen_configurado:
+                _almacen = None if os.environ.get("MOODLE_CACHE_DISABLED") == "1" else AlmacenLocal()
+                _almacen_configurado = True
+    return _almacen
+
+
+def get_revalidador():
+    global _revalidador
+    if _revalidador is None:
+        with _client_lock:
+            if _revalidador is None:
+                _revalidador = Revalidador()
+    return _revalidador
+
+
+def _en_modo_refrescar(funcion, *args, **kwargs):
+    """Ejecuta funcion en modo de caché "refrescar" (descarga y reescribe cachés y almacén)."""
+    with modo_cache("refrescar"):
+        return funcion(*args, **kwargs)
+
+
+def _leer_almacen(tipo, ident, caducados):
+    """
+    Lectura del almacén: el valor guardado de la entidad, o None. En modo de caché "usar" solo
+    vale una entrada vigente; en "obsoleto" (stale-while-revalidate) una caducada se devuelve
+    igual y `ident` se añade a `caducados`, para que quien llama programe una sola recarga en
+    segundo plano con todas (ver _revalidar), así la latencia interactiva no depende de Moodle.
+    """
+    almacen = get_almacen()
+    modo = modo_cache_actual()
+    if almacen is None or modo not in MODOS_LECTURA:
+        return None
+    entrada = almacen.get(tipo, ident, variante_descarga())
+    if entrada is None:
+        return None
+    valor, caducado = entrada
+    if caducado:
+        if modo != "obsoleto":
+            return None
+        caducados.append(ident)
+    return valor
+
+
+def _revalidar(tipo, idents, recargar):
+    """Programa en segundo plano una sola llamada recargar(ids) con los `idents` caducados que no se estén recargando ya."""
+    if not idents:
+        return
+    programadas = get_revalidador().programar([(tipo, ident) for ident in idents],
+                                              lambda claves: recargar([ident for _, ident in claves]))
+    if programadas:
+        log_evento(logging.DEBUG, "almacen_revalidar", tipo=tipo, ids=len(programadas))
+
+
+def _guardar_almacen(tipo, ident, valor):
+    """Guarda en el almacén; un fallo (SQLite bloqueada, disco lleno...) se registra y no corta la consulta."""
+    almacen = get_almacen()
+    if almacen is None or modo_cache_actual() == "omitir":
+        return
+    try:
+        almacen.set(tipo, ident, valor, variante_descarga())
+    except Exception:
+        logger.exception("almacen_error_escritura", extra={"campos": {"tipo": tipo, "id": ident}})
+
+
+# --- DESCARGA LIGERA ---
+# Pide a Moodle la variante más pequeña de cada web service y descarta al decodificar lo que la
+# app no usa:
+#   - mod_assign_get_assignments: sin intro, configs ni adjuntos (parseo en streaming, CAMPOS_TAREA)
+#   - mod_assign_list_participants: onlyids=1 (Moodle sigue devolviendo id y fullname)
+# Las submisiones se piden siempre en todos sus estados: la columna "Estado Envío" los muestra.
+# Como las tareas guardadas no tienen los mismos campos en un modo y en otro, el modo forma parte
+# de las claves del almacén local y de la caché en memoria (ver variante_descarga y clave_memo).
+# MOODLE_DESCARGA_LIGERA=0 vuelve a las respuestas completas.
+_descarga_ligera = os.environ.get("MOODLE_DESCARGA_LIGERA", "1") != "0"
+
+
+def configurar_descarga_ligera(activa):
+    """Activa o desactiva la descarga ligera para las siguientes llamadas."""
+    global _descarga_ligera
+    _descarga_ligera = bool(activa)
+
+
+def descarga_ligera():
+    return _descarga_ligera
+
+
+def variante_descarga():
+    """Variante de las entradas del almacén local según el modo de descarga ("" = completa)."""
+    return "ligera" if _descarga_ligera else ""
+
+
+def clave_memo(tipo, ident):
+    """Clave de una entidad en la CacheMemoria compartida: (tipo, id, modo de descarga)."""
+    return tipo, ident, variante_descarga()
+
+
+# Número de cursos que se envían en cada llamada a mod_assign_get_assignments
+TAREAS_CHUNK_SIZE = 50
+
+def _obtener_tareas_chunk(course_ids):
+    """
+    Llama una sola vez a mod_assign_get_assignments con varios courseids[n].
+    Devuelve {course_id: lista_de_tareas} para los cursos devueltos por Moodle,
+    {course_id: None} para los cursos reportados en 'warnings', o None si falló la llamada completa.
     """
     params = {
-        "wstoken":                   MOODLE_TOKEN,
-        "wsfunction":                "mod_assign_get_assignments",
-        "moodlewsrestformat":        "json",
-        "courseids[0]":              course_id,
         # "capabilities[0]":           "mod/assign:view", # Opcional
         "includenotenrolledcourses": 1 # Opcional
     }
+    for i, course_id in enumerate(course_ids):
+        params[f"courseids[{i}]"] = course_id
 
-    print(f"DEBUG: obtener_tareas_por_curso - Llamando a mod_assign_get_assignments con params: {params}")
+    data = llamar_ws(get_client(), "mod_assign_get_assignments", params, f"para {len(course_ids)} cursos",
+                     decodificar=(extraer_tareas, CAMPOS_TAREA) if _descarga_ligera else None)
+    if data is None:
+        return None
 
-    try:
-        r = requests.post(MOODLE_URL_BASE, data=params, verify=False)
-        print(f"DEBUG: obtener_tareas_por_curso - Respuesta HTTP Status Code: {r.status_code}")
-        r.raise_for_status()
-        data = r.json()
-
-        if "exception" in data:
-            print(f"MOODLE API EXCEPTION (obtener_tareas_por_curso): {data.get('message', 'Sin mensaje')}")
-            print(f"MOODLE API EXCEPTION Detalle: errorcode='{data.get('errorcode', 'N/A')}', debuginfo='{data.get('debuginfo', 'N/A')}'")
-            return []
-
-        assignments_list = []
-        courses_data = data.get("courses", [])
-        print(f"DEBUG: obtener_tareas_por_curso - Cursos encontrados: {len(courses_data)}")
-
-        if not courses_data:
-            print("DEBUG: obtener_tareas_por_curso - No se devolvieron cursos en la respuesta.")
-            return []
-
-        for course_data in courses_data:
-            # Asegurarse que el ID del curso procesado es el que se solicitó.
-            # Si course_id es un string, convertirlo a int para la comparación.
-            if course_data.get("id") == int(course_id): 
-                for assign_data in course_data.get("assignments", []):
-                    assignments_list.append({
-                        "id": assign_data.get("id"), # Este es el assignmentid
-                        "cmid": assign_data.get("cmid"),
-                        "name": assign_data.get("name"),
-                        "duedate_ts": assign_data.get("duedate"),
-                        "allowsubmissionsfromdate_ts": assign_data.get("allowsubmissionsfromdate"),
-                        "gradingduedate_ts": assign_data.get("gradingduedate"),
-                        "cutoffdate_ts": assign_data.get("cutoffdate"),
-                        "duedate_str": timestamp_to_datetime_str(assign_data.get("duedate")),
-                        "allowsubmissionsfromdate_str": timestamp_to_datetime_str(assign_data.get("allowsubmissionsfromdate")),
-                        "gradingduedate_str": timestamp_to_datetime_str(assign_data.get("gradingduedate")),
-                        "cutoffdate_str": timestamp_to_datetime_str(assign_data.get("cutoffdate")),
-                    })
-                break 
-        
-        print(f"DEBUG: obtener_tareas_por_curso - Total tareas encontradas para curso {course_id}: {len(assignments_list)}")
-        return assignments_list
-
-    except requests.exceptions.HTTPError as e_http:
-        print(f"CRITICAL ERROR: HTTPError en obtener_tareas_por_curso: {e_http}")
-        if e_http.response is not None: print(f"CRITICAL ERROR: Respuesta del servidor (HTTPError): {e_http.response.text}")
-        return []
-    except requests.exceptions.RequestException as e_req:
-        print(f"CRITICAL ERROR: RequestException en obtener_tareas_por_curso: {e_req}")
-        return []
-    except json.JSONDecodeError as e_json:
-        print(f"CRITICAL ERROR: JSONDecodeError en obtener_tareas_por_curso. Error: {e_json}. Respuesta: {r.text if 'r' in locals() else 'No response object'}")
-        return []
-    except Exception as e_general:
-        print(f"CRITICAL ERROR: Excepción general en obtener_tareas_por_curso: {e_general}")
-        import traceback
-        traceback.print_exc()
-        return []
+    resultado = {course_id: [] for course_id in course_ids}
+    for course_data in data.get("courses", []):
+        course_id = course_data.get("id")
+        if course_id in resultado:
+            resultado[course_id] = [_formatear_tarea(a, course_id) for a in course_data.get("assignments", [])]
 
-# EN moodle_services.py
+    # Moodle informa los cursos sin acceso o inexistentes en 'warnings' en lugar de lanzar excepción
+    for warning in data.get("warnings", []):
+        if warning.get("item") == "course" and warning.get("itemid") in resultado:
+            log_evento(logging.WARNING, "moodle_api_warning", wsfunction="mod_assign_get_assignments",
+                       course_id=warning.get("itemid"), mensaje=warning.get("message", "N/A"))
+            resultado[warning["itemid"]] = None
+    return resultado
 
-# ... (MOODLE_URL_BASE, MOODLE_TOKEN, funciones auxiliares, obtener_tareas_por_curso se mantienen) ...
 
-def obtener_participantes(assignid):
-    """Obtiene los participantes de una tarea (assignment.id)."""
-    print(f"DEBUG: obtener_participantes - Intentando obtener participantes para assignid: {assignid}")
-    params = {
-        "wstoken":            MOODLE_TOKEN,
-        "wsfunction":         "mod_assign_list_participants",
-        "moodlewsrestformat": "json",
-        "assignid":           assignid,
-        "groupid":            0,
-        "filter":             "",
-        "skip":               0,
-        "limit":              0,
-        "onlyids":            0,
-        "includeenrolments":  1
-    }
+def obtener_tareas_por_curso(course_id):
+    """
+    Obtiene todas las tareas (assignments) de un curso específico.
+    Si el curso está en el almacén local se devuelve de ahí (ver _leer_almacen).
+    """
+    course_id = int(course_id)
+    caducados = []
+    guardado = _leer_almacen("tareas", course_id, caducados)
+    if guardado is not None:
+        _revalidar("tareas", caducados, partial(_en_modo_refrescar, obtener_tareas_por_cursos))
+        return guardado
+    resultado = _obtener_tareas_chunk([course_id])
+    if resultado is None:
+        return []
+    assignments_list = resultado.get(course_id)
+    if assignments_list is not None:
+        _guardar_almacen("tareas", course_id, assignments_list)
+    assignments_list = assignments_list or []
+    log_evento(logging.DEBUG, "tareas_por_curso", course_id=course_id, tareas=len(assignments_list))
+    return assignments_list
+
+
+def obtener_tareas_por_cursos(course_ids, chunk_size=TAREAS_CHUNK_SIZE, progress_callback=None, caducados=None):
+    """
+    Variante masiva de obtener_tareas_por_curso: consulta varios cursos por llamada.
+
+    Devuelve un diccionario {course_id: lista_de_tareas} en el mismo orden que course_ids.
+    Un valor None indica que la consulta de ESE curso falló. Si falla un bloque completo,
+    sus cursos se reintentan uno a uno para que el error quede asociado al curso culpable.
+    progress_callback(procesados, total), si se indica, se llama tras cada bloque.
+    Los cursos que están en el almacén local se sirven de ahí sin llamar a Moodle; si se pasa
+    la lista `caducados`, se le añaden los que se sirvieron caducados (modo "obsoleto").
+    """
+    ids_unicos = list(dict.fromkeys(int(c) for c in course_ids))
+    chunk_size = max(1, int(chunk_size))
+    resultados = {}
+    caducados = [] if caducados is None else caducados
+    for course_id in ids_unicos:
+        guardado = _leer_almacen("tareas", course_id, caducados)
+        if guardado is not None:
+            resultados[course_id] = guardado
+    _revalidar("tareas", caducados, partial(_en_modo_refrescar, obtener_tareas_por_cursos))
+    pendientes = [course_id for course_id in ids_unicos if course_id not in resultados]
+    if progress_callback and resultados:
+        progress_callback(len(resultados), len(ids_unicos))
+
+    for inicio in range(0, len(pendientes), chunk_size):
+        chunk = pendientes[inicio:inicio + chunk_size]
+        resultado_chunk = _obtener_tareas_chunk(chunk)
+        if resultado_chunk is None:
+            log_evento(logging.WARNING, "bloque_cursos_fallido", cursos=len(chunk), accion="consulta_individual")
+            resultado_chunk = {}
+            for course_id in chunk:
+                individual = _obtener_tareas_chunk([course_id])
+                resultado_chunk[course_id] = None if individual is None else individual.get(course_id)
+        for course_id, tareas in resultado_chunk.items():
+            if tareas is not None:
+                _guardar_almacen("tareas", course_id, tareas)
+        resultados.update(resultado_chunk)
+        if progress_callback:
+            progress_callback(len(resultados), len(ids_unicos))
+
+    log_evento(logging.INFO, "tareas_por_cursos", cursos=len(ids_unicos),
+               con_error=sum(1 for v in resultados.values() if v is None))
+    return {course_id: resultados.get(course_id) for course_id in ids_unicos}
+
+
+# Participantes por página de mod_assign_list_participants. Con paginación, la respuesta más
+# grande en memoria es una página, no el curso entero (cursos de servicio con 20k+ matrículas).
+PARTICIPANTES_POR_PAGINA = 2000
+
+
+class ParticipantesError(Exception):
+    """Falló una página de mod_assign_list_participants (el detalle ya quedó en el log)."""
+
+    def __init__(self, assignid, skip):
+        super().__init__(f"Error al obtener participantes de la tarea {assignid} (skip={skip})")
+        self.assignid = assignid
+        self.skip = skip
+
+
+def iterar_participantes(assignid, por_pagina=PARTICIPANTES_POR_PAGINA, incluir_matriculas=False):
+    """
+    Generador de los participantes de una tarea (dicts tal cual los devuelve Moodle), recorriendo
+    páginas de `por_pagina` con skip/limit. Con incluir_matriculas=False se pide
+    includeenrolments=0, que omite la lista de cursos de cada participante (la mayor parte del
+    payload), y en descarga ligera además onlyids=1 (solo id, fullname y los indicadores de
+    envío). por_pagina=0 pide todo en una sola respuesta.
+    Lanza ParticipantesError si falla alguna página.
+    """
+    skip = 0
+    while True:
+        params = {
+            "assignid":           assignid,
+            "groupid":            0,
+            "filter":             "",
+            "skip":               skip,
+            "limit":              por_pagina,
+            "onlyids":            1 if _descarga_ligera and not incluir_matriculas else 0,
+            "includeenrolments":  1 if incluir_matriculas else 0
+        }
+        pagina = llamar_ws(get_client(), "mod_assign_list_participants", params,
+                           f"para assignid {assignid} (skip {skip})")
+        if not isinstance(pagina, list):
+            if pagina is not None: # Si la respuesta no es una lista, es inesperado para mod_assign_list_participants
+                log_evento(logging.ERROR, "participantes_respuesta_inesperada", assignid=assignid,
+                           tipo=type(pagina).__name__, datos=str(pagina)[:300])
+            raise ParticipantesError(assignid, skip)
+        log_evento(logging.DEBUG, "participantes_pagina", assignid=assignid, skip=skip, recibidos=len(pagina))
+        yield from pagina
+        if not por_pagina or len(pagina) < por_pagina:
+            return
+        skip += por_pagina
+
+
+def obtener_participantes(assignid, por_pagina=PARTICIPANTES_POR_PAGINA):
+    """
+    Obtiene los participantes de una tarea (assignment.id) como {id: fullname}, página a página
+    y sin datos de matrícula (el análisis solo usa id y nombre). None si hay error.
+    """
     try:
-        r = requests.post(MOODLE_URL_BASE, data=params, verify=False)
-        print(f"DEBUG: obtener_participantes - Status Code: {r.status_code} para assignid: {assignid}")
-        # print(f"DEBUG: obtener_participantes - Respuesta cruda: {r.text[:300]}...") # Descomentar si es necesario
-        r.raise_for_status()
-        parts_data = r.json()
-        if "exception" in parts_data:
-            print(f"MOODLE API EXCEPTION (obtener_participantes) para assignid {assignid}: {parts_data.get('message', 'N/A')}, ErrorCode: {parts_data.get('errorcode', 'N/A')}")
-            return None # Indicar error
-        
-        # Si parts_data es una lista (como se espera)
-        if isinstance(parts_data, list):
-            print(f"DEBUG: obtener_participantes - Número de participantes JSON crudos recibidos: {len(parts_data)}")
-            participants_dict = {p["id"]: p.get("fullname", "Nombre Desconocido") for p in parts_data if "id" in p}
-            print(f"DEBUG: obtener_participantes - Diccionario de participantes procesado (primeros 3): {dict(list(participants_dict.items())[:3])}")
-            return participants_dict if participants_dict else {} # Devolver dict vacío si no hay participantes válidos
-        else:
-            # Si la respuesta no es una lista, es inesperado para mod_assign_list_participants
-            print(f"CRITICAL ERROR: obtener_participantes - Respuesta inesperada, no es una lista. Tipo: {type(parts_data)}. Datos: {str(parts_data)[:300]}...")
-            return None # Indicar error
+        return {p["id"]: p.get("fullname", "Nombre Desconocido")
+                for p in iterar_participantes(assignid, por_pagina) if "id" in p}
+    except ParticipantesError:
+        return None # Indicar error
 
-    except requests.exceptions.HTTPError as e_http:
-        print(f"CRITICAL ERROR (HTTPError) en obtener_participantes para assignid {assignid}: {e_http}")
-        if e_http.response is not None: print(f"CRITICAL ERROR: Respuesta del servidor: {e_http.response.text}")
-        return None
-    except requests.exceptions.RequestException as e_req:
-        print(f"CRITICAL ERROR (RequestException) en obtener_participantes para assignid {assignid}: {e_req}")
-        return None
-    except json.JSONDecodeError as e_json:
-        print(f"CRITICAL ERROR (JSONDecodeError) en obtener_participantes para assignid {assignid}. Error: {e_json}. Respuesta: {r.text if 'r' in locals() else 'No response object'}")
-        return None
-    except Exception as e_general:
-        print(f"CRITICAL ERROR (Excepción general) en obtener_participantes para assignid {assignid}: {e_general}")
-        import traceback
-        traceback.print_exc()
+
+# Número de tareas que se envían en cada llamada a mod_assign_get_submissions / mod_assign_get_grades
+ASIGNACIONES_CHUNK_SIZE = 50
+
+def _obtener_por_tareas_chunk(wsfunction, clave_lista, assignids, extra_params, campos=None):
+    """
+    Llama una sola vez a `wsfunction` con varios assignmentids[n] y separa la respuesta por tarea.
+    Devuelve {assignid: data["assignments"][k][clave_lista]} o None si falló la llamada completa.
+    Las tareas que Moodle no devuelve (p. ej. sin calificaciones) quedan como lista vacía.
+    Con `campos` cada registro es una tupla de esos campos, extraída en streaming (moodle_stream).
+    """
+    params = dict(extra_params)
+    for i, assignid in enumerate(assignids):
+        params[f"assignmentids[{i}]"] = assignid
+
+    data = llamar_ws(get_client(), wsfunction, params, f"para {len(assignids)} tareas",
+                     registros=(clave_lista, campos) if campos else None)
+    if data is None:
         return None
 
+    resultado = {assignid: [] for assignid in assignids}
+    for assign_data in data.get("assignments", []):
+        assignid = assign_data.get("assignmentid")
+        if assignid in resultado:
+            resultado[assignid] = assign_data.get(clave_lista, [])
+    return resultado
+
+
+def _obtener_por_tareas(wsfunction, clave_lista, assignids, extra_params, chunk_size, campos=None):
+    """Reparte assignids en bloques de chunk_size; si un bloque falla, sus tareas quedan en None."""
+    chunk_size = max(1, int(chunk_size))
+    resultados = {}
+    for inicio in range(0, len(assignids), chunk_size):
+        chunk = assignids[inicio:inicio + chunk_size]
+        resultado_chunk = _obtener_por_tareas_chunk(wsfunction, clave_lista, chunk, extra_params, campos)
+        if resultado_chunk is None:
+            resultado_chunk = {assignid: None for assignid in chunk}
+        resultados.update(resultado_chunk)
+    return resultados
+
+
 def obtener_submisiones(assignid):
     """Obtiene todas las submisiones para una tarea específica (assignment.id)."""
-    print(f"DEBUG: obtener_submisiones - Intentando obtener submisiones para assignid: {assignid}")
-    params = {
-        "wstoken":            MOODLE_TOKEN,
-        "wsfunction":         "mod_assign_get_submissions",
-        "moodlewsrestformat": "json",
-        "assignmentids[0]":   assignid,
-        "status":             "", 
-    }
-    try:
-        r = requests.post(MOODLE_URL_BASE, data=params, verify=False)
-        print(f"DEBUG: obtener_submisiones - Status Code: {r.status_code} para assignid: {assignid}")
-        r.raise_for_status()
-        data = r.json()
-
-        if "exception" in data:
-            print(f"MOODLE API EXCEPTION (obtener_submisiones) para assignid {assignid}: {data.get('message', 'N/A')}, ErrorCode: {data.get('errorcode', 'N/A')}")
-            return None # Indicar error
-        
-        if data.get("assignments") and len(data["assignments"]) > 0:
-            submissions = data["assignments"][0].get("submissions", [])
-            print(f"DEBUG: obtener_submisiones - Número de submisiones encontradas: {len(submissions)}")
-            return submissions
-        else:
-            print(f"DEBUG: obtener_submisiones - No se encontró la estructura 'assignments' o estaba vacía para assignid {assignid}.")
-            return [] # Devuelve lista vacía si la estructura no es la esperada pero no hay excepción
-            
-    except requests.exceptions.HTTPError as e_http:
-        print(f"CRITICAL ERROR (HTTPError) en obtener_submisiones para assignid {assignid}: {e_http}")
-        if e_http.response is not None: print(f"CRITICAL ERROR: Respuesta del servidor: {e_http.response.text}")
-        return None
-    # ... (resto de los except como antes, devolviendo None) ...
-    except requests.exceptions.RequestException as e_req:
-        print(f"CRITICAL ERROR (RequestException) en obtener_submisiones para assignid {assignid}: {e_req}")
-        return None
-    except json.JSONDecodeError as e_json:
-        print(f"CRITICAL ERROR (JSONDecodeError) en obtener_submisiones para assignid {assignid}. Error: {e_json}. Respuesta: {r.text if 'r' in locals() else 'No response object'}")
-        return None
-    except Exception as e_general:
-        print(f"CRITICAL ERROR (Excepción general) en obtener_submisiones para assignid {assignid}: {e_general}")
-        import traceback
-        traceback.print_exc()
-        return None
+    return obtener_submisiones_multiples([assignid]).get(assignid)
 
 
 def obtener_calificaciones_tarea(assignid):
     """Obtiene las calificaciones para una tarea específica (assignment.id)."""
-    print(f"DEBUG: obtener_calificaciones_tarea - Intentando obtener calificaciones para assignid: {assignid}")
-    params = {
-        "wstoken":            MOODLE_TOKEN,
-        "wsfunction":         "mod_assign_get_grades",
-        "moodlewsrestformat": "json",
-        "assignmentids[0]":   assignid,
-        "since":              0 
-    }
-    try:
-        r = requests.post(MOODLE_URL_BASE, data=params, verify=False)
-        print(f"DEBUG: obtener_calificaciones_tarea - Status Code: {r.status_code} para assignid: {assignid}")
-        r.raise_for_status()
-        data = r.json()
-
-        if "exception" in data:
-            print(f"MOODLE API EXCEPTION (obtener_calificaciones_tarea) para assignid {assignid}: {data.get('message', 'N/A')}, ErrorCode: {data.get('errorcode', 'N/A')}")
-            return None # Indicar error
-
-        if data.get("assignments") and len(data["assignments"]) > 0:
-            grades = data["assignments"][0].get("grades", [])
-            print(f"DEBUG: obtener_calificaciones_tarea - Número de calificaciones encontradas: {len(grades)}")
-            return grades
-        else:
-            print(f"DEBUG: obtener_calificaciones_tarea - No se encontró la estructura 'assignments' o estaba vacía para assignid {assignid}.")
-            return [] # Devuelve lista vacía si la estructura no es la esperada pero no hay excepción
-            
-    except requests.exceptions.HTTPError as e_http:
-        print(f"CRITICAL ERROR (HTTPError) en obtener_calificaciones_tarea para assignid {assignid}: {e_http}")
-        if e_http.response is not None: print(f"CRITICAL ERROR: Respuesta del servidor: {e_http.response.text}")
-        return None
-    # ... (resto de los except como antes, devolviendo None) ...
-    except requests.exceptions.RequestException as e_req:
-        print(f"CRITICAL ERROR (RequestException) en obtener_calificaciones_tarea para assignid {assignid}: {e_req}")
-        return None
-    except json.JSONDecodeError as e_json:
-        print(f"CRITICAL ERROR (JSONDecodeError) en obtener_calificaciones_tarea para assignid {assignid}. Error: {e_json}. Respuesta: {r.text if 'r' in locals() else 'No response object'}")
-        return None
-    except Exception as e_general:
-        print(f"CRITICAL ERROR (Excepción general) en obtener_calificaciones_tarea para assignid {assignid}: {e_general}")
-        import traceback
-        traceback.print_exc()
-        return None
+    return obtener_calificaciones_multiples([assignid]).get(assignid)
 
 
-def analizar_tiempos_calificacion_tarea(assignid):
+def obtener_submisiones_multiples(assignids, chunk_size=ASIGNACIONES_CHUNK_SIZE, campos=None):
     """
-    Analiza los tiempos de calificación para una tarea específica (assignment.id).
+    Variante masiva de obtener_submisiones. Devuelve {assignid: lista_de_submisiones o None si hubo error}.
+    Con campos=moodle_stream.CAMPOS_SUBMISION (u otra tupla de claves) cada submisión es una tupla
+    compacta con esos campos y la respuesta se parsea en streaming sin materializar plugins ni archivos.
+    """
+    return _obtener_por_tareas("mod_assign_get_submissions", "submissions",
+                               list(assignids), {"status": ""}, chunk_size, campos)
+
+
+def obtener_calificaciones_multiples(assignids, chunk_size=ASIGNACIONES_CHUNK_SIZE, campos=None):
+    """
+    Variante masiva de obtener_calificaciones_tarea. Devuelve {assignid: lista_de_calificaciones o None si hubo error}.
+    `campos` como en obtener_submisiones_multiples (p. ej. moodle_stream.CAMPOS_CALIFICACION).
+    """
+    return _obtener_por_tareas("mod_assign_get_grades", "grades",
+                               list(assignids), {"since": 0}, chunk_size, campos)
+
+
+# --- SINCRONIZACIÓN INCREMENTAL (parámetro `since`) ---
+
+_estado_sync = None
+
+def get_estado_sync():
+    """Devuelve el EstadoSincronizacion compartido del módulo, creándolo en el primer uso."""
+    global _estado_sync
+    if _estado_sync is None:
+        with _client_lock:
+            if _estado_sync is None:
+                _estado_sync = EstadoSincronizacion()
+    return _estado_sync
+
+
+def _sincronizar_por_tareas(tipo, wsfunction, clave_lista, assignids, extra_params, chunk_size, campos=None):
     """
-    print(f"\nDEBUG: analizar_tiempos_calificacion_tarea - INICIANDO ANÁLISIS para assignid: {assignid}")
-    
-    participantes = obtener_participantes(assignid)
+    Descarga solo lo modificado desde el último sync de cada tarea, lo fusiona en el estado local
+    y devuelve {assignid: lista_completa_fusionada o None si falló la descarga del delta}.
+    Las tareas se agrupan por su valor de `since` porque Moodle solo acepta uno por llamada.
+    Con `campos` la lista fusionada se devuelve como RegistrosColumnares (ver EstadoSincronizacion.registros).
+    """
+    estado = get_estado_sync()
+    inicio_sync = int(time.time())
+    # "Forzar descarga" en la UI (modo refrescar) implica volver a bajar todo desde since=0
+    sync_completo = modo_cache_actual() == "refrescar"
+
+    grupos = {}
+    for assignid in assignids:
+        ultimo = 0 if sync_completo else estado.ultimo_sync(tipo, assignid)
+        since = max(0, ultimo - MARGEN_SYNC_SEGUNDOS) if ultimo else 0
+        grupos.setdefault(since, []).append(assignid)
+
+    resultados = {}
+    for since, grupo in grupos.items():
+        log_evento(logging.DEBUG, "sync_delta", wsfunction=wsfunction, since=since, tareas=len(grupo))
+        # Los deltas no se guardan en la caché de respuestas: su clave cambia en cada sync
+        with modo_cache("omitir"):
+            deltas = _obtener_por_tareas(wsfunction, clave_lista, grupo, {**extra_params, "since": since}, chunk_size)
+        for assignid in grupo:
+            if deltas.get(assignid) is None:
+                resultados[assignid] = None # No se avanza el último sync: se reintentará el mismo delta
+                continue
+            estado.fusionar(tipo, assignid, deltas[assignid], inicio_sync)
+            resultados[assignid] = estado.registros(tipo, assignid, campos)
+    return {assignid: resultados.get(assignid) for assignid in assignids}
+
+
+def sincronizar_submisiones(assignids, chunk_size=ASIGNACIONES_CHUNK_SIZE, campos=None):
+    """Como obtener_submisiones_multiples, pero descargando solo los cambios desde el último sync."""
+    return _sincronizar_por_tareas("submisiones", "mod_assign_get_submissions", "submissions",
+                                   list(assignids), {"status": ""}, chunk_size, campos)
+
+
+def sincronizar_calificaciones(assignids, chunk_size=ASIGNACIONES_CHUNK_SIZE, campos=None):
+    """Como obtener_calificaciones_multiples, pero descargando solo los cambios desde el último sync."""
+    return _sincronizar_por_tareas("calificaciones", "mod_assign_get_grades", "grades",
+                                   list(assignids), {}, chunk_size, campos)
+
+
+# --- ANÁLISIS DE TIEMPOS DE CALIFICACIÓN ---
+
+def _analizar_con_datos(assignid, participantes, submisiones, calificaciones):
+    """
+    Aplica las reglas de datos faltantes (None = error en la llamada) y cruza los datos de una tarea.
+    Si alguna llamada falló la tabla sale marcada con analisis_tiempos.marcar_error.
+    """
+    from analisis_tiempos import cruzar_datos_analisis_df, marcar_error, tabla_vacia
     # Si obtener_participantes devuelve None (error) o un diccionario vacío (sin participantes)
     if participantes is None:
-        print(f"ERROR: analizar_tiempos_calificacion_tarea - Falló la obtención de participantes para assignid {assignid}. No se puede continuar.")
-        return [] 
+        log_evento(logging.ERROR, "analisis_sin_participantes", assignid=assignid, motivo="error_en_llamada")
+        return marcar_error(tabla_vacia(assignid))
     if not participantes: # Diccionario vacío
-        print(f"INFO: analizar_tiempos_calificacion_tarea - No se encontraron participantes para assignid {assignid}. El análisis resultará vacío.")
-        return []
-        
-    submisiones = obtener_submisiones(assignid)
+        log_evento(logging.INFO, "analisis_sin_participantes", assignid=assignid, motivo="sin_participantes")
+        return tabla_vacia(assignid)
+
+    con_error = submisiones is None or calificaciones is None
     if submisiones is None: # Error en la llamada
-        print(f"ERROR: analizar_tiempos_calificacion_tarea - Falló la obtención de submisiones para assignid {assignid}.")
-        # Podrías decidir continuar sin submisiones o abortar. Por ahora, continuamos pero no habrá fechas de envío.
-        submisiones = [] # Tratar como lista vacía para que el resto del código no falle
-    
-    calificaciones = obtener_calificaciones_tarea(assignid)
+        log_evento(logging.ERROR, "analisis_datos_faltantes", assignid=assignid, datos="submisiones")
+        # Continuamos sin submisiones: no habrá fechas de envío pero el resto del análisis sigue siendo útil.
+        submisiones = []
     if calificaciones is None: # Error en la llamada
-        print(f"ERROR: analizar_tiempos_calificacion_tarea - Falló la obtención de calificaciones para assignid {assignid}.")
-        calificaciones = [] # Tratar como lista vacía
-
-    print(f"DEBUG: analizar_tiempos_calificacion_tarea - Participantes: {len(participantes)}, Submisiones: {len(submisiones)}, Calificaciones: {len(calificaciones)} para assignid {assignid}")
-
-    submisiones_por_usuario = {}
-    for sub in submisiones: # submisiones es una lista
-        userid = sub.get("userid")
-        if userid:
-            submisiones_por_usuario[userid] = {
-                "submission_time": sub.get("timemodified"), 
-                "submission_status": sub.get("status"),
-                "submitted": sub.get("status") == "submitted" or sub.get("status") == "graded"
-            }
-
-    calificaciones_por_usuario = {}
-    for grade_info in calificaciones: # calificaciones es una lista
-        userid = grade_info.get("userid")
-        if userid:
-            calificaciones_por_usuario[userid] = {
-                "grade": grade_info.get("grade"),
-                "timegraded": grade_info.get("timemodified") 
-            }
-
-    resultados_analisis = []
-    # Iterar sobre los participantes (que es un dict) es la base
-    for userid, fullname in participantes.items():
-        # ... (resto de la lógica de cruce de datos y cálculo de tiempo se mantiene igual) ...
-        info_sub = submisiones_por_usuario.get(userid, {})
-        info_grade = calificaciones_por_usuario.get(userid, {})
-        
-        student_submission_ts = None
-        if info_sub.get("submitted"): # Solo si realmente envió
-             student_submission_ts = info_sub.get("submission_time")
-        
-        teacher_graded_ts = info_grade.get("timegraded")
-        
-        tiempo_calificacion = "N/A"
-        if student_submission_ts and teacher_graded_ts:
-            tiempo_calificacion = calculate_time_difference(student_submission_ts, teacher_graded_ts)
-        elif student_submission_ts and not teacher_graded_ts:
-             tiempo_calificacion = "Pendiente de calificar"
-        elif not student_submission_ts: # Modificado para ser más general
-            if info_grade.get("grade") is not None: # Si no envió pero tiene nota
-                tiempo_calificacion = "Calificado sin envío"
-            else: # No envió y no tiene nota
-                tiempo_calificacion = "No ha enviado"
-        else: # Otros casos (ej. no hay student_submission_ts pero sí teacher_graded_ts sin nota)
-            tiempo_calificacion = "Situación de datos incompleta"
-
-
-        resultados_analisis.append({
-            "assignment_id": assignid,
-            "user_id": userid,
-            "student_name": fullname,
-            "submission_status": info_sub.get("submission_status", "Sin información de envío"),
-            "submission_date_ts": student_submission_ts,
-            "submission_date_str": timestamp_to_datetime_str(student_submission_ts),
-            "graded_date_ts": teacher_graded_ts,
-            "graded_date_str": timestamp_to_datetime_str(teacher_graded_ts),
-            "grade": info_grade.get("grade", "Sin calificar"),
-            "time_to_grade_str": tiempo_calificacion
-        })
-    
-    print(f"DEBUG: analizar_tiempos_calificacion_tarea - Total resultados generados: {len(resultados_analisis)}")
+        log_evento(logging.ERROR, "analisis_datos_faltantes", assignid=assignid, datos="calificaciones")
+        calificaciones = []
+
+    resultados_analisis = cruzar_datos_analisis_df(assignid, participantes, submisiones, calificaciones)
+    if con_error: # Tabla útil para mostrar, pero incompleta
+        marcar_error(resultados_analisis)
+    log_evento(logging.DEBUG, "analisis_tarea", assignid=assignid, participantes=len(participantes),
+               submisiones=len(submisiones), calificaciones=len(calificaciones), filas=len(resultados_analisis))
     return resultados_analisis
 
-# El resto de moodle_services.py (obtener_tareas_por_curso) no cambia.
\ No newline at end of file
+
+# Tamaño por defecto del pool de hilos del análisis concurrente (no debe superar el pool de conexiones del cliente)
+MAX_WORKERS = 8
+
+def iterar_analisis_concurrente(assignids, max_workers=MAX_WORKERS, chunk_size=ASIGNACIONES_CHUNK_SIZE, incremental=False,
+                                caducados=None):
+    """
+    Motor concurrente del análisis de tiempos de calificación.
+
+    Lanza en un pool acotado de `max_workers` hilos las llamadas de participantes (una por tarea)
+    y las de submisiones / calificaciones (una por bloque de chunk_size tareas), con como mucho
+    max_workers bloques en vuelo, y produce (assignid, resultados_analisis) en cuanto una tarea
+    tiene sus tres datos. El orden de salida
+    es el de finalización; quien necesite orden determinista debe indexar por assignid.
+    Un fallo en cualquiera de las llamadas solo afecta a las tareas que dependen de ella.
+    Con incremental=True submisiones y calificaciones salen del estado local sincronizado
+    (solo se descargan los cambios desde el último sync). Las tareas que ya están en el
+    almacén local se producen primero, sin llamar a Moodle (ver _leer_almacen); si se pasa la
+    lista `caducados`, se le añaden las que se produjeron caducadas (modo "obsoleto").
+    Las tareas cuyo análisis falló salen marcadas (analisis_tiempos.es_error), para distinguirlas
+    de las que simplemente no tienen datos.
+    """
+    from analisis_tiempos import es_error, marcar_error, tabla_vacia
+    assignids = list(dict.fromkeys(assignids))
+    guardados, pendientes = {}, []
+    caducados = [] if caducados is None else caducados
+    for assignid in assignids:
+        guardado = _leer_almacen("analisis", assignid, caducados)
+        if guardado is None:
+            pendientes.append(assignid)
+        else:
+            guardados[assignid] = guardado
+    _revalidar("analisis", caducados,
+               partial(_en_modo_refrescar, analizar_tiempos_calificacion_tareas, incremental=incremental))
+    yield from guardados.items()
+    assignids = pendientes
+    chunk_size = max(1, int(chunk_size))
+    datos = {assignid: {} for assignid in assignids}
+    # El análisis solo lee userid/status/grade/timemodified: se piden como RegistrosColumnares
+    # (parseados en streaming, o extraídos del estado local en modo incremental)
+    if incremental:
+        fn_submisiones = partial(sincronizar_submisiones, campos=CAMPOS_SUBMISION)
+        fn_calificaciones = partial(sincronizar_calificaciones, campos=CAMPOS_CALIFICACION)
+    else:
+        fn_submisiones = partial(obtener_submisiones_multiples, campos=CAMPOS_SUBMISION)
+        fn_calificaciones = partial(obtener_calificaciones_multiples, campos=CAMPOS_CALIFICACION)
+
+    max_workers = max(1, int(max_workers))
+    chunks = ((inicio, assignids[inicio:inicio + chunk_size]) for inicio in range(0, len(assignids), chunk_size))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futuros = {} # futuro -> (tipo, tareas afectadas, inicio del bloque); se sacan al terminar
+        restantes = {} # inicio del bloque -> futuros suyos sin terminar
+
+        def lanzar(inicio, chunk):
+            # Cada tarea corre con una copia del contexto actual para heredar el modo de caché de la sesión
+            llamadas = [("submisiones", chunk, fn_submisiones, (chunk, chunk_size)),
+                        ("calificaciones", chunk, fn_calificaciones, (chunk, chunk_size))]
+            llamadas += [("participantes", [assignid], obtener_participantes, (assignid,)) for assignid in chunk]
+            for tipo, afectadas, funcion, args in llamadas:
+                futuros[pool.submit(contextvars.copy_context().run, funcion, *args)] = (tipo, afectadas, inicio)
+            restantes[inicio] = len(llamadas)
+
+        # Como mucho max_workers bloques en vuelo: al terminar uno se lanza el siguiente, así la
+        # memoria (futuros y respuestas sin cruzar) no crece con el número de tareas.
+        for inicio, chunk in islice(chunks, max_workers):
+            lanzar(inicio, chunk)
+
+        while futuros:
+            hechos, _ = wait(futuros, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                tipo, afectadas, bloque = futuros.pop(futuro)
+                try:
+                    valor = futuro.result()
+                except Exception:
+                    logger.exception("analisis_error_descarga", extra={"campos": {"tipo": tipo, "assignids": afectadas}})
+                    valor = None
+
+                restantes[bloque] -= 1
+                if not restantes[bloque]:
+                    del restantes[bloque]
+                    siguiente = next(chunks, None)
+                    if siguiente is not None:
+                        lanzar(*siguiente)
+
+                for assignid in afectadas:
+                    if tipo == "participantes":
+                        datos[assignid][tipo] = valor
+                    else:
+                        datos[assignid][tipo] = None if valor is None else valor.get(assignid)
+
+                    if len(datos[assignid]) == 3:
+                        d = datos.pop(assignid)
+                        try:
+                            resultados = _analizar_con_datos(assignid, d["participantes"], d["submisiones"], d["calificaciones"])
+                        except Exception:
+                            logger.exception("analisis_error", extra={"campos": {"assignid": assignid}})
+                            resultados = marcar_error(tabla_vacia(assignid))
+                        # Las tablas vacías (sin datos) o con error no se guardan
+                        if not resultados.empty and not es_error(resultados):
+                            _guardar_almacen("analisis", assignid, resultados)
+                        yield assignid, resultados
+
+
+def analizar_tiempos_calificacion_tarea(assignid):
+    """
+    Analiza los tiempos de calificación para una tarea específica (assignment.id).
+    Las llamadas de participantes, submisiones y calificaciones se hacen en paralelo.
+    Devuelve la tabla columnar de analisis_tiempos.COLUMNAS_ANALISIS (vacía si no hay datos).
+    """
+    return analizar_tiempos_calificacion_tareas([assignid], max_workers=3)[assignid]
+
+
+def analizar_tiempos_calificacion_tareas(assignids, chunk_size=ASIGNACIONES_CHUNK_SIZE, max_workers=MAX_WORKERS, incremental=False):
+    """
+    Variante masiva de analizar_tiempos_calificacion_tarea.
+
+    Submisiones y calificaciones se piden en bloques de chunk_size tareas. Los participantes
+    se siguen pidiendo por tarea porque mod_assign_list_participants solo acepta un assignid.
+    Con max_workers=1 las llamadas se hacen de forma secuencial; con incremental=True ver
+    iterar_analisis_concurrente.
+    Devuelve {assignid: resultados_analisis} en el mismo orden que assignids.
+    """
+    assignids = list(dict.fromkeys(assignids))
+    log_evento(logging.INFO, "analisis_inicio", tareas=len(assignids))
+    from analisis_tiempos import marcar_error, tabla_vacia
+    resultados = dict(iterar_analisis_concurrente(assignids, max_workers=max_workers, chunk_size=chunk_size,
+                                                  incremental=incremental))
+    return {assignid: resultados[assignid] if assignid in resultados else marcar_error(tabla_vacia(assignid))
+            for assignid in assignids}
+
+
+# --- CACHÉ COMPARTIDA EN MEMORIA (entre sesiones de Streamlit) ---
+
+# TTL (segundos) de las entradas de la caché en memoria compartida
+TTL_MEMO_TAREAS = 30 * 60
+TTL_MEMO_ANALISIS = 10 * 60
+
+def obtener_tareas_por_cursos_memo(memo, course_ids, refrescar=False, **kwargs):
+    """
+    obtener_tareas_por_cursos a través de una CacheMemoria compartida con clave clave_memo("tareas", course_id).
+    Solo se consultan a Moodle los cursos que no están en memoria (o todos si refrescar=True);
+    no se guardan los cursos con error ni los servidos caducados del almacén (su recarga en segundo
+    plano solo actualiza el almacén: la siguiente consulta ya la encuentra ahí).
+    kwargs se pasan a obtener_tareas_por_cursos.
+    """
+    ids_unicos = list(dict.fromkeys(int(c) for c in course_ids))
+    resultados = {}
+    faltantes = []
+    for course_id in ids_unicos:
+        guardado = None if refrescar else memo.get(clave_memo("tareas", course_id))
+        if guardado is None:
+            faltantes.append(course_id)
+        else:
+            resultados[course_id] = guardado
+
+    if faltantes:
+        caducados = []
+        por_curso = obtener_tareas_por_cursos(faltantes, caducados=caducados, **kwargs)
+        caducados = set(caducados)
+        for course_id, tareas in por_curso.items():
+            resultados[course_id] = tareas
+            if tareas is not None and course_id not in caducados:
+                memo.set(clave_memo("tareas", course_id), tareas, ttl=TTL_MEMO_TAREAS)
+    return {course_id: resultados.get(course_id) for course_id in ids_unicos}
+
+
+def iterar_analisis_memo(memo, assignids, refrescar=False, **kwargs):
+    """
+    iterar_analisis_concurrente a través de una CacheMemoria compartida con clave clave_memo("analisis", assignid).
+    Primero produce las tareas ya analizadas en memoria y después las que se calculan con el
+    motor concurrente. No se guardan las tablas vacías (sin datos), las que tienen error ni las
+    servidas caducadas del almacén (ver obtener_tareas_por_cursos_memo).
+    """
+    from analisis_tiempos import es_error
+    faltantes = []
+    for assignid in dict.fromkeys(assignids):
+        guardado = None if refrescar else memo.get(clave_memo("analisis", assignid))
+        if guardado is None:
+            faltantes.append(assignid)
+        else:
+            yield assignid, guardado
+
+    caducados, obsoletas = [], None
+    for assignid, resultados in iterar_analisis_concurrente(faltantes, caducados=caducados, **kwargs):
+        if obsoletas is None:
+            obsoletas = set(caducados) # Completa antes de que el motor produzca la primera tarea
+        if not resultados.empty and not es_error(resultados) and assignid not in obsoletas:
+            memo.set(clave_memo("analisis", assignid), resultados, ttl=TTL_MEMO_ANALISIS)
+        yield assignid, resultados
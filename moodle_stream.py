@@ -0,0 +1,199 @@
+# moodle_stream.py
+# Parseo incremental de las respuestas de mod_assign_get_submissions / mod_assign_get_grades,
+# extrayendo solo los campos que usa el análisis en registros compactos (RegistrosColumnares), y
+# de mod_assign_get_assignments, quedándose solo con los campos de cada tarea que usa la app.
+#
+# Con ijson instalado (pip install ijson, mejor con el backend yajl2_c) el documento se lee por
+# eventos directamente del socket y nunca se materializa entero. Sin ijson se decodifica con json
+# y se proyecta al momento: el pico es el mismo que antes pero lo que queda en memoria es compacto.
+import json
+import sys
+from array import array
+
+try:
+    import ijson
+except ImportError: # Dependencia opcional
+    ijson = None
+
+# Campos (y su orden en cada tupla) que el análisis lee de cada envío y de cada calificación
+CAMPOS_SUBMISION = ("userid", "status", "timemodified")
+CAMPOS_CALIFICACION = ("userid", "grade", "timemodified")
+# Campos de cada tarea de mod_assign_get_assignments que usa moodle_services._formatear_tarea
+CAMPOS_TAREA = ("id", "cmid", "name", "duedate", "allowsubmissionsfromdate", "gradingduedate", "cutoffdate")
+
+# Claves de primer nivel de un payload de excepción de Moodle
+_CLAVES_EXCEPCION = ("exception", "errorcode", "message", "debuginfo")
+
+# Campos que siempre son enteros en Moodle: se guardan en array('q') (8 bytes por valor, sin objetos)
+CAMPOS_ENTEROS = frozenset(("userid", "timemodified", "timecreated", "attemptnumber"))
+# Campos de pocos valores distintos: se internan para que todos los registros compartan el mismo str
+CAMPOS_INTERNADOS = frozenset(("status",))
+
+
+class RegistrosColumnares:
+    """
+    Registros de una tarea guardados como columnas paralelas (una por campo) en lugar de un
+    objeto por registro: los enteros van en array('q') y el resto en listas. Para N registros
+    son len(campos) contenedores, no N dicts/tuplas. Iterar devuelve tuplas en el orden de
+    `campos`, así que sustituye a una lista de tuplas donde solo se recorra o se cuente.
+    """
+    __slots__ = ("campos", "columnas", "_internados")
+
+    def __init__(self, campos, columnas=None):
+        self.campos = tuple(campos)
+        if columnas is None:
+            columnas = [array("q") if c in CAMPOS_ENTEROS else [] for c in self.campos]
+        self.columnas = columnas
+        self._internados = tuple(c in CAMPOS_INTERNADOS for c in self.campos)
+
+    def agregar(self, valores):
+        for i, valor in enumerate(valores):
+            if self._internados[i] and type(valor) is str:
+                valor = sys.intern(valor)
+            try:
+                self.columnas[i].append(valor)
+            except TypeError: # Un entero ausente (None) o no entero: la columna pasa a lista
+                self.columnas[i] = list(self.columnas[i])
+                self.columnas[i].append(valor)
+
+    def __len__(self):
+        return len(self.columnas[0]) if self.columnas else 0
+
+    def __iter__(self):
+        return zip(*self.columnas)
+
+    def como_dict(self):
+        """{campo: columna}, listo para pd.DataFrame(...) sin copiar registro a registro."""
+        return dict(zip(self.campos, self.columnas))
+
+    def a_json(self):
+        return {"campos": list(self.campos), "columnas": [list(c) for c in self.columnas]}
+
+    @classmethod
+    def desde_json(cls, datos):
+        registros = cls(datos["campos"])
+        for i, columna in enumerate(datos["columnas"]):
+            try:
+                registros.columnas[i].extend(sys.intern(v) if registros._internados[i] and type(v) is str else v
+                                             for v in columna)
+            except TypeError:
+                registros.columnas[i] = list(columna)
+        return registros
+
+
+def _extraer_ijson(fuente, clave_lista, campos):
+    prefijo_tarea = "assignments.item"
+    prefijo_registro = f"{prefijo_tarea}.{clave_lista}.item"
+    indice_campo = {f"{prefijo_registro}.{campo}": i for i, campo in enumerate(campos)}
+    tareas, excepcion = [], {}
+    tarea = registro = None
+    vacio = [None] * len(campos)
+
+    for prefijo, evento, valor in ijson.parse(fuente, buf_size=64 * 1024, use_float=True):
+        i = indice_campo.get(prefijo)
+        if i is not None:
+            if registro is not None and evento not in ("start_map", "start_array"):
+                registro[i] = valor
+        elif prefijo == prefijo_registro:
+            if evento == "start_map":
+                registro = list(vacio)
+            elif evento == "end_map":
+                tarea[clave_lista].agregar(registro)
+                registro = None
+        elif prefijo == prefijo_tarea and evento == "start_map":
+            tarea = {"assignmentid": None, clave_lista: RegistrosColumnares(campos)}
+            tareas.append(tarea)
+        elif prefijo == f"{prefijo_tarea}.assignmentid":
+            tarea["assignmentid"] = valor
+        elif prefijo in _CLAVES_EXCEPCION:
+            excepcion[prefijo] = valor
+
+    return excepcion if "exception" in excepcion else {"assignments": tareas}
+
+
+def _extraer_json(fuente, clave_lista, campos):
+    data = json.load(fuente)
+    if not isinstance(data, dict) or "exception" in data:
+        return data
+    tareas = []
+    for t in data.get("assignments", []):
+        registros = RegistrosColumnares(campos)
+        for r in t.get(clave_lista, []):
+            registros.agregar([r.get(c) for c in campos])
+        tareas.append({"assignmentid": t.get("assignmentid"), clave_lista: registros})
+    return {"assignments": tareas}
+
+
+def extraer_registros(fuente, clave_lista, campos):
+    """
+    Lee de `fuente` (objeto tipo archivo en bytes) una respuesta con la forma
+    {"assignments": [{"assignmentid": ..., clave_lista: [...]}, ...]} y devuelve la misma forma
+    con los registros de cada tarea reducidos a `campos` (None si falta) en un
+    RegistrosColumnares. Los plugins, archivos y
+    demás datos anidados se descartan sin construirlos. Si la respuesta es una excepción de
+    Moodle se devuelve su payload para que el cliente la lance.
+    """
+    if ijson is not None:
+        return _extraer_ijson(fuente, clave_lista, campos)
+    return _extraer_json(fuente, clave_lista, campos)
+
+
+def _extraer_tareas_ijson(fuente, campos):
+    prefijo_tarea = "courses.item.assignments.item"
+    campos = frozenset(campos)
+    cursos, avisos, excepcion = [], [], {}
+    tarea = None
+
+    for prefijo, evento, valor in ijson.parse(fuente, buf_size=64 * 1024, use_float=True):
+        if prefijo.startswith(prefijo_tarea):
+            if prefijo == prefijo_tarea:
+                if evento == "start_map":
+                    tarea = {}
+                    cursos[-1]["assignments"].append(tarea)
+            elif prefijo[len(prefijo_tarea) + 1:] in campos and evento not in ("start_map", "start_array"):
+                tarea[prefijo[len(prefijo_tarea) + 1:]] = valor
+        elif prefijo == "courses.item" and evento == "start_map":
+            cursos.append({"id": None, "assignments": []})
+        elif prefijo == "courses.item.id":
+            cursos[-1]["id"] = valor
+        elif prefijo == "warnings.item" and evento == "start_map":
+            avisos.append({})
+        elif prefijo.startswith("warnings.item.") and evento not in ("start_map", "start_array"):
+            avisos[-1][prefijo[len("warnings.item."):]] = valor
+        elif prefijo in _CLAVES_EXCEPCION:
+            excepcion[prefijo] = valor
+
+    return excepcion if "exception" in excepcion else {"courses": cursos, "warnings": avisos}
+
+
+def extraer_tareas(fuente, campos=CAMPOS_TAREA):
+    """
+    Lee de `fuente` una respuesta de mod_assign_get_assignments y devuelve la misma forma
+    ({"courses": [{"id", "assignments": [...]}], "warnings": [...]}) con cada tarea reducida a
+    `campos`: la descripción (intro), los configs y los adjuntos se descartan sin construirlos.
+    Si la respuesta es una excepción de Moodle se devuelve su payload.
+    """
+    if ijson is not None:
+        return _extraer_tareas_ijson(fuente, campos)
+    data = json.load(fuente)
+    if not isinstance(data, dict) or "exception" in data:
+        return data
+    return {
+        "courses": [{"id": c.get("id"), "assignments": [{k: a[k] for k in campos if k in a}
+                                                        for a in c.get("assignments", [])]}
+                    for c in data.get("courses", [])],
+        "warnings": data.get("warnings", []),
+    }
+
+
+class LectorContado:
+    """Envuelve un stream de bytes y cuenta lo leído (para la métrica bytes_recibidos)."""
+
+    def __init__(self, fuente):
+        self._fuente = fuente
+        self.bytes = 0
+
+    def read(self, n=None):
+        datos = self._fuente.read(n)
+        self.bytes += len(datos)
+        return datos
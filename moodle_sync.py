@@ -0,0 +1,104 @@
+# moodle_sync.py
+# Estado local para la sincronización incremental de submisiones y calificaciones.
+import json
+import os
+import sqlite3
+import threading
+
+from moodle_cache import CACHE_DIR_POR_DEFECTO
+from moodle_stream import RegistrosColumnares
+
+# Margen (segundos) que se resta al último sync al pedir deltas, para cubrir desfases de reloj
+# entre esta máquina y el servidor Moodle y cambios hechos durante la propia descarga.
+MARGEN_SYNC_SEGUNDOS = 300
+
+# Tipos de dato sincronizados: tipo -> tabla
+TABLAS_SYNC = {"submisiones": "submisiones", "calificaciones": "calificaciones"}
+
+
+class EstadoSincronizacion:
+    """
+    Guarda, por tarea, la última sincronización de cada tipo de dato y el último registro
+    conocido de cada usuario (la submisión o calificación cruda de Moodle). Los deltas
+    descargados con `since` se fusionan aquí; la lista completa se reconstruye desde SQLite.
+    """
+
+    def __init__(self, directorio=CACHE_DIR_POR_DEFECTO):
+        os.makedirs(directorio, exist_ok=True)
+        self.ruta = os.path.join(directorio, "sincronizacion.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.ruta, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ultimo_sync ("
+            " assignid INTEGER NOT NULL, tipo TEXT NOT NULL, ts INTEGER NOT NULL,"
+            " PRIMARY KEY (assignid, tipo))"
+        )
+        for tabla in TABLAS_SYNC.values():
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {tabla} ("
+                " assignid INTEGER NOT NULL, userid INTEGER NOT NULL, timemodified INTEGER NOT NULL,"
+                " datos TEXT NOT NULL, PRIMARY KEY (assignid, userid))"
+            )
+        self._conn.commit()
+
+    def ultimo_sync(self, tipo, assignid):
+        """Timestamp del último sync de `tipo` para la tarea, o 0 si nunca se sincronizó."""
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT ts FROM ultimo_sync WHERE assignid = ? AND tipo = ?", (assignid, tipo)
+            ).fetchone()
+        return fila[0] if fila else 0
+
+    def fusionar(self, tipo, assignid, registros, ts_sync):
+        """
+        Fusiona un delta de registros crudos (con 'userid' y 'timemodified') en el estado de la tarea.
+        Por usuario se conserva el registro más reciente. Después se marca `ts_sync` como último sync.
+        """
+        tabla = TABLAS_SYNC[tipo]
+        filas = [
+            (assignid, r["userid"], r.get("timemodified") or 0, json.dumps(r, separators=(",", ":")))
+            for r in registros if r.get("userid")
+        ]
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT INTO {tabla} (assignid, userid, timemodified, datos) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (assignid, userid) DO UPDATE SET timemodified = excluded.timemodified,"
+                " datos = excluded.datos WHERE excluded.timemodified >= timemodified",
+                filas,
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ultimo_sync (assignid, tipo, ts) VALUES (?, ?, ?)",
+                (assignid, tipo, int(ts_sync)),
+            )
+            self._conn.commit()
+
+    def registros(self, tipo, assignid, campos=None):
+        """
+        Lista de registros crudos fusionados de la tarea, igual que la devolvería Moodle sin `since`.
+        Con `campos`, un RegistrosColumnares con solo esos campos, extraídos en SQLite con
+        json_extract (no se decodifica ningún registro completo en Python).
+        """
+        if campos:
+            columnas = ", ".join(f"json_extract(datos, '$.{campo}')" for campo in campos)
+            registros = RegistrosColumnares(campos)
+            with self._lock:
+                for fila in self._conn.execute(
+                        f"SELECT {columnas} FROM {TABLAS_SYNC[tipo]} WHERE assignid = ? ORDER BY userid", (assignid,)):
+                    registros.agregar(fila)
+            return registros
+        with self._lock:
+            filas = self._conn.execute(
+                f"SELECT datos FROM {TABLAS_SYNC[tipo]} WHERE assignid = ? ORDER BY userid", (assignid,)
+            ).fetchall()
+        return [json.loads(datos) for (datos,) in filas]
+
+    def olvidar(self, assignid=None):
+        """Borra el estado de una tarea (o de todas) para forzar una descarga completa en el próximo sync."""
+        with self._lock:
+            for tabla in ("ultimo_sync", *TABLAS_SYNC.values()):
+                if assignid is None:
+                    self._conn.execute(f"DELETE FROM {tabla}")
+                else:
+                    self._conn.execute(f"DELETE FROM {tabla} WHERE assignid = ?", (assignid,))
+            self._conn.commit()
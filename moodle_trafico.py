@@ -0,0 +1,224 @@
+# moodle_trafico.py
+# Control del tráfico hacia Moodle: límite de tasa (token bucket), concurrencia adaptativa (AIMD)
+# y circuit breaker. Lo usa MoodleClient en cada intento HTTP.
+import threading
+import time
+from collections import deque
+
+import requests
+
+# Límites por defecto de ControlTrafico (peticiones/segundo y llamadas simultáneas de un proceso)
+TASA_INICIAL = 20.0
+TASA_MIN = 1.0
+TASA_MAX = 200.0
+CONCURRENCIA_INICIAL = 4
+MAX_CONCURRENCIA = 10
+
+# Respuestas que indican que Moodle (o su front end) está saturado: reducir el ritmo
+CODIGOS_SOBRECARGA = {429, 502, 503, 504}
+
+
+class CircuitoAbiertoError(requests.exceptions.RequestException):
+    """El circuit breaker está abierto: Moodle falló repetidamente y no se le envían llamadas."""
+
+
+class CuboTokens:
+    """Token bucket: como máximo `tasa` peticiones/segundo de media, con ráfagas de hasta `capacidad`."""
+
+    def __init__(self, tasa, capacidad=None):
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad if capacidad is not None else max(1.0, tasa))
+        self._tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reponer(self, ahora):
+        self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    def adquirir(self):
+        """Bloquea hasta que haya un token disponible y lo consume."""
+        while True:
+            with self._lock:
+                self._reponer(time.monotonic())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.tasa
+            time.sleep(espera)
+
+
+class Interruptor:
+    """
+    Circuit breaker. Tras `umbral_fallos` fallos consecutivos se abre y rechaza las llamadas
+    durante `espera_s`; después deja pasar una sola llamada de prueba (semiabierto): si sale
+    bien se cierra, si falla se vuelve a abrir.
+    """
+
+    def __init__(self, umbral_fallos=5, espera_s=30.0):
+        self.umbral_fallos = umbral_fallos
+        self.espera_s = espera_s
+        self.estado = "cerrado"
+        self._fallos = 0
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        with self._lock:
+            if self.estado == "cerrado":
+                return True
+            if self.estado == "abierto" and time.monotonic() - self._abierto_desde >= self.espera_s:
+                self.estado = "semiabierto"
+            if self.estado == "semiabierto" and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return True
+            return False
+
+    def registrar(self, exito):
+        with self._lock:
+            self._prueba_en_curso = False
+            if exito:
+                self._fallos = 0
+                self.estado = "cerrado"
+                return
+            self._fallos += 1
+            if self.estado == "semiabierto" or self._fallos >= self.umbral_fallos:
+                self.estado = "abierto"
+                self._abierto_desde = time.monotonic()
+
+
+class _Latencias:
+    """
+    Latencia habitual (EWMA lenta de las respuestas sanas) y reciente (la menor de las últimas
+    MUESTRAS_RECIENTES) de una clase de llamada. Se usa la menor porque una respuesta suelta
+    lenta (p. ej. coincidió con una llamada grande en el servidor) no es congestión; que
+    hasta la más rápida de las últimas sea lenta, sí.
+    """
+    __slots__ = ("base", "ultimas", "muestras")
+
+    MUESTRAS_RECIENTES = 8
+
+    def __init__(self, latencia):
+        self.base = latencia
+        self.ultimas = deque(maxlen=self.MUESTRAS_RECIENTES)
+        self.muestras = 0
+
+    @property
+    def reciente(self):
+        return min(self.ultimas)
+
+    def observar(self, latencia, factor_latencia):
+        """Registra una latencia; True si la reciente supera factor_latencia veces la habitual."""
+        self.ultimas.append(latencia)
+        alta = self.muestras >= 20 and self.reciente > factor_latencia * self.base
+        if not alta: # La línea base solo aprende de respuestas normales
+            self.base = 0.98 * self.base + 0.02 * latencia
+        self.muestras += 1
+        return alta
+
+
+class ControlTrafico:
+    """
+    Regula las llamadas a Moodle sin ajuste manual:
+      - CuboTokens con tasa adaptativa entre tasa_min y tasa_max.
+      - Límite de llamadas simultáneas adaptativo entre 1 y max_concurrencia.
+      - Interruptor (circuit breaker) que falla rápido mientras Moodle no responde.
+    Ajuste AIMD: cada respuesta sana sube la tasa y la concurrencia poco a poco (aditivo); una
+    respuesta de sobrecarga (429/5xx), un error de red o una latencia muy por encima de la
+    habitual las multiplica por `factor_reduccion`. La latencia habitual se aprende por clase de
+    llamada (la wsfunction): una llamada con 50 tareas es lenta por naturaleza frente a una
+    página de participantes, y compararlas con una sola línea base confundiría tamaño con
+    congestión.
+    """
+
+    def __init__(self, tasa_inicial=TASA_INICIAL, tasa_min=TASA_MIN, tasa_max=TASA_MAX,
+                 concurrencia_inicial=CONCURRENCIA_INICIAL, max_concurrencia=MAX_CONCURRENCIA,
+                 factor_reduccion=0.7, factor_latencia=2.5, interruptor=None):
+        self.cubo = CuboTokens(tasa_inicial)
+        self.tasa_min, self.tasa_max = tasa_min, tasa_max
+        self.max_concurrencia = max_concurrencia
+        self.limite = float(min(concurrencia_inicial, max_concurrencia))
+        self.factor_reduccion = factor_reduccion
+        self.factor_latencia = factor_latencia
+        self.interruptor = interruptor or Interruptor()
+        self._en_curso = 0
+        self._cond = threading.Condition()
+        self._latencias = {} # clase de llamada -> _Latencias
+        self._ultima_reduccion = 0.0
+        self.reducciones = 0
+
+    @classmethod
+    def repartido(cls, partes, **kwargs):
+        """
+        ControlTrafico con 1/`partes` de los límites por defecto: para `partes` procesos que
+        llaman al mismo Moodle, de modo que juntos no superen la tasa ni la concurrencia de uno
+        (y, tras reducir, juntos no bajen de TASA_MIN). `partes` no puede superar MAX_CONCURRENCIA:
+        cada proceso necesita al menos una petición simultánea.
+        """
+        if not 1 <= partes <= MAX_CONCURRENCIA:
+            raise ValueError(f"partes debe estar entre 1 y {MAX_CONCURRENCIA}, no {partes}")
+        return cls(tasa_inicial=TASA_INICIAL / partes, tasa_min=TASA_MIN / partes, tasa_max=TASA_MAX / partes,
+                   concurrencia_inicial=max(1, CONCURRENCIA_INICIAL // partes),
+                   max_concurrencia=max(1, MAX_CONCURRENCIA // partes), **kwargs)
+
+    def adquirir(self):
+        """
+        Espera turno (token + hueco de concurrencia) para un intento HTTP. Lanza
+        CircuitoAbiertoError sin esperar si el circuito está abierto. Devuelve el instante de
+        inicio, que se pasa a liberar().
+        """
+        if not self.interruptor.permitir():
+            raise CircuitoAbiertoError("Moodle no responde: circuito abierto, se reintentará más tarde")
+        self.cubo.adquirir()
+        with self._cond:
+            while self._en_curso >= int(self.limite):
+                self._cond.wait()
+            self._en_curso += 1
+        return time.monotonic()
+
+    def liberar(self, inicio, status=None, error_red=False, clase=None):
+        """
+        Registra el resultado del intento (status HTTP o error de red) y ajusta los límites.
+        `clase` (la wsfunction) elige la línea base de latencia con la que se compara.
+        """
+        latencia = time.monotonic() - inicio
+        sobrecarga = error_red or status in CODIGOS_SOBRECARGA
+        fallo = sobrecarga or (status is not None and status >= 500)
+        self.interruptor.registrar(not fallo)
+        with self._cond:
+            self._en_curso -= 1
+            latencias = self._latencias.get(clase)
+            if latencias is None:
+                latencias = self._latencias[clase] = _Latencias(latencia)
+            if fallo or latencias.observar(latencia, self.factor_latencia):
+                self._reducir(latencias.reciente)
+            else:
+                self._aumentar()
+            self._cond.notify_all()
+
+    def _reducir(self, ventana):
+        # Una reducción por ventana de latencia: las respuestas de una misma ráfaga no se acumulan
+        ahora = time.monotonic()
+        if ahora - self._ultima_reduccion < ventana:
+            return
+        self._ultima_reduccion = ahora
+        self.reducciones += 1
+        self.limite = max(1.0, self.limite * self.factor_reduccion)
+        self.cubo.tasa = max(self.tasa_min, self.cubo.tasa * self.factor_reduccion)
+
+    def _aumentar(self):
+        self.limite = min(float(self.max_concurrencia), self.limite + 1.0 / self.limite)
+        self.cubo.tasa = min(self.tasa_max, self.cubo.tasa + 1.0)
+
+    def estado(self):
+        with self._cond:
+            return {
+                "circuito": self.interruptor.estado,
+                "limite_concurrencia": round(self.limite, 2),
+                "en_curso": self._en_curso,
+                "tasa_por_s": round(self.cubo.tasa, 2),
+                "reducciones": self.reducciones,
+                "latencias_s": {clase: {"base": round(l.base, 4), "reciente": round(l.reciente, 4)}
+                                for clase, l in self._latencias.items()},
+            }
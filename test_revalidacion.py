@@ -0,0 +1,67 @@
+# test_revalidacion.py
+# Stale-while-revalidate (modo de caché "obsoleto") a través de la caché en memoria compartida,
+# contra el servidor Moodle falso.
+import time
+
+import pytest
+
+import moodle_services
+from fake_moodle_server import ConfigFalsa, ServidorMoodleFalso
+from moodle_cache import AlmacenLocal, CacheMemoria, modo_cache
+
+ASSIGNIDS = [101, 102, 103]
+CURSOS = [1, 2]
+
+
+@pytest.fixture
+def servidor(tmp_path):
+    srv = ServidorMoodleFalso(ConfigFalsa(participantes=20)).iniciar()
+    moodle_services.configurar(url_base=srv.url, token="x", cache=None)
+    moodle_services.configurar_almacen(AlmacenLocal(str(tmp_path), ttls={"tareas": 0.2, "analisis": 0.2}))
+    yield srv
+    srv.detener()
+    moodle_services.configurar_almacen(None)
+    moodle_services.configurar()
+
+
+def _esperar_revalidaciones():
+    limite = time.time() + 10
+    while moodle_services.get_revalidador().pendientes() and time.time() < limite:
+        time.sleep(0.02)
+    assert not moodle_services.get_revalidador().pendientes()
+
+
+def test_analisis_revalidado_llega_a_la_segunda_consulta(servidor):
+    with modo_cache("usar"):
+        moodle_services.analizar_tiempos_calificacion_tareas(ASSIGNIDS)
+    time.sleep(0.3) # Las entradas del almacén caducan
+    servidor.config.semilla += 1 # Moodle cambia: los mismos ids traen otros datos
+    with modo_cache("omitir"):
+        nuevos = moodle_services.analizar_tiempos_calificacion_tareas(ASSIGNIDS)
+
+    memo = CacheMemoria()
+    with modo_cache("obsoleto"):
+        primera = dict(moodle_services.iterar_analisis_memo(memo, ASSIGNIDS))
+        _esperar_revalidaciones()
+        segunda = dict(moodle_services.iterar_analisis_memo(memo, ASSIGNIDS))
+
+    assert not all(primera[a].equals(nuevos[a]) for a in ASSIGNIDS) # Se sirvió lo caducado
+    assert all(segunda[a].equals(nuevos[a]) for a in ASSIGNIDS)
+
+
+def test_tareas_revalidadas_llegan_a_la_segunda_consulta(servidor):
+    with modo_cache("usar"):
+        moodle_services.obtener_tareas_por_cursos(CURSOS)
+    time.sleep(0.3)
+    servidor.config.semilla += 1
+    with modo_cache("omitir"):
+        nuevas = moodle_services.obtener_tareas_por_cursos(CURSOS)
+
+    memo = CacheMemoria()
+    with modo_cache("obsoleto"):
+        primera = moodle_services.obtener_tareas_por_cursos_memo(memo, CURSOS)
+        _esperar_revalidaciones()
+        segunda = moodle_services.obtener_tareas_por_cursos_memo(memo, CURSOS)
+
+    assert primera != nuevas
+    assert segunda == nuevas
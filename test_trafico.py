@@ -0,0 +1,46 @@
+# test_trafico.py
+# Control de tráfico (moodle_trafico.ControlTrafico) contra el servidor Moodle falso.
+import pytest
+
+import moodle_services
+from fake_moodle_server import ConfigFalsa, ServidorMoodleFalso
+from moodle_cache import modo_cache
+from moodle_trafico import ControlTrafico
+
+
+@pytest.fixture
+def servidor():
+    srv = ServidorMoodleFalso(ConfigFalsa(participantes=300)).iniciar()
+    yield srv
+    srv.detener()
+    moodle_services.configurar()
+
+
+def _configurar(servidor, **kwargs):
+    trafico = ControlTrafico(**kwargs)
+    moodle_services.configurar(url_base=servidor.url, token="x", cache=None, trafico=trafico)
+    return trafico
+
+
+def test_llamadas_de_distinto_tamano_no_reducen_los_limites(servidor):
+    # Submisiones y calificaciones de 50 tareas por llamada junto a una llamada de participantes
+    # por tarea: las grandes son mucho más lentas, pero el servidor está sano
+    trafico = _configurar(servidor, tasa_inicial=200.0, concurrencia_inicial=10)
+    with modo_cache("omitir"):
+        moodle_services.analizar_tiempos_calificacion_tareas(list(range(1, 401)), chunk_size=50)
+
+    assert trafico.reducciones == 0
+    assert trafico.cubo.tasa == trafico.tasa_max
+    assert trafico.limite == trafico.max_concurrencia
+
+
+def test_una_ralentizacion_real_reduce_los_limites(servidor):
+    trafico = _configurar(servidor, tasa_inicial=200.0, concurrencia_inicial=10)
+    with modo_cache("omitir"):
+        moodle_services.analizar_tiempos_calificacion_tareas(list(range(1, 41)), max_workers=4)
+        assert trafico.reducciones == 0
+        servidor.config.latencia_ms = 300 # Moodle se satura: todas las respuestas tardan más
+        moodle_services.analizar_tiempos_calificacion_tareas(list(range(41, 81)), max_workers=4)
+
+    assert trafico.reducciones > 0
+    assert trafico.cubo.tasa < trafico.tasa_max